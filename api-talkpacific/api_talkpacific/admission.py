@@ -0,0 +1,220 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Deque, Iterator, Optional
+
+from .metrics import (
+    ADMISSION_ACTIVE,
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REJECTED,
+    ADMISSION_WAIT_SECONDS,
+)
+
+QUEUE_FULL = "queue_full"
+QUEUE_TIMEOUT = "queue_timeout"
+
+
+class Overloaded(Exception):
+    """
+    A call was turned away by an admission controller. A full queue answers
+    429 and a wait past the deadline 503, both retried after
+    retry_after_seconds.
+    """
+
+    def __init__(self, controller: str, reason: str, retry_after_seconds: int):
+        super().__init__(f"{controller} overloaded: {reason}")
+        self.controller = controller
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+    @property
+    def status_code(self) -> int:
+        return 429 if self.reason == QUEUE_FULL else 503
+
+
+class _Waiter:
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.admitted = False
+
+
+class Permit:
+    """
+    Held by an admitted call until it releases it, releasing twice is a no-op.
+    """
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """
+    Bounds the calls in flight to an upstream.
+
+    Up to max_concurrency calls run at once and up to max_queue more wait, in
+    arrival order, for at most queue_timeout_seconds. Anything beyond fails
+    fast with Overloaded instead of piling onto the upstream's rate limits. A
+    released permit goes straight to the oldest waiter, so waiters are never
+    overtaken by new calls.
+
+    Calls are admitted from the event loop with admit and from worker threads
+    with admit_sync, sharing the same limits.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int = 0,
+        queue_timeout_seconds: float = 1.0,
+        retry_after_seconds: int = 1,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.active = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_env(
+        name: str,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout_ms: float,
+    ) -> Optional["AdmissionController"]:
+        """
+        The controller configured by the <NAME>_MAX_CONCURRENCY, _MAX_QUEUE,
+        _QUEUE_TIMEOUT_MS and _RETRY_AFTER_SECONDS variables, the arguments
+        being their defaults. None when the max concurrency is 0.
+        """
+        prefix = name.upper()
+        max_concurrency = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", max_concurrency))
+        if max_concurrency <= 0:
+            return None
+        return AdmissionController(
+            name,
+            max_concurrency,
+            max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", max_queue)),
+            queue_timeout_seconds=float(
+                os.getenv(f"{prefix}_QUEUE_TIMEOUT_MS", queue_timeout_ms)
+            )
+            / 1000,
+            retry_after_seconds=int(os.getenv(f"{prefix}_RETRY_AFTER_SECONDS", 1)),
+        )
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def admit(self) -> Permit:
+        """
+        A permit once the call is admitted, raises Overloaded when it is not.
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+        waiter = self._enter(lambda: loop.call_soon_threadsafe(_resolve, admitted))
+        if waiter:
+            try:
+                await asyncio.wait_for(admitted, self.queue_timeout_seconds)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    raise self._reject(QUEUE_TIMEOUT)
+            except asyncio.CancelledError:
+                if not self._abandon(waiter):
+                    self._release()
+                raise
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, self.name)
+        return Permit(self)
+
+    def admit_sync(self) -> Permit:
+        """
+        admit for worker threads, blocking while the call waits.
+        """
+        started = time.perf_counter()
+        admitted = threading.Event()
+        waiter = self._enter(admitted.set)
+        if waiter and not admitted.wait(self.queue_timeout_seconds):
+            if self._abandon(waiter):
+                raise self._reject(QUEUE_TIMEOUT)
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, self.name)
+        return Permit(self)
+
+    @asynccontextmanager
+    async def limit(self) -> AsyncIterator[None]:
+        permit = await self.admit()
+        try:
+            yield
+        finally:
+            permit.release()
+
+    @contextmanager
+    def limit_sync(self) -> Iterator[None]:
+        permit = self.admit_sync()
+        try:
+            yield
+        finally:
+            permit.release()
+
+    def _enter(self, wake: Callable[[], None]) -> Optional[_Waiter]:
+        """
+        None when the call is admitted at once, otherwise its place in the
+        queue, woken once a permit is handed to it.
+        """
+        with self._lock:
+            if self.active < self.max_concurrency and not self._waiters:
+                self.active += 1
+                self._update_gauges()
+                return None
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject(QUEUE_FULL)
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            self._update_gauges()
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """
+        Leave the queue, False when a permit was handed over in the meantime.
+        """
+        with self._lock:
+            if waiter.admitted:
+                return False
+            self._waiters.remove(waiter)
+            self._update_gauges()
+            return True
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.admitted = True
+                waiter.wake()
+            else:
+                self.active -= 1
+            self._update_gauges()
+
+    def _reject(self, reason: str) -> Overloaded:
+        ADMISSION_REJECTED.inc(self.name, reason)
+        return Overloaded(self.name, reason, self.retry_after_seconds)
+
+    def _update_gauges(self) -> None:
+        ADMISSION_ACTIVE.set(self.name, value=self.active)
+        ADMISSION_QUEUE_DEPTH.set(self.name, value=len(self._waiters))
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
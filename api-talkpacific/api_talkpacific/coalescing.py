@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, List
+
+from .models import ChatResponseChunk
+
+_END = object()
+_TIMEOUT = object()
+
+
+class _Failure:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class DeltaCoalescer:
+    """
+    Merges the per-token chunks of a response stream into fewer SSE frames.
+
+    Deltas are held until they add up to max_bytes, the oldest has waited
+    max_delay_seconds or a chunk closes a sentence, then sent as one chunk
+    carrying every delta, closed sentence and detection in between. The
+    final chunk is always sent on its own. max_bytes 0 sends every chunk as
+    it comes.
+
+    The upstream stream is pumped into a queue by its own task, so the time
+    budget holds while the model is between tokens.
+    """
+
+    def __init__(self, max_bytes: int = 64, max_delay_seconds: float = 0.03):
+        self.max_bytes = max_bytes
+        self.max_delay_seconds = max_delay_seconds
+        self.chunks = 0
+        self.frames = 0
+
+    @staticmethod
+    def from_env(max_bytes: int = None) -> "DeltaCoalescer":
+        """
+        Coalescing configured by the environment, max_bytes overriding it for
+        one request.
+        """
+        if max_bytes is None:
+            max_bytes = int(os.getenv("SSE_COALESCE_BYTES", 64))
+        return DeltaCoalescer(
+            max_bytes=max_bytes,
+            max_delay_seconds=float(os.getenv("SSE_COALESCE_MS", 30)) / 1000,
+        )
+
+    @property
+    def saved(self) -> int:
+        """
+        Frames not sent thanks to coalescing.
+        """
+        return self.chunks - self.frames
+
+    def coalesce(
+        self, stream: AsyncIterator[ChatResponseChunk]
+    ) -> AsyncIterator[ChatResponseChunk]:
+        if self.max_bytes <= 0:
+            return self._per_token(stream)
+        return self._coalesce(stream)
+
+    async def _per_token(
+        self, stream: AsyncIterator[ChatResponseChunk]
+    ) -> AsyncIterator[ChatResponseChunk]:
+        try:
+            async for chunk in stream:
+                self.chunks += 1
+                self.frames += 1
+                yield chunk
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+    async def _coalesce(
+        self, stream: AsyncIterator[ChatResponseChunk]
+    ) -> AsyncIterator[ChatResponseChunk]:
+        queue: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.create_task(self._pump(stream, queue))
+        pending: List[ChatResponseChunk] = []
+        pending_bytes = 0
+        deadline = 0.0
+        try:
+            while True:
+                item = await self._next(queue, deadline if pending else None)
+                if item is _TIMEOUT:
+                    yield self._merge(pending)
+                    pending, pending_bytes = [], 0
+                    continue
+                if item is _END:
+                    break
+                self.chunks += 1
+                if not isinstance(item, ChatResponseChunk) or item.is_finished:
+                    if pending:
+                        yield self._merge(pending)
+                        pending, pending_bytes = [], 0
+                    self.frames += 1
+                    yield item
+                    continue
+
+                if not pending:
+                    deadline = time.monotonic() + self.max_delay_seconds
+                pending.append(item)
+                pending_bytes += len(item.delta.encode("utf-8"))
+                if pending_bytes >= self.max_bytes or item.sentence_indices:
+                    yield self._merge(pending)
+                    pending, pending_bytes = [], 0
+
+            if pending:
+                yield self._merge(pending)
+        finally:
+            pump.cancel()
+
+    @staticmethod
+    async def _next(queue: asyncio.Queue, deadline: float = None):
+        """
+        The next item of the pump, or _TIMEOUT once deadline has passed.
+        """
+        try:
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            if deadline is None:
+                item = await queue.get()
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return _TIMEOUT
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    return _TIMEOUT
+        if isinstance(item, _Failure):
+            raise item.error
+        return item
+
+    @staticmethod
+    async def _pump(stream: AsyncIterator[ChatResponseChunk], queue: asyncio.Queue):
+        try:
+            async for chunk in stream:
+                queue.put_nowait(chunk)
+            queue.put_nowait(_END)
+        except Exception as e:
+            queue.put_nowait(_Failure(e))
+
+    def _merge(self, chunks: List[ChatResponseChunk]) -> ChatResponseChunk:
+        self.frames += 1
+        if len(chunks) == 1:
+            return chunks[0]
+        first = chunks[0]
+        merged = ChatResponseChunk.model_construct(
+            conversation_id=first.conversation_id,
+            content_id=first.content_id,
+            delta="".join(chunk.delta for chunk in chunks),
+            is_finished=False,
+        )
+        sentence_indices = [
+            indices for chunk in chunks if chunk.sentence_indices
+            for indices in chunk.sentence_indices
+        ]
+        if sentence_indices:
+            merged.sentence_indices = sentence_indices
+        sentence_learning_phrases = [
+            phrases for chunk in chunks if chunk.sentence_learning_phrases
+            for phrases in chunk.sentence_learning_phrases
+        ]
+        if sentence_learning_phrases:
+            merged.sentence_learning_phrases = sentence_learning_phrases
+        return merged
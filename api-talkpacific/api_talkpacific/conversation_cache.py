@@ -0,0 +1,250 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .teacher_db import ConversationMemory, ConversationMessage
+
+# Rough per-message overhead of the python objects, on top of the text itself.
+MESSAGE_OVERHEAD_BYTES = 256
+
+
+class ConversationCache:
+    """
+    In-process LRU cache of ConversationMemory keyed by conversation id.
+
+    TeacherDB writes through it, so a cached conversation always reflects this
+    process's own writes. Writes from other processes are only picked up once
+    an entry expires, which ttl_seconds bounds. Memory is bounded by both
+    max_entries and an estimate of the cached bytes.
+
+    Every write moves the conversation to a new generation. A read that missed
+    the cache takes the generation before querying Mongo and only fills the
+    cache when no write happened since, a write in between would be missing
+    from its snapshot for the whole TTL otherwise.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 << 20,
+        ttl_seconds: float = 600,
+        enabled: bool = True,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._entries: OrderedDict[str, Tuple["ConversationMemory", float, int]] = (
+            OrderedDict()
+        )
+        # Generation of the most recently written conversations, those
+        # forgotten count as written at the last generation dropped.
+        self._generation = 0
+        self._written: OrderedDict[str, int] = OrderedDict()
+        self._forgotten = 0
+        # TeacherDB calls arrive from worker threads, see AsyncTeacherDB.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_env() -> "ConversationCache":
+        return ConversationCache(
+            max_entries=int(os.getenv("CONVERSATION_CACHE_MAX_ENTRIES", 1024)),
+            max_bytes=int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", 64 << 20)),
+            ttl_seconds=float(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", 600)),
+            enabled=os.getenv("CONVERSATION_CACHE_ENABLED", "true").lower() == "true",
+        )
+
+    def get(self, conversation_id: str) -> Optional["ConversationMemory"]:
+        """
+        A copy of the cached conversation, safe for the caller to modify.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            memory = self._peek(conversation_id)
+            if memory is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(conversation_id)
+            return memory.model_copy(update={"messages": list(memory.messages)})
+
+    def peek(self, conversation_id: str) -> Optional["ConversationMemory"]:
+        """
+        The cached conversation, read-only, without counting a hit or a miss.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._peek(conversation_id)
+
+    def generation(self) -> int:
+        """
+        Taken before reading a conversation to fill the cache with, see put.
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, memory: "ConversationMemory", generation: int = None) -> None:
+        """
+        Cache memory, unless it was read at a generation the conversation has
+        been written after since.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            conversation_id = memory.conversation_id
+            written = self._written.get(conversation_id, self._forgotten)
+            if generation is not None and written > generation:
+                logging.info(f"stale conversation not cached: {conversation_id=}")
+                return
+            self._store(
+                memory.model_copy(update={"messages": list(memory.messages)}),
+                expires_at=time.monotonic() + self.ttl_seconds,
+            )
+
+    def append_message(self, message: "ConversationMessage") -> None:
+        with self._lock:
+            self._mark_written(message.conversation_id)
+            memory = self._peek(message.conversation_id)
+            if memory is None:
+                return
+            if memory.messages and memory.messages[-1].position >= message.position:
+                # Out of order with what is cached, reload on the next read.
+                self._remove(message.conversation_id)
+                return
+            size = self._entries[message.conversation_id][2]
+            memory.messages.append(message)
+            self._store(memory, size=size + self._message_size(message))
+
+    def truncate(self, conversation_id: str, position: int) -> None:
+        """
+        Drop cached messages at or after position, and the summary if it
+        covers any of them.
+        """
+        with self._lock:
+            self._mark_written(conversation_id)
+            memory = self._peek(conversation_id)
+            if memory is None:
+                return
+            memory.messages = [m for m in memory.messages if m.position < position]
+            if memory.summary_position >= position:
+                memory.summary = None
+                memory.summary_position = -1
+            self._store(memory)
+
+    def update(self, conversation_id: str, **fields) -> None:
+        """
+        Set conversation level fields, such as the summary, of a cached entry.
+        """
+        with self._lock:
+            self._mark_written(conversation_id)
+            memory = self._peek(conversation_id)
+            if memory is None:
+                return
+            self._store(memory.model_copy(update=fields))
+
+    def replace_message(self, message: "ConversationMessage") -> None:
+        with self._lock:
+            self._mark_written(message.conversation_id)
+            memory = self._peek(message.conversation_id)
+            if memory is None:
+                return
+            memory.messages = [
+                message if m.position == message.position else m
+                for m in memory.messages
+            ]
+            if memory.summary_position >= message.position:
+                memory.summary = None
+                memory.summary_position = -1
+            self._store(memory)
+
+    def evict(self, conversation_id: str) -> None:
+        with self._lock:
+            self._mark_written(conversation_id)
+            self._remove(conversation_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _peek(self, conversation_id: str) -> Optional["ConversationMemory"]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        memory, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(conversation_id)
+            return None
+        return memory
+
+    def _store(
+        self,
+        memory: "ConversationMemory",
+        expires_at: float = None,
+        size: int = None,
+    ) -> None:
+        """
+        Store memory, keeping the expiry of the entry it replaces by default so
+        write-through updates do not extend the TTL.
+        """
+        conversation_id = memory.conversation_id
+        if expires_at is None:
+            expires_at = self._entries[conversation_id][1]
+        if size is None:
+            size = self._estimate_size(memory)
+        self._remove(conversation_id)
+        if size > self.max_bytes:
+            logging.info(f"conversation too large to cache: {conversation_id=}")
+            return
+        self._entries[conversation_id] = (memory, expires_at, size)
+        self.size_bytes += size
+        while (
+            len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _mark_written(self, conversation_id: str) -> None:
+        self._generation += 1
+        self._written[conversation_id] = self._generation
+        self._written.move_to_end(conversation_id)
+        if len(self._written) > self.max_entries:
+            _, self._forgotten = self._written.popitem(last=False)
+
+    def _remove(self, conversation_id: str) -> None:
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+    @staticmethod
+    def _estimate_size(memory: "ConversationMemory") -> int:
+        return MESSAGE_OVERHEAD_BYTES + sum(
+            ConversationCache._message_size(message) for message in memory.messages
+        )
+
+    @staticmethod
+    def _message_size(message: "ConversationMessage") -> int:
+        size = MESSAGE_OVERHEAD_BYTES + 2 * len(message.content)
+        if message.learning_phrases:
+            size += 2 * sum(len(phrase) for phrase in message.learning_phrases)
+        return size
@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from .language_detector import LanguageDetectionStrategy
+from .models import Language
+
+
+class _Abandoned(Exception):
+    """
+    The caller detecting a message was cancelled, its waiters start over.
+    """
+
+
+def detection_key(
+    namespace: str, message: str, primary: Language, learning: Language
+) -> str:
+    payload = [namespace, message, primary.value, learning.value]
+    encoded = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class MemoizedLanguageDetector(LanguageDetectionStrategy):
+    """
+    Remembers the phrases detected in a message by a deterministic detector.
+
+    Results are addressed by a hash of the detector's cache_namespace and the
+    detect arguments. An in-process LRU sits in front of an optional Mongo
+    collection, which keeps results across restarts and workers until its TTL
+    index expires them after ttl_seconds. Concurrent misses on the same message
+    share one detection. Failed detections raise and are not cached.
+    """
+
+    def __init__(
+        self,
+        detector: LanguageDetectionStrategy,
+        collection: Collection = None,
+        max_entries: int = 10_000,
+        ttl_seconds: int = 30 * 24 * 3600,
+    ):
+        self.detector = detector
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.namespace = detector.cache_namespace()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: OrderedDict[str, List[str]] = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        if self.collection is not None:
+            try:
+                self.collection.create_index(
+                    [("created_at", ASCENDING)], expireAfterSeconds=ttl_seconds
+                )
+            except PyMongoError as e:
+                logging.error(f"Failed to create the detection cache index: {e}")
+
+    @staticmethod
+    def from_env(
+        detector: LanguageDetectionStrategy, collection: Collection = None
+    ) -> LanguageDetectionStrategy:
+        """
+        detector wrapped as configured by the DETECTION_CACHE_* variables.
+        """
+        if os.getenv("DETECTION_CACHE_ENABLED", "true").lower() != "true":
+            return detector
+        persistent = os.getenv("DETECTION_CACHE_PERSISTENT", "true").lower() == "true"
+        return MemoizedLanguageDetector(
+            detector,
+            collection=collection if persistent else None,
+            max_entries=int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", 10_000)),
+            ttl_seconds=int(
+                os.getenv("DETECTION_CACHE_TTL_SECONDS", 30 * 24 * 3600)
+            ),
+        )
+
+    def cache_namespace(self) -> str:
+        return self.namespace
+
+    def detect(self, message: str, primary: Language, learning: Language) -> List[str]:
+        key = detection_key(self.namespace, message, primary, learning)
+        return self._detect(key, message, primary, learning, persistent=True)
+
+    async def adetect(
+        self, message: str, primary: Language, learning: Language
+    ) -> List[str]:
+        key = detection_key(self.namespace, message, primary, learning)
+        return await self._adetect(key, message, primary, learning, persistent=True)
+
+    def detect_many(
+        self, messages: List[str], primary: Language, learning: Language
+    ) -> List[List[str]]:
+        """
+        Phrases of each message, looking all of them up with a single query.
+        """
+        keys = [detection_key(self.namespace, m, primary, learning) for m in messages]
+        results = self._get_many(keys)
+        detected = {}
+        for key, message in zip(keys, messages):
+            if key not in results and key not in detected:
+                detected[key] = self._detect(key, message, primary, learning)
+        results.update(detected)
+        return [list(results[key]) for key in keys]
+
+    async def adetect_many(
+        self, messages: List[str], primary: Language, learning: Language
+    ) -> List[List[str]]:
+        keys = [detection_key(self.namespace, m, primary, learning) for m in messages]
+        results = await asyncio.to_thread(self._get_many, keys)
+        pending = {}
+        for key, message in zip(keys, messages):
+            if key not in results and key not in pending:
+                pending[key] = self._adetect(key, message, primary, learning)
+        detected = await asyncio.gather(*pending.values())
+        results.update(zip(pending, detected))
+        return [list(results[key]) for key in keys]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+    def _detect(
+        self,
+        key: str,
+        message: str,
+        primary: Language,
+        learning: Language,
+        persistent: bool = False,
+    ) -> List[str]:
+        """
+        Detect the phrases of a message missing from the cache, looking it up
+        in the collection first when persistent is set.
+        """
+        while True:
+            phrases, future, leader = self._lookup(key)
+            if phrases is not None:
+                return phrases
+            if leader:
+                break
+            try:
+                return list(future.result())
+            except _Abandoned:
+                continue
+        try:
+            if persistent:
+                phrases = self._find_persistent([key]).get(key)
+            if phrases is None:
+                phrases = self.detector.detect(message, primary, learning)
+                self._insert_persistent(key, phrases)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._complete(key, future, phrases)
+        return list(phrases)
+
+    async def _adetect(
+        self,
+        key: str,
+        message: str,
+        primary: Language,
+        learning: Language,
+        persistent: bool = False,
+    ) -> List[str]:
+        while True:
+            phrases, future, leader = self._lookup(key)
+            if phrases is not None:
+                return phrases
+            if leader:
+                break
+            try:
+                return list(await asyncio.shield(asyncio.wrap_future(future)))
+            except _Abandoned:
+                # The detecting caller was cancelled, a waiter takes over.
+                continue
+        try:
+            if persistent:
+                found = await asyncio.to_thread(self._find_persistent, [key])
+                phrases = found.get(key)
+            if phrases is None:
+                phrases = await self.detector.adetect(message, primary, learning)
+                await asyncio.to_thread(self._insert_persistent, key, phrases)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._complete(key, future, phrases)
+        return list(phrases)
+
+    def _lookup(self, key: str):
+        """
+        (cached phrases, in-flight future, whether the caller must detect).
+        """
+        with self._lock:
+            phrases = self._entries.get(key)
+            if phrases is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return list(phrases), None, False
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            future = self._in_flight[key] = Future()
+            return None, future, True
+
+    def _complete(self, key: str, future: Future, phrases: List[str]) -> None:
+        with self._lock:
+            self._store(key, phrases)
+            del self._in_flight[key]
+        future.set_result(phrases)
+
+    def _fail(self, key: str, future: Future, error: BaseException) -> None:
+        with self._lock:
+            del self._in_flight[key]
+        if not isinstance(error, Exception):
+            # Cancelled, which is no failure of the detection, waiters retry.
+            error = _Abandoned()
+        future.set_exception(error)
+
+    def _get_many(self, keys: List[str]) -> Dict[str, List[str]]:
+        results = {}
+        with self._lock:
+            for key in keys:
+                phrases = self._entries.get(key)
+                if phrases is not None:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    results[key] = phrases
+        missing = [key for key in dict.fromkeys(keys) if key not in results]
+        found = self._find_persistent(missing)
+        with self._lock:
+            for key, phrases in found.items():
+                self._store(key, phrases)
+        results.update(found)
+        return results
+
+    def _store(self, key: str, phrases: List[str]) -> None:
+        self._entries[key] = phrases
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _find_persistent(self, keys: List[str]) -> Dict[str, List[str]]:
+        if self.collection is None or not keys:
+            return {}
+        try:
+            cursor = self.collection.find(
+                {"_id": {"$in": keys}}, projection={"phrases": True}
+            )
+            found = {document["_id"]: document["phrases"] for document in cursor}
+        except PyMongoError as e:
+            logging.error(f"Failed to read detection cache: {e}")
+            return {}
+        with self._lock:
+            self.persistent_hits += len(found)
+        return found
+
+    def _insert_persistent(self, key: str, phrases: List[str]) -> None:
+        with self._lock:
+            self.misses += 1
+        if self.collection is None:
+            return
+        document = {
+            "_id": key,
+            "phrases": phrases,
+            "created_at": datetime.now(timezone.utc),
+        }
+        try:
+            self.collection.insert_one(document)
+        except DuplicateKeyError:
+            # Another worker stored the same detection first.
+            pass
+        except PyMongoError as e:
+            logging.error(f"Failed to write detection cache: {e}")
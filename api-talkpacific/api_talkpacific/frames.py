@@ -0,0 +1,99 @@
+import logging
+from typing import Optional
+
+from .models import ChatResponseChunk
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ormsgpack as msgpack
+except ImportError:
+    try:
+        import msgpack
+    except ImportError:
+        msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Field order of the JSON objects, which pydantic serializes in definition order.
+CHUNK_FIELDS = tuple(ChatResponseChunk.model_fields)
+# Fields of a streaming chunk that only carries a delta.
+DELTA_FIELD_COUNT = 4
+DELTA_SUFFIX = b',"is_finished":false}\n\n'
+
+
+def chunk_fields(chunk: ChatResponseChunk) -> dict:
+    """
+    The fields of chunk that were set, like model_dump(exclude_unset=True)
+    without converting the values.
+    """
+    fields_set = chunk.model_fields_set
+    return {name: getattr(chunk, name) for name in CHUNK_FIELDS if name in fields_set}
+
+
+class SSEFrameEncoder:
+    """
+    Encodes the chunks of one stream as SSE frames, byte for byte the frames
+    of model_dump_json(exclude_unset=True).
+
+    Frames that only carry a delta are spliced into a template built from the
+    stream's first chunk, since conversation_id, content_id and is_finished do
+    not change while it streams. Other chunks are encoded with orjson.
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(self):
+        self._conversation_id: Optional[str] = None
+        self._content_id: Optional[str] = None
+        self._prefix = b""
+
+    def encode(self, chunk: ChatResponseChunk) -> bytes:
+        if orjson is None:
+            return f"data: {chunk.model_dump_json(exclude_unset=True)}\n\n".encode()
+        if len(chunk.model_fields_set) == DELTA_FIELD_COUNT and not chunk.is_finished:
+            if (
+                chunk.content_id != self._content_id
+                or chunk.conversation_id != self._conversation_id
+            ):
+                self._build_template(chunk)
+            return self._prefix + orjson.dumps(chunk.delta) + DELTA_SUFFIX
+        return b"data: " + orjson.dumps(chunk_fields(chunk)) + b"\n\n"
+
+    def _build_template(self, chunk: ChatResponseChunk) -> None:
+        self._conversation_id = chunk.conversation_id
+        self._content_id = chunk.content_id
+        self._prefix = (
+            b'data: {"conversation_id":'
+            + orjson.dumps(chunk.conversation_id)
+            + b',"content_id":'
+            + orjson.dumps(chunk.content_id)
+            + b',"delta":'
+        )
+
+
+class MsgpackFrameEncoder:
+    """
+    Encodes every chunk as a msgpack map of its set fields. The frames are
+    concatenated without delimiters, msgpack values are self-delimiting.
+    """
+
+    media_type = "application/x-msgpack"
+
+    def encode(self, chunk: ChatResponseChunk) -> bytes:
+        return msgpack.packb(chunk_fields(chunk))
+
+
+def frame_encoder(accept: str = None):
+    """
+    The frame encoder negotiated by the Accept header of the request, SSE
+    unless msgpack is asked for and available.
+    """
+    if accept and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        if msgpack is not None:
+            return MsgpackFrameEncoder()
+        logging.warning("msgpack requested but not installed, sending SSE")
+    return SSEFrameEncoder()
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+
+from .teacher_db import (
+    AsyncTeacherDB,
+    ConversationMemory,
+    ConversationMessage,
+    ConversationRole,
+    TeacherDB,
+)
+
+SUMMARY_SYSTEM_PROMPT = """You keep notes on a lesson between a language teacher \
+and a student.
+Update the summary with the new messages. Keep the vocabulary, phrases and \
+grammar that were taught, what the student struggled with and any personal \
+details the student shared. Reply with the updated summary only."""
+
+SUMMARY_HUMAN_PROMPT = """Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+SUMMARY_HISTORY_PREFIX = "Summary of the earlier lesson: "
+
+
+def replay(messages: List[ConversationMessage]) -> List[BaseMessage]:
+    message_history = ChatMessageHistory()
+    for msg in messages:
+        if msg.role == ConversationRole.User:
+            message_history.add_user_message(msg.content)
+        else:
+            message_history.add_ai_message(msg.content)
+    return message_history.messages
+
+
+def approximate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def tiktoken_counter() -> Callable[[str], int]:
+    """
+    Token counter of the OpenAI chat models, or an approximation when the
+    tiktoken encoding cannot be loaded.
+    """
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text))
+    except Exception as e:
+        logging.warning(f"tiktoken unavailable, approximating token counts: {e}")
+        return approximate_tokens
+
+
+class TokenCounter:
+    """
+    Counts the tokens of conversation messages, caching the count of each
+    message so budget checks do not re-tokenize the whole history every turn.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int] = None,
+        max_entries: int = 100_000,
+    ):
+        self._count_tokens = count_tokens
+        self.max_entries = max_entries
+        self._counts: OrderedDict[Tuple[str, int, int], int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, message: ConversationMessage) -> int:
+        key = (message.conversation_id, message.position, hash(message.content))
+        with self._lock:
+            tokens = self._counts.get(key)
+            if tokens is not None:
+                self._counts.move_to_end(key)
+                return tokens
+        if self._count_tokens is None:
+            self._count_tokens = tiktoken_counter()
+        tokens = self._count_tokens(message.content)
+        with self._lock:
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def window(
+        self, messages: List[ConversationMessage], max_tokens: int
+    ) -> List[ConversationMessage]:
+        """
+        The most recent messages that fit in max_tokens.
+        """
+        total = 0
+        start = len(messages)
+        while start > 0:
+            total += self.count(messages[start - 1])
+            if total > max_tokens:
+                break
+            start -= 1
+        return messages[start:]
+
+
+class HistoryStrategy(ABC):
+    """
+    Turns a stored conversation into the history messages of the next prompt.
+    """
+
+    @abstractmethod
+    def load(self, memory: ConversationMemory) -> List[BaseMessage]:
+        pass
+
+    async def aload(self, memory: ConversationMemory) -> List[BaseMessage]:
+        return self.load(memory)
+
+    def after_turn(self, conversation_id: str) -> Optional[asyncio.Task]:
+        """
+        Called once a turn is saved, to prepare the history of the next one.
+        """
+        return None
+
+    @staticmethod
+    def from_env(llm: BaseChatModel, teacher_db: TeacherDB) -> "HistoryStrategy":
+        """
+        Built from HISTORY_STRATEGY (full, window or summary) and
+        HISTORY_MAX_TOKENS. llm only writes summaries, it need not stream.
+        """
+        name = os.getenv("HISTORY_STRATEGY", "full")
+        max_tokens = int(os.getenv("HISTORY_MAX_TOKENS", 3000))
+        if name == "window":
+            return TokenBudgetHistory(max_tokens=max_tokens)
+        if name == "summary":
+            return SummaryHistory(llm, teacher_db, max_tokens=max_tokens)
+        if name != "full":
+            logging.error(f"Unknown HISTORY_STRATEGY {name}, replaying everything")
+        return FullHistory()
+
+
+class FullHistory(HistoryStrategy):
+    """
+    Replays every stored message.
+    """
+
+    def load(self, memory: ConversationMemory) -> List[BaseMessage]:
+        return replay(memory.messages)
+
+
+class TokenBudgetHistory(HistoryStrategy):
+    """
+    Replays the most recent messages that fit in max_tokens.
+    """
+
+    def __init__(self, max_tokens: int, token_counter: TokenCounter = None):
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter if token_counter else TokenCounter()
+
+    def load(self, memory: ConversationMemory) -> List[BaseMessage]:
+        return replay(self.token_counter.window(memory.messages, self.max_tokens))
+
+
+class SummaryHistory(HistoryStrategy):
+    """
+    Replays the messages after the conversation's rolling summary, preceded by
+    the summary itself.
+
+    Once those messages outgrow max_tokens, the oldest are folded into the
+    summary until only low_water * max_tokens remain. The window then has room
+    to grow again, so the summary is only recomputed every few turns. It is
+    persisted with the conversation in TeacherDB.
+
+    Folding runs in the background after a turn is saved, so the LLM call never
+    delays a response. Until it finishes, the next prompt replays the most
+    recent max_tokens of messages after the current summary.
+    """
+
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        teacher_db: TeacherDB,
+        max_tokens: int,
+        low_water: float = 0.5,
+        token_counter: TokenCounter = None,
+    ):
+        self.teacher_db = teacher_db
+        self.async_teacher_db = AsyncTeacherDB(teacher_db)
+        self.max_tokens = max_tokens
+        self.low_water = low_water
+        self.token_counter = token_counter if token_counter else TokenCounter()
+        prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", SUMMARY_SYSTEM_PROMPT),
+                ("human", SUMMARY_HUMAN_PROMPT),
+            ]
+        )
+        self.chain = prompt | llm | StrOutputParser()
+        # Folds running in the background, by conversation.
+        self._folds: Dict[str, asyncio.Task] = {}
+
+    def load(self, memory: ConversationMemory) -> List[BaseMessage]:
+        recent = self.token_counter.window(self._unsummarized(memory), self.max_tokens)
+        return self._history(memory.summary, recent)
+
+    def after_turn(self, conversation_id: str) -> Optional[asyncio.Task]:
+        """
+        Fold the conversation in the background, unless it already is.
+        """
+        if conversation_id in self._folds:
+            return None
+        task = asyncio.create_task(self._fold(conversation_id))
+        self._folds[conversation_id] = task
+        task.add_done_callback(lambda _: self._folds.pop(conversation_id, None))
+        return task
+
+    async def _fold(self, conversation_id: str) -> None:
+        try:
+            memory = await self.async_teacher_db.get_conversation(conversation_id)
+            folded, _ = self._split(self._unsummarized(memory))
+            if not folded:
+                return
+            summary = await self.chain.ainvoke(
+                self._chain_input(memory.summary, folded)
+            )
+            await self.async_teacher_db.update_summary(
+                conversation_id, summary, folded[-1].position
+            )
+        except Exception as e:
+            logging.error(f"Failed to summarize conversation {conversation_id}: {e}")
+
+    @staticmethod
+    def _unsummarized(memory: ConversationMemory) -> List[ConversationMessage]:
+        messages = memory.messages
+        start = len(messages)
+        while start > 0 and messages[start - 1].position > memory.summary_position:
+            start -= 1
+        return messages[start:]
+
+    def _split(
+        self, messages: List[ConversationMessage]
+    ) -> Tuple[List[ConversationMessage], List[ConversationMessage]]:
+        """
+        Messages to fold into the summary and messages to replay.
+        """
+        window = self.token_counter.window(messages, self.max_tokens)
+        if len(window) == len(messages):
+            return [], messages
+        kept = self.token_counter.window(
+            messages, int(self.max_tokens * self.low_water)
+        )
+        return messages[: len(messages) - len(kept)], kept
+
+    @staticmethod
+    def _chain_input(summary: str, messages: List[ConversationMessage]) -> dict:
+        return {
+            "summary": summary or "(none)",
+            "messages": "\n".join(f"{m.role.value}: {m.content}" for m in messages),
+        }
+
+    @staticmethod
+    def _history(summary: str, messages: List[ConversationMessage]):
+        history = replay(messages)
+        if summary:
+            history.insert(0, SystemMessage(content=SUMMARY_HISTORY_PREFIX + summary))
+        return history
@@ -1,25 +1,39 @@
-import re
-from typing import Generator, List, Tuple
-import os
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Tuple
 import logging
 from operator import itemgetter
+import time
 import uuid
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel
 
 from .models import (
     ChatResponseChunk,
     Language,
 )
-from .language_detector import LanguageDetector
+from .admission import AdmissionController
+from .detection_cache import MemoizedLanguageDetector
+from .history import HistoryStrategy
+from .language_detector import LanguageDetectionStrategy, LanguageDetector
+from .llm_clients import LLMClients
+from .metrics import StreamObserver
+from .response_cache import ResponseCache, response_key
+from .script_detector import ScriptLanguageDetector
+from .sentence_detection import (
+    AsyncSentencePhraseDetection,
+    SentencePhraseDetection,
+)
+from .sentence_segmenter import SentenceSegmenter
+from .singleflight import ConversationStreams
+from .tracing import current_trace
 from .teacher_db import (
+    AsyncTeacherDB,
     ConversationMessage,
     ConversationRole,
+    MessageProjection,
     TeacherDB,
     ConversationMemory,
 )
@@ -34,17 +48,63 @@ Take any opportunity you can to teach {learning_language}.
 If the user is interested in learning history or culture, \
 you can teach them about {learning_language} history or culture."""
 
+# Sentences of one response whose phrase detection may run at the same time.
+SENTENCE_DETECTION_CONCURRENCY = 4
+
 
 class LanguageCoach:
-    def __init__(self):
-        api_key = os.getenv("OPENAI_API_KEY")
-        self.llm = ChatOpenAI(
-            openai_api_key=api_key,
-            model_name="gpt-3.5-turbo-1106",
-            streaming=True,
-            callbacks=[StreamingStdOutCallbackHandler()],
-        )
-        self.teacher_db = TeacherDB()
+    def __init__(
+        self,
+        llm: BaseChatModel = None,
+        teacher_db: TeacherDB = None,
+        language_detector: LanguageDetectionStrategy = None,
+        history_strategy: HistoryStrategy = None,
+        clients: LLMClients = None,
+        response_cache: ResponseCache = None,
+        admission: AdmissionController = None,
+        streams: ConversationStreams = None,
+    ):
+        self.clients = clients
+        if llm:
+            self.llm = llm
+        else:
+            if not self.clients:
+                self.clients = LLMClients.from_env()
+            self.llm = self.clients.coach_llm
+        self.teacher_db = teacher_db if teacher_db else TeacherDB()
+        self.async_teacher_db = AsyncTeacherDB(self.teacher_db)
+        if language_detector:
+            self.language_detector = language_detector
+        else:
+            detector_llm = self.clients.detector_llm if self.clients else None
+            self.language_detector = ScriptLanguageDetector(
+                fallback=MemoizedLanguageDetector.from_env(
+                    LanguageDetector(detector_llm), self.teacher_db.db.detections
+                )
+            )
+        if history_strategy:
+            self.history_strategy = history_strategy
+        else:
+            summary_llm = self.clients.summary_llm if self.clients else self.llm
+            self.history_strategy = HistoryStrategy.from_env(
+                summary_llm, self.teacher_db
+            )
+        if response_cache:
+            self.response_cache = response_cache
+        else:
+            self.response_cache = ResponseCache.from_env(
+                self.teacher_db.db.response_cache
+            )
+        # Admits the coach streams of the /send-message endpoint.
+        if admission:
+            self.admission = admission
+        else:
+            self.admission = AdmissionController.from_env(
+                "coach", max_concurrency=32, max_queue=64, queue_timeout_ms=2000
+            )
+        # Serializes the streams of a conversation, see singleflight.py.
+        self.streams = streams if streams else ConversationStreams.from_env()
+        self.chain = self._create_chain()
 
     def create_conversation(
         self,
@@ -56,11 +116,206 @@ class LanguageCoach:
             learning=learning,
         )
 
-    def send_message(
+    async def asend_message(
         self,
         conversation_id: str,
         message: str,
-    ) -> Generator[ChatResponseChunk, None, None]:
+    ) -> AsyncGenerator[ChatResponseChunk, None]:
+        """
+        Stream the coach's response to a message and persist the turn.
+
+        The LLM stream, the detector call and every Mongo round trip are awaited,
+        so a single worker can serve many concurrent streams.
+        """
+        started = time.perf_counter()
+        trace = current_trace()
+        with trace.span("history_load"):
+            conversation: ConversationMemory = (
+                await self.async_teacher_db.get_conversation(conversation_id)
+            )
+            history: List[BaseMessage] = await self.history_strategy.aload(
+                conversation
+            )
+        cache_key = self._response_key(conversation, history, message)
+        cached = None
+        if cache_key:
+            cached = await self.response_cache.aget(
+                cache_key, language_pair(conversation)
+            )
+        if cached:
+            async for chunk in self._areplay(conversation_id, message, cached):
+                yield chunk
+            return
+        with StreamObserver(language_pair(conversation), started, trace) as observer:
+            with trace.span("prompt_build"):
+                chain_input = self._chain_input(conversation, history, message)
+                stream = self.chain.astream(chain_input)
+
+            user_message = asyncio.ensure_future(
+                self.async_teacher_db.add_message(
+                    conversation_id=conversation_id,
+                    role=ConversationRole.User,
+                    content=message,
+                )
+            )
+            response_chunks = []
+
+            chunk_generator = ChatResponseChunkProcessor(
+                conversation_id=conversation_id
+            )
+            detection = AsyncSentencePhraseDetection(
+                self.language_detector,
+                conversation.primary,
+                conversation.learning,
+                max_concurrency=SENTENCE_DETECTION_CONCURRENCY,
+            )
+            process_chunk = trace.timed("segmentation", chunk_generator.process_chunk)
+            response_state = None
+            try:
+                # Shielded, a cancelled insert would still finish in its thread.
+                await asyncio.shield(user_message)
+                async for chunk in stream:
+                    response_chunk = process_chunk(chunk=chunk)
+                    if response_chunk is not None:
+                        observer.token()
+                        self._detect_closed_sentences(
+                            chunk_generator, detection, response_chunk
+                        )
+                        if cache_key:
+                            response_chunks.append(response_chunk)
+                        yield response_chunk
+                observer.tokens_finished()
+
+                with trace.span("segmentation"):
+                    response_state = chunk_generator.finish()
+                with trace.span("detection"):
+                    detection.submit_remaining(
+                        response_state.content, response_state.sentence_indices
+                    )
+                    await detection.wait()
+            except (asyncio.CancelledError, GeneratorExit):
+                await self._cancel_stream(
+                    user_message,
+                    stream,
+                    chunk_generator,
+                    detection,
+                    observer,
+                    response_state,
+                )
+                raise
+            final_chunk = self._create_final_chunk(response_state, detection)
+            await self.async_teacher_db.add_message(
+                conversation_id=final_chunk.conversation_id,
+                role=ConversationRole.Assistant,
+                content=response_state.content,
+                sentence_indices=final_chunk.sentence_indices,
+                learning_phrases=final_chunk.learning_phrases,
+            )
+            self.history_strategy.after_turn(conversation_id)
+            self._attach_timings(final_chunk)
+
+            yield final_chunk
+            logging.info(f"completed stream: {final_chunk=}")
+            if cache_key:
+                response_chunks.append(final_chunk)
+                await self.response_cache.aput(cache_key, response_chunks)
+
+    async def _cancel_stream(
+        self,
+        user_message: asyncio.Future,
+        stream: AsyncIterator[str],
+        chunk_generator: "ChatResponseChunkProcessor",
+        detection: SentencePhraseDetection,
+        observer: StreamObserver,
+        response_state: Optional["ChatResponseState"],
+    ) -> None:
+        """
+        End the stream of a client that left: close the LLM's HTTP stream, drop
+        the detections not done yet and persist what was received. Without a
+        response_state the LLM was still generating, and the message is marked
+        truncated, empty when the user message was still being written. The
+        user message always gets its reply, clients pair them up.
+        """
+        await stream.aclose()
+        completed = detection.pop_completed()
+        detection.cancel()
+        truncated = response_state is None
+        if truncated:
+            observer.cancelled()
+            response_state = chunk_generator.state.to_state()
+        logging.info(
+            f"cancelled stream: {response_state.conversation_id=}, {truncated=}, "
+            f"tokens={observer.tokens}, detected={len(completed)}"
+        )
+        try:
+            await user_message
+        except Exception as e:
+            logging.error(f"Failed to persist message of cancelled stream: {e}")
+            return
+        try:
+            await self.async_teacher_db.add_message(
+                conversation_id=response_state.conversation_id,
+                role=ConversationRole.Assistant,
+                content=response_state.content,
+                sentence_indices=response_state.sentence_indices,
+                learning_phrases=detection.learning_phrases(),
+                truncated=truncated,
+            )
+        except Exception as e:
+            logging.error(f"Failed to persist cancelled stream: {e}")
+
+    async def _areplay(
+        self, conversation_id: str, message: str, cached: tuple
+    ) -> AsyncGenerator[ChatResponseChunk, None]:
+        """
+        Stream a cached response and persist the turn like a generated one.
+        """
+        await self.async_teacher_db.add_message(
+            conversation_id=conversation_id,
+            role=ConversationRole.User,
+            content=message,
+        )
+        chunks = ResponseCache.replay(cached, conversation_id, str(uuid.uuid4()))
+        for chunk in chunks[:-1]:
+            yield chunk
+        final_chunk = chunks[-1]
+        await self.async_teacher_db.add_message(
+            conversation_id=conversation_id,
+            role=ConversationRole.Assistant,
+            content="".join(chunk.delta for chunk in chunks),
+            sentence_indices=final_chunk.sentence_indices,
+            learning_phrases=final_chunk.learning_phrases,
+        )
+        self._attach_timings(final_chunk)
+        yield final_chunk
+
+    @staticmethod
+    def _attach_timings(final_chunk: ChatResponseChunk) -> None:
+        trace = current_trace()
+        if trace.debug:
+            final_chunk.timings = trace.timings()
+
+    def _response_key(
+        self,
+        conversation: ConversationMemory,
+        history: List[BaseMessage],
+        message: str,
+    ) -> str | None:
+        """
+        Key of the response in the response cache, None when it is bypassed.
+        """
+        if not self.response_cache or not self.response_cache.accepts(history):
+            return None
+        return response_key(
+            getattr(self.llm, "model_name", type(self.llm).__name__),
+            COACH_SYSTEM_PROMPT,
+            conversation.primary,
+            conversation.learning,
+            history,
+            message,
+        )
+
+    def _create_chain(self):
         parameters = {
             "history": itemgetter("history"),
             "primary_language": itemgetter("primary_language"),
@@ -74,89 +329,107 @@ class LanguageCoach:
                 ("human", "{input}"),
             ]
         )
-        chain = parameters | prompt | self.llm | StrOutputParser()
-        conversation: ConversationMemory = self.teacher_db.get_conversation(
-            conversation_id
-        )
-        history: List[BaseMessage] = self.load_history(conversation)
-        logging.info(f"current history: {history=}")
-        stream = chain.stream(
-            {
-                "history": history,
-                "primary_language": conversation.primary.value,
-                "learning_language": conversation.learning.value,
-                "input": message,
-            }
-        )
+        return parameters | prompt | self.llm | StrOutputParser()
 
-        self.teacher_db.add_message(
-            conversation_id=conversation_id,
-            role=ConversationRole.User,
-            content=message,
-        )
-
-        # Create uuid
-        chunk_generator = ChatResponseChunkProcessor(conversation_id=conversation_id)
-        for chunk in stream:
-            response_chunk = chunk_generator.process_chunk(chunk=chunk)
-            if response_chunk is not None:
-                yield response_chunk
+    @staticmethod
+    def _chain_input(
+        conversation: ConversationMemory,
+        history: List[BaseMessage],
+        message: str,
+    ) -> dict:
+        logging.info(f"current history: {history=}")
+        return {
+            "history": history,
+            "primary_language": conversation.primary.value,
+            "learning_language": conversation.learning.value,
+            "input": message,
+        }
 
-        # Parse the final response and decorate it with annotations
-        chunk_generator.state = chunk_generator.state.model_copy(
-            update={"content_finished": True}
-        )
-        response_model = chunk_generator.state
-        chunk_generator.create_sentences()
-        learning_phrases = LanguageDetector().detect(
-            message=response_model.content,
-            primary=conversation.primary,
-            learning=conversation.learning,
-        )
+    @staticmethod
+    def _detect_closed_sentences(
+        chunk_generator: "ChatResponseChunkProcessor",
+        detection: SentencePhraseDetection,
+        response_chunk: ChatResponseChunk,
+    ) -> None:
+        """
+        Start detection on sentences closed by this chunk and attach the
+        detections that have completed so far.
+        """
+        if response_chunk.sentence_indices:
+            detection.submit(
+                chunk_generator.sentence_texts(response_chunk.sentence_indices)
+            )
+        completed = detection.pop_completed()
+        if completed:
+            response_chunk.sentence_learning_phrases = completed
 
+    @staticmethod
+    def _create_final_chunk(
+        response_state: "ChatResponseState",
+        detection: SentencePhraseDetection,
+    ) -> ChatResponseChunk:
+        completed = detection.pop_completed()
         final_chunk = ChatResponseChunk(
-            conversation_id=conversation_id,
-            content_id=response_model.content_id,
+            conversation_id=response_state.conversation_id,
+            content_id=response_state.content_id,
             delta="",
             is_finished=True,
-            sentence_indices=chunk_generator.state.sentence_indices,
-            learning_phrases=learning_phrases,
+            sentence_indices=response_state.sentence_indices,
+            learning_phrases=detection.learning_phrases(),
         )
-        self.teacher_db.add_message(
-            conversation_id=final_chunk.conversation_id,
-            role=ConversationRole.Assistant,
-            content=response_model.content,
-            sentence_indices=final_chunk.sentence_indices,
-            learning_phrases=final_chunk.learning_phrases,
-        )
-
-        yield final_chunk
-        logging.info(f"completed stream: {final_chunk=}")
+        if completed:
+            final_chunk.sentence_learning_phrases = completed
+        return final_chunk
 
     def load_history(self, memory: ConversationMemory) -> List[BaseMessage]:
         """
         Load memory variables for LLM processing.
         """
-        message_history = ChatMessageHistory()
-        for msg in memory.messages:
-            if msg.role == ConversationRole.User:
-                message_history.add_user_message(msg.content)
-            else:
-                message_history.add_ai_message(msg.content)
-        return message_history.messages
+        return self.history_strategy.load(memory)
+
+    def cached_language_pair(self, conversation_id: str) -> str:
+        """
+        Language pair of a conversation in the cache, for labelling metrics
+        without a database round trip.
+        """
+        conversation = self.teacher_db.conversation_cache.peek(conversation_id)
+        return language_pair(conversation) if conversation else "unknown"
 
-    def get_conversation_memories(self) -> List[ConversationMemory]:
-        return self.teacher_db.get_conversation_memories()
+    def get_conversation_memories(
+        self, limit: int = 10, after: str = None
+    ) -> List[ConversationMemory]:
+        return self.teacher_db.get_conversation_memories(limit, after)
 
     def delete_conversation(self, conversation_id: str) -> bool:
         return self.teacher_db.delete_conversation(conversation_id)
 
-    def get_messages(self, conversation_id: str) -> List[ConversationMessage]:
-        return self.teacher_db.get_messages(conversation_id)
+    def get_messages(
+        self,
+        conversation_id: str,
+        after_position: int = -1,
+        limit: int = None,
+        projection: MessageProjection = MessageProjection.Full,
+    ) -> List[ConversationMessage]:
+        return self.teacher_db.get_messages(
+            conversation_id, after_position, limit, projection
+        )
+
+    def get_messages_version(self, conversation_id: str) -> Optional[Tuple[int, int]]:
+        return self.teacher_db.get_messages_version(conversation_id)
 
     def delete_messages(self, conversation_id: str, position: int) -> bool:
         return self.teacher_db.delete_messages(conversation_id, position)
 
+    def close(self) -> None:
+        """
+        Flush pending writes.
+        """
+        self.teacher_db.close()
+
+
+def language_pair(conversation: ConversationMemory) -> str:
+    return f"{conversation.primary.value}-{conversation.learning.value}"
+
 
 class ChatResponseState(BaseModel):
     conversation_id: str
@@ -166,57 +439,115 @@ class ChatResponseState(BaseModel):
     sentence_indices: List[Tuple[int, int]] = []
 
 
+class ChatResponseAccumulator:
+    """
+    Mutable response state used while a stream is in flight.
+
+    Deltas are appended to a list of parts and only joined when the content is
+    read, so each token costs O(1) instead of a model copy plus a full string
+    concatenation. The ChatResponseState is materialized once, at finish.
+    """
+
+    __slots__ = (
+        "conversation_id",
+        "content_id",
+        "content_finished",
+        "sentence_indices",
+        "_parts",
+    )
+
+    def __init__(self, conversation_id: str, content_id: str = ""):
+        self.conversation_id = conversation_id
+        self.content_id = content_id
+        self.content_finished = False
+        self.sentence_indices: List[Tuple[int, int]] = []
+        self._parts: List[str] = []
+
+    @property
+    def content(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    @content.setter
+    def content(self, value: str) -> None:
+        self._parts = [value] if value else []
+
+    def append(self, delta: str) -> None:
+        self._parts.append(delta)
+
+    def to_state(self) -> ChatResponseState:
+        return ChatResponseState(
+            conversation_id=self.conversation_id,
+            content=self.content,
+            content_id=self.content_id,
+            content_finished=self.content_finished,
+            sentence_indices=self.sentence_indices,
+        )
+
+
 class ChatResponseChunkProcessor:
 
     def __init__(self, conversation_id: str):
-        self.state = ChatResponseState(
+        self.state = ChatResponseAccumulator(
             conversation_id=conversation_id, content_id=str(uuid.uuid4())
         )
+        self.segmenter = SentenceSegmenter()
+        self.state.sentence_indices = self.segmenter.sentence_indices
+        # Content of sentences that are still open, see sentence_texts.
+        self._open_parts: List[str] = []
+        self._open_start = 0
 
     def process_chunk(self, chunk: str) -> ChatResponseChunk | None:
-        if chunk is not None and len(chunk) > 0:
-            delta_content = chunk if chunk is not None else ""
-            self.state = self.state.model_copy(
-                update={
-                    "content": self.state.content + delta_content,
-                }
-            )
-            return ChatResponseChunk(
-                conversation_id=self.state.conversation_id,
-                content_id=self.state.content_id,
-                delta=delta_content,
-                is_finished=self.state.content_finished,
-            )
-        return None
+        if not chunk:
+            return None
+        state = self.state
+        state.append(chunk)
+        self._open_parts.append(chunk)
+        closed_sentences = self.segmenter.feed(chunk)
+        # The fields are known to be valid, skip pydantic validation per token.
+        response_chunk = ChatResponseChunk.model_construct(
+            conversation_id=state.conversation_id,
+            content_id=state.content_id,
+            delta=chunk,
+            is_finished=state.content_finished,
+        )
+        if closed_sentences:
+            response_chunk.sentence_indices = closed_sentences
+        return response_chunk
+
+    def sentence_texts(self, sentence_indices: List[Tuple[int, int]]) -> List[str]:
+        """
+        Text of sentences that closed in the last processed chunk.
+
+        Content before the last of them is released from the open buffer, so
+        each character is copied a bounded number of times.
+        """
+        text = "".join(self._open_parts)
+        offset = self._open_start
+        end = sentence_indices[-1][1]
+        self._open_parts = [text[end - offset:]]
+        self._open_start = end
+        return [text[start - offset:stop - offset] for start, stop in sentence_indices]
+
+    def finish(self) -> ChatResponseState:
+        """
+        Mark the content as finished, segment it and return the final state.
+        """
+        self.state.content_finished = True
+        self.create_sentences()
+        return self.state.to_state()
 
     def create_sentences(self) -> List[str]:
         if not self.state.content_finished:
             return []
-        if len(self.state.sentence_indices) > 0:
-            return [
-                self.state.content[start:end]
-                for start, end in self.state.sentence_indices
-            ]
+        segmenter = self.segmenter
+        if not segmenter.finished:
+            # Content assigned directly to the state has not been fed yet.
+            content = self.state.content
+            segmenter.feed(content[segmenter.length:])
+            segmenter.finish()
+            self.state.sentence_indices = segmenter.sentence_indices
 
-        sentence_indices = []
         content = self.state.content
-        regex_sentence = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|!)\s|(?<=\n)"
-
-        start_index = 0
-        for match in re.finditer(regex_sentence, content):
-            end_index = match.start()
-            sentence = content[start_index:end_index].strip()
-            if sentence:
-                sentence_indices.append((start_index, end_index))
-            start_index = match.end()
-
-        # Handle the last sentence
-        if start_index < len(content):
-            sentence_indices.append((start_index, len(content)))
-        self.state = self.state.model_copy(
-            update={"sentence_indices": sentence_indices}
-        )
-
-        return [
-            self.state.content[start:end] for start, end in self.state.sentence_indices
-        ]
+        return [content[start:end] for start, end in self.state.sentence_indices]
@@ -1,11 +1,16 @@
+import hashlib
 import json
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
 from operator import itemgetter
 from typing import List
 import os
 import logging
 from langchain_community.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.language_models import BaseChatModel
 
+from .admission import AdmissionController
 from .models import Language
 
 COACH_SYSTEM_PROMPT = """You are an assistant trained to extract {learning_language} \
@@ -25,24 +30,91 @@ User says, "你好, Kyle。我叫[Your Name]。\
 Hěn gāoxìng rènshì nǐ!) "Hello, Kyle."
 Your response: ["你好!", "我叫", "很高兴认识你！"]"""
 
-# TODO - This is a good example of a class that could use a simpler model.
+
+class DetectionFailed(Exception):
+    """
+    The detector's reply could not be parsed. Failures are never cached, the
+    sentence goes without phrases this time only.
+    """
 
 
-class LanguageDetector:
+class LanguageDetectionStrategy(ABC):
     """
     Finds all the phrases or words in a message that are in the learning language.
     """
 
-    def __init__(self):
-        api_key = os.getenv("OPENAI_API_KEY")
-        self.llm = ChatOpenAI(
-            openai_api_key=api_key,
-            model_name="gpt-3.5-turbo",
-            temperature=0.0,
-        )
+    @abstractmethod
+    def detect(self, message: str, primary: Language, learning: Language) -> List[str]:
+        pass
+
+    async def adetect(
+        self, message: str, primary: Language, learning: Language
+    ) -> List[str]:
+        return self.detect(message, primary, learning)
+
+    def cache_namespace(self) -> str:
+        """
+        Identifies the detector's behaviour, so cached results are not reused
+        once the model or the prompt changes.
+        """
+        return type(self).__name__
+
+
+# TODO - This is a good example of a class that could use a simpler model.
+
+
+class LanguageDetector(LanguageDetectionStrategy):
+    """
+    Asks an LLM for the learning language phrases in a message, raising
+    DetectionFailed when its reply is not a JSON array.
+    """
+
+    def __init__(
+        self, llm: BaseChatModel = None, admission: AdmissionController = None
+    ):
+        if llm:
+            self.llm = llm
+        else:
+            api_key = os.getenv("OPENAI_API_KEY")
+            self.llm = ChatOpenAI(
+                openai_api_key=api_key,
+                model_name="gpt-3.5-turbo",
+                temperature=0.0,
+            )
+        # Bounds the detector calls in flight, an overloaded call raises
+        # Overloaded and its sentence goes without phrases.
+        if admission:
+            self.admission = admission
+        else:
+            self.admission = AdmissionController.from_env(
+                "detector", max_concurrency=16, max_queue=64, queue_timeout_ms=1000
+            )
+        self.chain = self._create_chain()
 
     def detect(self, message: str, primary: Language, learning: Language) -> List[str]:
         logging.info(f"Detecting {learning.value} phrases in {message=}")
+        with self.admission.limit_sync() if self.admission else nullcontext():
+            response = self.chain.invoke(
+                self._chain_input(message, primary, learning)
+            )
+        return self._parse_response(response)
+
+    async def adetect(
+        self, message: str, primary: Language, learning: Language
+    ) -> List[str]:
+        logging.info(f"Detecting {learning.value} phrases in {message=}")
+        async with self.admission.limit() if self.admission else nullcontext():
+            response = await self.chain.ainvoke(
+                self._chain_input(message, primary, learning)
+            )
+        return self._parse_response(response)
+
+    def cache_namespace(self) -> str:
+        model = getattr(self.llm, "model_name", type(self.llm).__name__)
+        prompt = hashlib.sha256(COACH_SYSTEM_PROMPT.encode("utf-8")).hexdigest()
+        return f"{type(self).__name__}:{model}:{prompt[:16]}"
+
+    def _create_chain(self):
         parameters = {
             "primary_language": itemgetter("primary_language"),
             "learning_language": itemgetter("learning_language"),
@@ -54,24 +126,23 @@ class LanguageDetector:
                 ("human", "{input}"),
             ]
         )
-        chain = parameters | prompt | self.llm
-        response = chain.invoke(
-            {
-                "primary_language": primary.value,
-                "learning_language": learning.value,
-                "input": message,
-            }
-        )
-        try:
-            learning_phrases = json.loads(response.content)
-            logging.info(f"Found learning phrases: {learning_phrases}")
-            if not isinstance(learning_phrases, list):
-                logging.error("Unable to parse response into array of strings.")
-                return []
+        return parameters | prompt | self.llm
 
-            return learning_phrases
+    @staticmethod
+    def _chain_input(message: str, primary: Language, learning: Language) -> dict:
+        return {
+            "primary_language": primary.value,
+            "learning_language": learning.value,
+            "input": message,
+        }
 
+    @staticmethod
+    def _parse_response(response) -> List[str]:
+        try:
+            learning_phrases = json.loads(response.content)
         except (AttributeError, TypeError, json.JSONDecodeError) as e:
-            logging.error(f"Failed to parse {response=}")
-            logging.error(f"Error processing response: {e}")
-            return []
+            raise DetectionFailed(f"Failed to parse {response=}: {e}") from e
+        if not isinstance(learning_phrases, list):
+            raise DetectionFailed(f"Expected an array of strings: {response=}")
+        logging.info(f"Found learning phrases: {learning_phrases}")
+        return learning_phrases
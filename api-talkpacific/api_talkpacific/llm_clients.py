@@ -0,0 +1,78 @@
+import os
+
+import httpx
+from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+from langchain_openai import ChatOpenAI
+
+COACH_MODEL = "gpt-3.5-turbo-1106"
+DETECTOR_MODEL = "gpt-3.5-turbo"
+
+
+class LLMClients:
+    """
+    Long-lived OpenAI chat models shared by every request.
+
+    The coach, summary and detector models share one keep-alive connection
+    pool per flavour (sync and async), so requests reuse open TLS connections
+    instead of building a client and a pool each. The app creates them at
+    startup and closes them at shutdown.
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30,
+        timeout: float = 60,
+        stream_to_stdout: bool = False,
+    ):
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http_client = httpx.Client(limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        # Echoing every token is a development aid, it is costly in production.
+        callbacks = [StreamingStdOutCallbackHandler()] if stream_to_stdout else None
+        self.coach_llm = ChatOpenAI(
+            openai_api_key=api_key,
+            model_name=COACH_MODEL,
+            streaming=True,
+            callbacks=callbacks,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+        )
+        # Writes the rolling summaries of SummaryHistory, nobody waits on a stream.
+        self.summary_llm = ChatOpenAI(
+            openai_api_key=api_key,
+            model_name=COACH_MODEL,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+        )
+        self.detector_llm = ChatOpenAI(
+            openai_api_key=api_key,
+            model_name=DETECTOR_MODEL,
+            temperature=0.0,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+        )
+
+    @staticmethod
+    def from_env() -> "LLMClients":
+        return LLMClients(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(
+                os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20)
+            ),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", 30)),
+            timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", 60)),
+            stream_to_stdout=os.getenv("LLM_STREAM_TO_STDOUT", "false").lower()
+            == "true",
+        )
+
+    async def aclose(self) -> None:
+        self.http_client.close()
+        await self.http_async_client.aclose()
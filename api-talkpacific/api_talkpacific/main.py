@@ -1,14 +1,32 @@
 import logging
-from typing import List, Tuple
-from fastapi import FastAPI, Request
+from typing import Callable, Dict, List, Optional, Tuple
+from bson import ObjectId
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse  # noqa: F401
-from concurrent.futures import ThreadPoolExecutor
+from fastapi.responses import (  # noqa: F401
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
-from .teacher_db import ConversationMemory, ConversationMessage
+from .teacher_db import ConversationMemory, ConversationMessage, MessageProjection
+from .admission import Overloaded
+from .singleflight import IdempotencyConflict
+from .coalescing import DeltaCoalescer
+from .detection_cache import MemoizedLanguageDetector
+from .frames import frame_encoder
 from .language_coach import LanguageCoach
+from .llm_clients import LLMClients
+from .metrics import (
+    REGISTRY,
+    SSE_FRAMES_SAVED,
+    SSE_STREAM_BYTES,
+    SSE_STREAM_FRAMES,
+)
+from .tracing import Trace, Tracer, activate
+from .transfer import export_ndjson
 from .models import (
     ChatResponseChunk,
     Language,
@@ -16,8 +34,9 @@ from .models import (
 
 load_dotenv()
 
-executor = ThreadPoolExecutor(max_workers=1)
+llmClients: LLMClients = None
 languageCoach: LanguageCoach = None
+tracer: Tracer = None
 
 app = FastAPI()
 
@@ -27,6 +46,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
@@ -37,12 +57,19 @@ async def startup_event():
         datefmt="%Y-%m-%d %H:%M:%S",
     )
     logging.info("Started translation service")
-    global languageCoach
-    languageCoach = LanguageCoach()
+    global llmClients, languageCoach, tracer
+    tracer = Tracer.from_env()
+    # Harnesses and tests may install their own coach before startup.
+    if languageCoach is None:
+        llmClients = LLMClients.from_env()
+        languageCoach = LanguageCoach(clients=llmClients)
 
 
 async def shutdown_event():
-    executor.shutdown(wait=True)
+    if languageCoach:
+        languageCoach.close()
+    if llmClients:
+        await llmClients.aclose()
 
 
 app.add_event_handler("startup", startup_event)
@@ -54,12 +81,71 @@ async def status():
     return {"status": "ok"}
 
 
+def cache_stats() -> Dict[Tuple[str, str], float]:
+    """
+    Counters of the caches and the write-behind queue of the current coach.
+    """
+    if languageCoach is None:
+        return {}
+    teacher_db = languageCoach.teacher_db
+    sources = {
+        "conversation": teacher_db.conversation_cache,
+        "write_behind": teacher_db.write_behind,
+        "detection": memoized_detector(languageCoach.language_detector),
+    }
+    return {
+        (cache, stat): value
+        for cache, source in sources.items()
+        if source
+        for stat, value in source.stats().items()
+    }
+
+
+def response_cache_stats() -> Dict[Tuple[str, str], float]:
+    if languageCoach is None or not languageCoach.response_cache:
+        return {}
+    return {
+        (language_pair, stat): value
+        for language_pair, stats in languageCoach.response_cache.stats().items()
+        for stat, value in stats.items()
+    }
+
+
+def memoized_detector(detector) -> MemoizedLanguageDetector | None:
+    while detector is not None:
+        if isinstance(detector, MemoizedLanguageDetector):
+            return detector
+        detector = getattr(detector, "fallback", None)
+    return None
+
+
+REGISTRY.callback_gauge(
+    "talkpacific_cache",
+    "Counters of the in-process caches and the write-behind queue.",
+    ["cache", "stat"],
+    cache_stats,
+)
+REGISTRY.callback_gauge(
+    "talkpacific_response_cache",
+    "Response cache lookups per language pair.",
+    ["language_pair", "stat"],
+    response_cache_stats,
+)
+
+
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 class ConversationCreateResponse(BaseModel):
     conversation_id: str
 
 
 @app.get("/create-conversation")
-async def create_conversation(
+def create_conversation(
     request: Request,
     primary: Language = Language.English,
     learning: Language = Language.Chinese,
@@ -85,7 +171,7 @@ class DeleteConversationRequest(BaseModel):
 
 
 @app.post("/delete-conversation")
-async def delete_conversation(
+def delete_conversation(
     request: DeleteConversationRequest,
 ) -> JSONResponse:
     logging.info(f"deleting conversation {request}")
@@ -96,11 +182,59 @@ async def delete_conversation(
         return JSONResponse(content={"status": "ok"})
 
 
+class FlightStreamingResponse(StreamingResponse):
+    """
+    Calls on_close once the response is over, even when the client left before
+    the stream started, so its flight is left and its trace finished.
+
+    A disconnect cancels the response, which then closes its generator right
+    away instead of leaving it to the garbage collector, so the coach stream
+    behind it is cancelled too.
+    """
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if hasattr(self.body_iterator, "aclose"):
+                await self.body_iterator.aclose()
+            self.on_close()
+
+
+def rejected_stream(error: Exception) -> JSONResponse:
+    logging.warning(f"rejected chat stream: {error}")
+    if isinstance(error, Overloaded):
+        return JSONResponse(
+            status_code=error.status_code,
+            content={"status": "error"},
+            headers={"Retry-After": str(error.retry_after_seconds)},
+        )
+    return JSONResponse(status_code=422, content={"status": "error"})
+
+
+def start_trace(request: Request) -> Optional[Trace]:
+    """
+    The active trace of a /send-message request, None without a tracer. The
+    flight's task copies the context, so the trace is activated there too.
+    """
+    if not tracer:
+        return None
+    trace = tracer.start("send_message", request.headers.get("traceparent"))
+    activate(trace)
+    return trace
+
+
 @app.get("/send-message")
 async def send_message(
     request: Request,
     conversation_id: str,
     message: str,
+    # Deltas are sent in frames of about this many bytes, 0 sends every token.
+    coalesce_bytes: int = None,
 ) -> StreamingResponse:
     url = (
         f"{request.url.scheme}://{request.url.netloc}/send-message?"
@@ -109,20 +243,61 @@ async def send_message(
     )
     logging.info(f"Requesting chat stream: {url=}")
 
-    async def generator():
-        stream = languageCoach.send_message(
-            conversation_id=conversation_id,
-            message=message,
+    coalescer = DeltaCoalescer.from_env(max_bytes=coalesce_bytes)
+    encoder = frame_encoder(request.headers.get("accept"))
+    trace = start_trace(request)
+    headers = {"X-Trace-Id": trace.trace_id} if trace else None
+    try:
+        flight = languageCoach.streams.flight(
+            conversation_id,
+            message,
+            lambda: languageCoach.asend_message(
+                conversation_id=conversation_id,
+                message=message,
+            ),
+            key=request.headers.get("idempotency-key"),
         )
+        # Only the request starting the flight takes a coach permit, once the
+        # conversation's earlier streams are done.
+        await languageCoach.streams.join(flight, languageCoach.admission)
+    except (IdempotencyConflict, Overloaded) as e:
+        if trace:
+            tracer.finish(trace)
+        return rejected_stream(e)
+
+    def close():
+        languageCoach.streams.leave(flight)
+        if trace:
+            tracer.finish(trace)
 
-        for chunk in stream:
-            if isinstance(chunk, ChatResponseChunk):
-                response_json = chunk.model_dump_json(exclude_unset=True)
-                yield f"data: {response_json}\n\n"
-            else:
-                logging.error(f"Expected a string, got: {type(chunk)}")
-
-    return StreamingResponse(generator(), media_type="text/event-stream")
+    async def generator():
+        stream = coalescer.coalesce(languageCoach.streams.subscribe(flight))
+
+        frames = 0
+        sent_bytes = 0
+        try:
+            async for chunk in stream:
+                if isinstance(chunk, ChatResponseChunk):
+                    frame = encoder.encode(chunk)
+                    frames += 1
+                    sent_bytes += len(frame)
+                    yield frame
+                else:
+                    logging.error(f"Expected a string, got: {type(chunk)}")
+        finally:
+            await stream.aclose()
+            language_pair = languageCoach.cached_language_pair(conversation_id)
+            SSE_STREAM_FRAMES.observe(frames, language_pair)
+            SSE_STREAM_BYTES.observe(sent_bytes, language_pair)
+            if coalescer.saved:
+                SSE_FRAMES_SAVED.inc(language_pair, amount=coalescer.saved)
+
+    return FlightStreamingResponse(
+        generator(),
+        on_close=close,
+        media_type=encoder.media_type,
+        headers=headers,
+    )
 
 
 class ConversationMemoryItem(BaseModel):
@@ -134,12 +309,22 @@ class ConversationMemoryItem(BaseModel):
 
 class ConversationsResponse(BaseModel):
     items: List[ConversationMemoryItem]
-
-
-@app.get("/conversations")
-async def conversations() -> ConversationsResponse:
-    logging.info("Requesting conversation history")
-    memories: List[ConversationMemory] = languageCoach.get_conversation_memories()
+    # Pass as cursor to get the next page, absent on the last page.
+    next_cursor: Optional[str] = None
+
+
+@app.get("/conversations", response_model_exclude_none=True)
+def conversations(
+    limit: int = Query(10, ge=1, le=100),
+    cursor: str = None,
+) -> ConversationsResponse:
+    logging.info(f"Requesting conversation history: {limit=}, {cursor=}")
+    if cursor and not ObjectId.is_valid(cursor):
+        return JSONResponse(status_code=400, content={"status": "error"})
+    # One more than the page tells whether there is a next one.
+    memories: List[ConversationMemory] = languageCoach.get_conversation_memories(
+        limit=limit + 1, after=cursor
+    )
     items = [
         ConversationMemoryItem(
             conversation_id=memory.conversation_id,
@@ -147,10 +332,12 @@ async def conversations() -> ConversationsResponse:
             learning=memory.learning.value,
             messages=[],
         )
-        for memory in memories
+        for memory in memories[:limit]
     ]
     response = ConversationsResponse(items=items)
-    logging.info(f"conversation history: {response}")
+    if len(memories) > limit:
+        response.next_cursor = items[-1].conversation_id
+    logging.info(f"returning conversations count: {len(response.items)}")
     return response
 
 
@@ -159,20 +346,75 @@ class MessageMemoryItem(BaseModel):
     position: int
     role: str
     content: str
-    sentence_indices: List[Tuple[int, int]]
-    learning_phrases: List[str]
+    # Absent with the content projection.
+    sentence_indices: Optional[List[Tuple[int, int]]] = None
+    learning_phrases: Optional[List[str]] = None
+    # Only set on assistant messages cut short by a disconnect.
+    truncated: Optional[bool] = None
 
 
 class MessagesResponse(BaseModel):
     items: List[MessageMemoryItem]
-
-
-@app.get("/messages")
-async def messsages(
+    # Pass as cursor to get the next page, absent on the last page.
+    next_cursor: Optional[int] = None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header lists etag, compared weakly.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def messages_etag(
+    version: int,
+    cursor: int,
+    end: int,
+    limit: Optional[int],
+    fields: MessageProjection,
+) -> str:
+    """
+    ETag of the page holding the positions between cursor and end at version.
+    """
+    return f'"{version}-{cursor}-{end}-{limit or 0}-{fields.value}"'
+
+
+@app.get("/messages", response_model_exclude_none=True)
+def messsages(
+    request: Request,
+    response: Response,
     conversation_id: str,
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: int = Query(-1, ge=-1),
+    # Only the messages after the last position the client holds.
+    since_position: int = Query(None, ge=-1),
+    fields: MessageProjection = MessageProjection.Full,
 ) -> MessagesResponse:
-    logging.info("Requesting message history")
-    memories: List[ConversationMessage] = languageCoach.get_messages(conversation_id)
+    logging.info(
+        f"Requesting message history: {limit=}, {cursor=}, {since_position=}, "
+        f"{fields=}"
+    )
+    if since_position is not None:
+        cursor = max(cursor, since_position)
+    # next_position moves before a message is written, so it only tells the
+    # page the client holds is still current; the tag sent is built from the
+    # messages actually served.
+    current = languageCoach.get_messages_version(conversation_id)
+    if current:
+        version, next_position = current
+        end = min(next_position, cursor + 1 + limit) if limit else next_position
+        etag = messages_etag(version, cursor, max(end, cursor + 1), limit, fields)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    memories: List[ConversationMessage] = languageCoach.get_messages(
+        conversation_id,
+        after_position=cursor,
+        limit=limit + 1 if limit else None,
+        projection=fields,
+    )
     items = [
         MessageMemoryItem(
             conversation_id=memory.conversation_id,
@@ -181,22 +423,39 @@ async def messsages(
             content=memory.content,
             sentence_indices=memory.sentence_indices,
             learning_phrases=memory.learning_phrases,
+            truncated=memory.truncated or None,
         )
-        for memory in memories
+        for memory in memories[:limit]
     ]
+    if current:
+        end = items[-1].position + 1 if items else cursor + 1
+        response.headers["ETag"] = messages_etag(version, cursor, end, limit, fields)
     response = MessagesResponse(items=items)
+    if limit and len(memories) > limit:
+        response.next_cursor = items[-1].position
     logging.info(f"returning messages count: {len(response.items)}")
-    logging.info(f"message history: {response}")
     return response
 
 
+# Every conversation, or one, with its messages as NDJSON, see transfer.py.
+@app.get("/export")
+def export(conversation_id: str = None, gzip: bool = False) -> StreamingResponse:
+    logging.info(f"exporting conversations: {conversation_id=}, {gzip=}")
+    if conversation_id and not ObjectId.is_valid(conversation_id):
+        return JSONResponse(status_code=400, content={"status": "error"})
+    return StreamingResponse(
+        export_ndjson(languageCoach.teacher_db, conversation_id, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+    )
+
+
 class DeleteMessagesRequest(BaseModel):
     conversation_id: str
     position: int
 
 
 @app.post("/delete-messages")
-async def delete_messages(
+def delete_messages(
     request: DeleteMessagesRequest,
 ) -> JSONResponse:
     logging.info(f"deleting messages {request}")
@@ -0,0 +1,430 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import wraps
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Upper bounds in seconds, from a cached Mongo read to a slow LLM call.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+SIZE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10_000, 30_000, 100_000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        pass
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values: str, value: float) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+
+class CallbackGauge(Metric):
+    """
+    Gauge read from a callback at scrape time, for counters kept elsewhere.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        callback: Callable[[], Dict[LabelValues, float]],
+    ):
+        super().__init__(name, documentation, label_names)
+        self.callback = callback
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+            for labels, value in self.callback().items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket and +Inf, sum]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = (
+                    [0] * (len(self.buckets) + 1),
+                    [0.0],
+                )
+            state[0][index] += 1
+            state[1][0] += value
+
+    def time(self, *label_values: str) -> "Timer":
+        return Timer(self, label_values)
+
+    def timed(self, *label_values: str) -> Callable:
+        """
+        Decorator observing the duration of every call.
+        """
+
+        def decorate(function: Callable) -> Callable:
+            @wraps(function)
+            def call(*args, **kwargs):
+                with Timer(self, label_values):
+                    return function(*args, **kwargs)
+
+            return call
+
+        return decorate
+
+    def count(self, *label_values: str) -> int:
+        state = self._values.get(label_values)
+        return sum(state[0]) if state else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = [
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self._values.items()
+            ]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            bounds = self.buckets + (float("inf"),)
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.label_names, labels, le)} "
+                    f"{cumulative}"
+                )
+            label_text = _labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_number(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Timer:
+    """
+    Context manager observing the seconds spent in its block.
+    """
+
+    __slots__ = ("histogram", "label_values", "started")
+
+    def __init__(self, histogram: Histogram, label_values: LabelValues):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(
+            time.perf_counter() - self.started, *self.label_values
+        )
+
+
+class Registry:
+    """
+    In-process metrics, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names=()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names=()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def callback_gauge(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        callback: Callable[[], Dict[LabelValues, float]],
+    ) -> CallbackGauge:
+        return self.register(CallbackGauge(name, documentation, label_names, callback))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names=(),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TEACHER_DB_SECONDS = REGISTRY.histogram(
+    "talkpacific_teacher_db_seconds",
+    "Duration of TeacherDB operations.",
+    ["operation"],
+)
+TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "talkpacific_time_to_first_token_seconds",
+    "Time from receiving a message to the first token of the coach.",
+    ["language_pair"],
+)
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "talkpacific_tokens_per_second",
+    "Rate of the coach stream after its first token.",
+    ["language_pair"],
+    buckets=RATE_BUCKETS,
+)
+DETECTOR_SECONDS = REGISTRY.histogram(
+    "talkpacific_detector_seconds",
+    "Duration of learning phrase detection per sentence.",
+    ["language_pair"],
+)
+SSE_STREAM_BYTES = REGISTRY.histogram(
+    "talkpacific_sse_stream_bytes",
+    "Bytes sent per /send-message stream.",
+    ["language_pair"],
+    buckets=SIZE_BUCKETS,
+)
+SSE_STREAM_FRAMES = REGISTRY.histogram(
+    "talkpacific_sse_stream_frames",
+    "SSE frames sent per /send-message stream.",
+    ["language_pair"],
+    buckets=SIZE_BUCKETS,
+)
+SSE_FRAMES_SAVED = REGISTRY.counter(
+    "talkpacific_sse_frames_saved_total",
+    "Chunks merged into another SSE frame by delta coalescing.",
+    ["language_pair"],
+)
+ACTIVE_STREAMS = REGISTRY.gauge(
+    "talkpacific_active_streams",
+    "Coach streams in flight.",
+    ["language_pair"],
+)
+CANCELLED_STREAMS = REGISTRY.counter(
+    "talkpacific_cancelled_streams_total",
+    "Coach streams cancelled because their client disconnected.",
+    ["language_pair"],
+)
+TOKENS_SAVED = REGISTRY.counter(
+    "talkpacific_tokens_saved_total",
+    "Estimated tokens not generated by cancelled coach streams.",
+    ["language_pair"],
+)
+ADMISSION_ACTIVE = REGISTRY.gauge(
+    "talkpacific_admission_active",
+    "Calls admitted and running per admission controller.",
+    ["controller"],
+)
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    "talkpacific_admission_queue_depth",
+    "Calls waiting to be admitted per admission controller.",
+    ["controller"],
+)
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "talkpacific_admission_wait_seconds",
+    "Time admitted calls waited in the queue.",
+    ["controller"],
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "talkpacific_admission_rejected_total",
+    "Calls turned away because the queue was full or their wait timed out.",
+    ["controller", "reason"],
+)
+
+
+class StreamObserver:
+    """
+    Observations of one coach stream. token is the only call per chunk and
+    only counts, the histograms are updated at the first and the last token,
+    which are also marked on the request's trace when it has one.
+
+    The tokens a cancelled stream saved are estimated from the moving mean of
+    the tokens of the completed streams of its language pair.
+    """
+
+    # Mean tokens per completed stream by language pair, and its smoothing.
+    # Streams of the sync path finish on worker threads, hence the lock.
+    expected_tokens: Dict[str, float] = {}
+    EXPECTED_TOKENS_WEIGHT = 0.1
+    _expected_tokens_lock = threading.Lock()
+
+    __slots__ = (
+        "language_pair",
+        "started",
+        "trace",
+        "first_token",
+        "tokens",
+        "_closed",
+    )
+
+    def __init__(self, language_pair: str, started: float = None, trace=None):
+        self.language_pair = language_pair
+        self.trace = trace
+        self.started = started if started is not None else time.perf_counter()
+        self.first_token = None
+        self.tokens = 0
+        self._closed = False
+        ACTIVE_STREAMS.inc(language_pair)
+
+    def __enter__(self) -> "StreamObserver":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def token(self) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+            TIME_TO_FIRST_TOKEN_SECONDS.observe(
+                self.first_token - self.started, self.language_pair
+            )
+            if self.trace:
+                self.trace.mark("first_token")
+        self.tokens += 1
+
+    def tokens_finished(self) -> None:
+        """
+        Observe the token rate once the model stream ends.
+        """
+        if self.trace:
+            self.trace.mark("stream_end")
+        with StreamObserver._expected_tokens_lock:
+            expected = StreamObserver.expected_tokens.get(self.language_pair)
+            if expected is None:
+                expected = self.tokens
+            StreamObserver.expected_tokens[self.language_pair] = expected + (
+                self.tokens - expected
+            ) * self.EXPECTED_TOKENS_WEIGHT
+        if self.tokens > 1:
+            elapsed = time.perf_counter() - self.first_token
+            if elapsed > 0:
+                TOKENS_PER_SECOND.observe(
+                    (self.tokens - 1) / elapsed, self.language_pair
+                )
+
+    def cancelled(self) -> None:
+        """
+        Count a stream whose client left before it finished.
+        """
+        CANCELLED_STREAMS.inc(self.language_pair)
+        with StreamObserver._expected_tokens_lock:
+            expected = StreamObserver.expected_tokens.get(self.language_pair, 0)
+        saved = round(expected - self.tokens)
+        if saved > 0:
+            TOKENS_SAVED.inc(self.language_pair, amount=saved)
+        if self.trace:
+            self.trace.mark("cancelled")
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            ACTIVE_STREAMS.dec(self.language_pair)
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 from pydantic import BaseModel
 
 
@@ -52,5 +52,10 @@ class ChatResponseChunk(BaseModel):
     content_id: str
     delta: str
     is_finished: bool
+    # Sentences closed by this chunk while streaming, every sentence when finished.
     sentence_indices: List[Tuple[int, int]] = None
     learning_phrases: List[str] = None
+    # (sentence index, phrases) for sentences whose detection just completed.
+    sentence_learning_phrases: List[Tuple[int, List[str]]] = None
+    # Milliseconds per stage of the request, on the final chunk in debug mode.
+    timings: Dict[str, float] = None
@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+from .models import ChatResponseChunk, Language
+
+# Fields that belong to the request being answered, not to the cached response.
+REQUEST_FIELDS = {"conversation_id", "content_id", "timings"}
+
+CachedResponse = Tuple[dict, ...]
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+def response_key(
+    model: str,
+    system_prompt: str,
+    primary: Language,
+    learning: Language,
+    history: List[BaseMessage],
+    message: str,
+) -> str:
+    """
+    Hash of everything that determines the coach's response.
+    """
+    payload = [
+        model,
+        system_prompt,
+        primary.value,
+        learning.value,
+        [(m.type, normalize_text(m.content)) for m in history],
+        normalize_text(message),
+    ]
+    encoded = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of complete coach responses, kept as the chunk sequence that was
+    streamed so a hit replays the same frames.
+
+    An in-process LRU with a TTL sits in front of an optional Mongo collection
+    shared by every worker, whose documents expire through a TTL index. Only
+    opening turns are cached unless with_history is set, a conversation with
+    history rarely repeats and would only fill the cache.
+    """
+
+    def __init__(
+        self,
+        collection: Collection = None,
+        max_entries: int = 1024,
+        ttl_seconds: float = 24 * 3600,
+        with_history: bool = False,
+    ):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.with_history = with_history
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self._entries: OrderedDict[str, Tuple[CachedResponse, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        if self.collection is not None:
+            try:
+                self.collection.create_index(
+                    [("expires_at", ASCENDING)], expireAfterSeconds=0
+                )
+            except PyMongoError as e:
+                logging.error(f"Failed to create the response cache index: {e}")
+
+    @staticmethod
+    def from_env(collection: Collection = None) -> Optional["ResponseCache"]:
+        """
+        Built from the RESPONSE_CACHE_* variables, None unless enabled.
+        """
+        if os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() != "true":
+            return None
+        persistent = os.getenv("RESPONSE_CACHE_PERSISTENT", "true").lower() == "true"
+        return ResponseCache(
+            collection=collection if persistent else None,
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024)),
+            ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 24 * 3600)),
+            with_history=os.getenv("RESPONSE_CACHE_WITH_HISTORY", "false").lower()
+            == "true",
+        )
+
+    def accepts(self, history: List[BaseMessage]) -> bool:
+        return self.with_history or not history
+
+    def get(self, key: str, language_pair: str) -> Optional[CachedResponse]:
+        response = self._get_local(key)
+        if response is None and self.collection is not None:
+            response = self._get_persistent(key)
+        self._record(language_pair, response is not None)
+        return response
+
+    async def aget(self, key: str, language_pair: str) -> Optional[CachedResponse]:
+        response = self._get_local(key)
+        if response is None and self.collection is not None:
+            response = await asyncio.to_thread(self._get_persistent, key)
+        self._record(language_pair, response is not None)
+        return response
+
+    def put(self, key: str, chunks: List[ChatResponseChunk]) -> None:
+        response = self._put_local(key, chunks)
+        if self.collection is not None:
+            self._put_persistent(key, response)
+
+    async def aput(self, key: str, chunks: List[ChatResponseChunk]) -> None:
+        response = self._put_local(key, chunks)
+        if self.collection is not None:
+            await asyncio.to_thread(self._put_persistent, key, response)
+
+    @staticmethod
+    def replay(
+        response: CachedResponse, conversation_id: str, content_id: str
+    ) -> List[ChatResponseChunk]:
+        """
+        The cached chunks, addressed to conversation_id and content_id.
+        """
+        return [
+            ChatResponseChunk.model_construct(
+                conversation_id=conversation_id, content_id=content_id, **fields
+            )
+            for fields in response
+        ]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Hits, misses and hit rate per language pair.
+        """
+        with self._lock:
+            pairs = set(self.hits) | set(self.misses)
+            stats = {}
+            for pair in sorted(pairs):
+                hits = self.hits.get(pair, 0)
+                misses = self.misses.get(pair, 0)
+                stats[pair] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses),
+                }
+            return stats
+
+    def _record(self, language_pair: str, hit: bool) -> None:
+        with self._lock:
+            counts = self.hits if hit else self.misses
+            counts[language_pair] = counts.get(language_pair, 0) + 1
+
+    def _get_local(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def _put_local(self, key: str, chunks: List[ChatResponseChunk]) -> CachedResponse:
+        response = tuple(
+            chunk.model_dump(exclude_unset=True, exclude=REQUEST_FIELDS)
+            for chunk in chunks
+        )
+        self._store_local(key, response, time.monotonic() + self.ttl_seconds)
+        return response
+
+    def _store_local(self, key: str, response: CachedResponse, expires_at: float):
+        with self._lock:
+            self._entries[key] = (response, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_persistent(self, key: str) -> Optional[CachedResponse]:
+        now = datetime.now(timezone.utc)
+        try:
+            document = self.collection.find_one(
+                {"_id": key, "expires_at": {"$gt": now}}
+            )
+        except PyMongoError as e:
+            logging.error(f"Failed to read the response cache: {e}")
+            return None
+        if document is None:
+            return None
+        response = tuple(self._from_document(fields) for fields in document["chunks"])
+        expires_at = document["expires_at"].replace(tzinfo=timezone.utc)
+        remaining = (expires_at - now).total_seconds()
+        self._store_local(key, response, time.monotonic() + remaining)
+        return response
+
+    @staticmethod
+    def _from_document(fields: dict) -> dict:
+        """
+        Restore the tuples that BSON stores as arrays.
+        """
+        if fields.get("sentence_indices"):
+            fields["sentence_indices"] = [
+                tuple(indices) for indices in fields["sentence_indices"]
+            ]
+        if fields.get("sentence_learning_phrases"):
+            fields["sentence_learning_phrases"] = [
+                tuple(phrases) for phrases in fields["sentence_learning_phrases"]
+            ]
+        return fields
+
+    def _put_persistent(self, key: str, response: CachedResponse) -> None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        try:
+            self.collection.replace_one(
+                {"_id": key},
+                {"chunks": list(response), "expires_at": expires_at},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            logging.error(f"Failed to write the response cache: {e}")
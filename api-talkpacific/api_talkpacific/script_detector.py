@@ -0,0 +1,93 @@
+import logging
+import re
+from typing import Dict, FrozenSet, List, Pattern
+
+from .language_detector import LanguageDetectionStrategy
+from .models import Language
+
+# Unicode ranges of the letters of each script, as regex character class bodies.
+SCRIPT_RANGES: Dict[str, str] = {
+    "latin": "A-Za-zÀ-ÖØ-öø-ɏḀ-ỿ",
+    "han": "㐀-䶿一-鿿豈-﫿々〇",
+    "kana": "぀-ゟ゠-ヿㇰ-ㇿｦ-ﾟ",
+    "hangul": "ᄀ-ᇿ㄰-㆏가-힯",
+    "cyrillic": "Ѐ-ԯ",
+    "devanagari": "ऀ-ॣ०-ॿ",
+    "bengali": "ঀ-৿",
+}
+
+LANGUAGE_SCRIPTS: Dict[Language, FrozenSet[str]] = {
+    Language.English: frozenset({"latin"}),
+    Language.Chinese: frozenset({"han"}),
+    Language.Mandarin: frozenset({"han"}),
+    Language.Cantonese: frozenset({"han"}),
+    Language.Spanish: frozenset({"latin"}),
+    Language.French: frozenset({"latin"}),
+    Language.Ukrainian: frozenset({"cyrillic"}),
+    Language.Korean: frozenset({"hangul"}),
+    Language.Japanese: frozenset({"han", "kana"}),
+    Language.Hindi: frozenset({"devanagari"}),
+    Language.Bengali: frozenset({"bengali"}),
+    Language.Portuguese: frozenset({"latin"}),
+    Language.German: frozenset({"latin"}),
+    Language.Russian: frozenset({"cyrillic"}),
+    Language.Polish: frozenset({"latin"}),
+    Language.Turkish: frozenset({"latin"}),
+    Language.Italian: frozenset({"latin"}),
+}
+
+# Characters that keep a phrase going when more of the script follows them.
+PHRASE_JOINERS = " 　,，、'’\\-·・"
+# Sentence punctuation kept at the end of a phrase, e.g. "你好!" or "认识你！".
+PHRASE_TERMINATORS = ".!?。！？…।॥"
+
+
+def _phrase_pattern(scripts: FrozenSet[str]) -> Pattern:
+    letters = "".join(SCRIPT_RANGES[script] for script in sorted(scripts))
+    return re.compile(
+        f"[{letters}]+(?:[{PHRASE_JOINERS}]+[{letters}]+)*[{PHRASE_TERMINATORS}]*"
+    )
+
+
+class ScriptLanguageDetector(LanguageDetectionStrategy):
+    """
+    Extracts learning language phrases by Unicode script, without an LLM call.
+
+    Only works when the learning and primary languages share no script, e.g.
+    Chinese and English. Other pairs, such as Spanish and English, are handed to
+    the fallback strategy.
+    """
+
+    def __init__(self, fallback: LanguageDetectionStrategy = None):
+        self.fallback = fallback
+        self._patterns: Dict[FrozenSet[str], Pattern] = {}
+
+    @staticmethod
+    def supports(primary: Language, learning: Language) -> bool:
+        return LANGUAGE_SCRIPTS[primary].isdisjoint(LANGUAGE_SCRIPTS[learning])
+
+    def detect(self, message: str, primary: Language, learning: Language) -> List[str]:
+        if self.supports(primary, learning):
+            return self._extract(message, learning)
+        if self.fallback:
+            return self.fallback.detect(message, primary, learning)
+        logging.warning(f"No detector for {primary.value} and {learning.value}")
+        return []
+
+    async def adetect(
+        self, message: str, primary: Language, learning: Language
+    ) -> List[str]:
+        if self.supports(primary, learning):
+            return self._extract(message, learning)
+        if self.fallback:
+            return await self.fallback.adetect(message, primary, learning)
+        logging.warning(f"No detector for {primary.value} and {learning.value}")
+        return []
+
+    def _extract(self, message: str, learning: Language) -> List[str]:
+        scripts = LANGUAGE_SCRIPTS[learning]
+        pattern = self._patterns.get(scripts)
+        if pattern is None:
+            pattern = self._patterns[scripts] = _phrase_pattern(scripts)
+        # Unique phrases in order of first appearance.
+        return list(dict.fromkeys(pattern.findall(message)))
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from .language_detector import LanguageDetectionStrategy
+from .metrics import DETECTOR_SECONDS
+from .models import Language
+
+
+class SentencePhraseDetection(ABC):
+    """
+    Detects learning phrases sentence by sentence while the response streams.
+
+    Sentences are numbered in the order they are submitted, which matches the
+    response's sentence_indices. Merged results keep sentence order and report
+    each phrase once, like a single detection over the whole response.
+    """
+
+    def __init__(
+        self,
+        language_detector: LanguageDetectionStrategy,
+        primary: Language,
+        learning: Language,
+    ):
+        self.language_detector = language_detector
+        self.primary = primary
+        self.learning = learning
+        self.language_pair = f"{primary.value}-{learning.value}"
+        self.results: Dict[int, List[str]] = {}
+        self._pending: List[Tuple[int, asyncio.Future]] = []
+        self._submitted = 0
+
+    def submit(self, sentences: List[str]) -> None:
+        for sentence in sentences:
+            index = self._submitted
+            self._submitted += 1
+            if sentence.strip():
+                self._pending.append((index, self._start(sentence)))
+            else:
+                self.results[index] = []
+
+    def submit_remaining(self, content: str, sentence_indices: List[Tuple[int, int]]):
+        """
+        Submit the sentences that closed when the stream finished.
+        """
+        remaining = sentence_indices[self._submitted:]
+        self.submit([content[start:end] for start, end in remaining])
+
+    def pop_completed(self) -> List[Tuple[int, List[str]]]:
+        """
+        Results of the detections that finished since the last call.
+        """
+        completed = []
+        pending = []
+        for index, future in self._pending:
+            if future.done():
+                self.results[index] = self._result(index, future)
+                completed.append((index, self.results[index]))
+            else:
+                pending.append((index, future))
+        self._pending = pending
+        return completed
+
+    def learning_phrases(self) -> List[str]:
+        """
+        Merged phrases of every completed sentence.
+        """
+        merged = dict.fromkeys(
+            phrase for index in sorted(self.results) for phrase in self.results[index]
+        )
+        return list(merged)
+
+    def cancel(self) -> None:
+        """
+        Drop the detections not finished yet, those not started never call the
+        detector.
+        """
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+
+    @abstractmethod
+    def _start(self, sentence: str):
+        pass
+
+    @staticmethod
+    def _result(index: int, future) -> List[str]:
+        try:
+            return future.result()
+        except asyncio.CancelledError:
+            # Cancelled with the response, the sentence has no phrases.
+            return []
+        except Exception as e:
+            logging.error(f"Failed to detect phrases in sentence {index}: {e}")
+            return []
+
+
+class AsyncSentencePhraseDetection(SentencePhraseDetection):
+    """
+    Runs each sentence's detection as an asyncio task, at most max_concurrency
+    at a time per response.
+    """
+
+    def __init__(
+        self,
+        language_detector: LanguageDetectionStrategy,
+        primary: Language,
+        learning: Language,
+        max_concurrency: int,
+    ):
+        super().__init__(language_detector, primary, learning)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _start(self, sentence: str) -> asyncio.Task:
+        return asyncio.create_task(self._detect(sentence))
+
+    async def _detect(self, sentence: str) -> List[str]:
+        async with self._semaphore:
+            with DETECTOR_SECONDS.time(self.language_pair):
+                return await self.language_detector.adetect(
+                    sentence, self.primary, self.learning
+                )
+
+    async def wait(self) -> None:
+        if self._pending:
+            await asyncio.wait([future for _, future in self._pending])
@@ -0,0 +1,81 @@
+import re
+from typing import List, Tuple
+
+# A sentence ends at whitespace after terminal punctuation (skipping
+# abbreviations such as "e.g." and "Mr.") or right after a newline.
+SENTENCE_BOUNDARY = re.compile(
+    r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|!)\s|(?<=\n)"
+)
+
+# Longest lookbehind in SENTENCE_BOUNDARY, in characters.
+SENTENCE_LOOKBEHIND = 4
+
+
+class SentenceSegmenter:
+    """
+    Splits streamed content into sentences as it arrives.
+
+    Each feed only scans the appended delta plus a SENTENCE_LOOKBEHIND window,
+    so segmenting a whole response is linear in its length. The indices match
+    a single pass of SENTENCE_BOUNDARY over the complete content.
+    """
+
+    __slots__ = (
+        "sentence_indices",
+        "length",
+        "finished",
+        "_tail",
+        "_sentence_start",
+        "_has_text",
+        "_last_empty_match",
+    )
+
+    def __init__(self):
+        self.sentence_indices: List[Tuple[int, int]] = []
+        self.length = 0
+        self.finished = False
+        self._tail = ""
+        self._sentence_start = 0
+        self._has_text = False
+        self._last_empty_match = -1
+
+    def feed(self, delta: str) -> List[Tuple[int, int]]:
+        """
+        Append delta and return the sentences it closed.
+        """
+        text = self._tail + delta
+        offset = self.length - len(self._tail)
+        checked = self.length
+        closed = []
+        for match in SENTENCE_BOUNDARY.finditer(text, len(self._tail)):
+            start = match.start() + offset
+            end = match.end() + offset
+            # An empty match at the old end of content was already handled.
+            if start == end == self._last_empty_match:
+                continue
+            if not self._has_text:
+                self._has_text = bool(text[checked - offset:start - offset].strip())
+            if self._has_text:
+                closed.append((self._sentence_start, start))
+            if start == end:
+                self._last_empty_match = start
+            self._sentence_start = checked = end
+            self._has_text = False
+
+        if not self._has_text:
+            self._has_text = bool(text[checked - offset:].strip())
+        self.length += len(delta)
+        self._tail = text[-SENTENCE_LOOKBEHIND:]
+        self.sentence_indices.extend(closed)
+        return closed
+
+    def finish(self) -> List[Tuple[int, int]]:
+        """
+        Close the trailing sentence, if any, and return it.
+        """
+        self.finished = True
+        if self._sentence_start < self.length:
+            last = (self._sentence_start, self.length)
+            self.sentence_indices.append(last)
+            return [last]
+        return []
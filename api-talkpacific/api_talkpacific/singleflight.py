@@ -0,0 +1,233 @@
+"""
+Serializes the coach streams of a conversation and shares them between
+duplicate requests.
+
+Every stream runs as a flight: a task holding the conversation's lock while
+it pumps the coach's chunks into a buffer, which its subscribers replay and
+then follow. Requests on the same conversation run one after the other, so
+each turn sees the history of the one before. Requests carrying the same
+Idempotency-Key join the flight of the first, or replay it once finished,
+and never reach the LLM again. Only a flight takes a permit of the coach's
+admission controller, once it holds the lock, so neither joined requests nor
+those waiting for their turn use up the limit. A flight is cancelled when its
+last subscriber leaves before it finished.
+
+All of this holds within one process. Across workers, either route requests
+by conversation_id at the load balancer so a conversation always lands on
+the same worker, or move both parts into Mongo:
+
+- the lock becomes a lease on the conversation document, taken with
+  update_one({"_id": id, "lease_until": {"$lt": now}}, {"$set": ...}) and
+  renewed while the stream runs;
+- the idempotency record becomes a document with a unique index on
+  (conversation_id, key) inserted before streaming. The worker whose insert
+  fails waits for the record's final chunks, like the persistent response
+  cache stores them, instead of calling the LLM.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .admission import AdmissionController, Overloaded
+from .models import ChatResponseChunk
+
+StreamFactory = Callable[[], AsyncIterator[ChatResponseChunk]]
+
+
+class IdempotencyConflict(Exception):
+    """
+    An idempotency key was reused for a different message.
+    """
+
+
+class _Flight:
+    def __init__(self, conversation_id: str, message: str, start: StreamFactory):
+        self.conversation_id = conversation_id
+        self.message = message
+        self.start = start
+        self.chunks: List[ChatResponseChunk] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.finished_at = 0.0
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Set once the flight holds its lock and permit, or ended without.
+        self.started = asyncio.Event()
+        self.updated = asyncio.Condition()
+
+
+class ConversationStreams:
+    """
+    The flights of this process, see the module docstring. Finished flights
+    with an idempotency key are kept ttl_seconds for retries, at most
+    max_entries of them.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.joined = 0
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self._flights: OrderedDict[Tuple[str, str], _Flight] = OrderedDict()
+
+    @staticmethod
+    def from_env() -> "ConversationStreams":
+        return ConversationStreams(
+            ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 300)),
+            max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 256)),
+        )
+
+    def flight(
+        self,
+        conversation_id: str,
+        message: str,
+        start: StreamFactory,
+        key: str = None,
+    ) -> _Flight:
+        """
+        The flight of the request, a new one unless key matches one in flight
+        or recently finished. start creates the coach stream once the flight
+        runs. Raises IdempotencyConflict when key was used for another message.
+        """
+        if not key:
+            return _Flight(conversation_id, message, start)
+        self._expire()
+        flight = self._flights.get((conversation_id, key))
+        if flight:
+            if flight.message != message:
+                raise IdempotencyConflict(f"{key=} was used for another message")
+            self.joined += 1
+            logging.info(f"joining stream of {conversation_id=}, {key=}")
+            return flight
+        flight = _Flight(conversation_id, message, start)
+        self._flights[(conversation_id, key)] = flight
+        return flight
+
+    async def join(
+        self, flight: _Flight, admission: AdmissionController = None
+    ) -> None:
+        """
+        Hold the flight for a response, starting it if it is not running yet.
+        Every join is paired with a leave once the response is over.
+
+        A flight started here takes a permit of admission once it holds the
+        conversation's lock, and the join returns when it did. Joining a
+        started flight needs no permit. Raises Overloaded, holding nothing,
+        when the flight was turned away.
+        """
+        flight.subscribers += 1
+        if flight.task is None:
+            flight.task = asyncio.create_task(self._run(flight, admission))
+        try:
+            await flight.started.wait()
+        except BaseException:
+            self.leave(flight)
+            raise
+        if isinstance(flight.error, Overloaded):
+            self.leave(flight)
+            raise flight.error
+
+    def leave(self, flight: _Flight) -> None:
+        """
+        Release a join, cancelling the flight when the last holder left before
+        it finished.
+        """
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.done:
+            self._forget(flight)
+            flight.task.cancel()
+
+    async def subscribe(self, flight: _Flight) -> AsyncIterator[ChatResponseChunk]:
+        """
+        Every chunk of a joined flight from the first.
+        """
+        index = 0
+        while True:
+            while index < len(flight.chunks):
+                yield flight.chunks[index]
+                index += 1
+            if flight.done:
+                break
+            async with flight.updated:
+                await flight.updated.wait_for(
+                    lambda: flight.done or index < len(flight.chunks)
+                )
+        if flight.error:
+            raise flight.error
+
+    async def _run(
+        self, flight: _Flight, admission: Optional[AdmissionController]
+    ) -> None:
+        lock = self._acquire_lock(flight.conversation_id)
+        permit = None
+        try:
+            async with lock:
+                if admission:
+                    permit = await admission.admit()
+                flight.started.set()
+                # Closed on cancellation too, so the coach ends its LLM stream.
+                async with aclosing(flight.start()) as stream:
+                    async for chunk in stream:
+                        flight.chunks.append(chunk)
+                        async with flight.updated:
+                            flight.updated.notify_all()
+        except (Exception, asyncio.CancelledError) as e:
+            logging.info(f"stream of {flight.conversation_id=} ended early: {e!r}")
+            flight.error = e
+            self._forget(flight)
+        finally:
+            if permit:
+                permit.release()
+            self._release_lock(flight.conversation_id)
+            flight.started.set()
+            flight.done = True
+            flight.finished_at = time.monotonic()
+            async with flight.updated:
+                flight.updated.notify_all()
+
+    def _acquire_lock(self, conversation_id: str) -> asyncio.Lock:
+        """
+        The conversation's lock, which lives as long as flights use it.
+        """
+        lock, users = self._locks.get(conversation_id, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[conversation_id] = (lock, users + 1)
+        return lock
+
+    def _release_lock(self, conversation_id: str) -> None:
+        lock, users = self._locks[conversation_id]
+        if users == 1:
+            del self._locks[conversation_id]
+        else:
+            self._locks[conversation_id] = (lock, users - 1)
+
+    def _forget(self, flight: _Flight) -> None:
+        """
+        Drop a failed or abandoned flight, so a retry runs it again.
+        """
+        for key, known in list(self._flights.items()):
+            if known is flight:
+                del self._flights[key]
+
+    def _expire(self) -> None:
+        """
+        Drop the flights past their TTL, then the oldest that are finished or
+        were never started, leaving room for a new flight within max_entries.
+        Running flights stay so they can still be joined.
+        """
+        now = time.monotonic()
+        for key, flight in list(self._flights.items()):
+            if flight.done and now - flight.finished_at > self.ttl_seconds:
+                del self._flights[key]
+        excess = len(self._flights) + 1 - self.max_entries
+        for key, flight in list(self._flights.items()):
+            if excess <= 0:
+                break
+            if flight.done or flight.task is None:
+                del self._flights[key]
+                excess -= 1
@@ -0,0 +1,262 @@
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "is_mark")
+
+    def __init__(self, name: str, start: float, end: float = None, is_mark=False):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.is_mark = is_mark
+
+
+class _SpanTimer:
+    __slots__ = ("trace", "span")
+
+    def __init__(self, trace: "Trace", name: str):
+        self.trace = trace
+        self.span = Span(name, 0)
+
+    def __enter__(self) -> Span:
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, *exc_info) -> None:
+        self.span.end = time.perf_counter()
+        self.trace.spans.append(self.span)
+
+
+class _NullSpan:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """
+    Timeline of one request: spans with a duration, marks at a point in time
+    and totals of work spread over many small calls.
+
+    An unsampled trace keeps its id for the response header but records
+    nothing, its span is a shared no-op and timed returns the function as is.
+    """
+
+    def __init__(
+        self,
+        trace_id: str,
+        name: str = "request",
+        sampled: bool = True,
+        debug: bool = False,
+        parent_span_id: str = None,
+    ):
+        self.trace_id = trace_id
+        self.name = name
+        self.sampled = sampled
+        self.debug = debug
+        self.parent_span_id = parent_span_id
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.ended: Optional[float] = None
+        self.spans: List[Span] = []
+        self.totals: Dict[str, float] = {}
+
+    def span(self, name: str):
+        if not self.sampled:
+            return NULL_SPAN
+        return _SpanTimer(self, name)
+
+    def mark(self, name: str) -> None:
+        if self.sampled:
+            now = time.perf_counter()
+            self.spans.append(Span(name, now, now, is_mark=True))
+
+    def timed(self, name: str, function: Callable) -> Callable:
+        """
+        function, adding the time spent in each call to the total of name.
+        """
+        if not self.sampled:
+            return function
+        totals = self.totals
+        totals.setdefault(name, 0.0)
+
+        @wraps(function)
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals[name] += time.perf_counter() - started
+
+        return call
+
+    def end(self) -> None:
+        if self.ended is None:
+            self.ended = time.perf_counter()
+
+    def timings(self) -> Dict[str, float]:
+        """
+        Milliseconds per stage: the summed duration of spans and totals of a
+        name, or the time since the start of the trace for marks.
+        """
+        timings: Dict[str, float] = {}
+        for span in self.spans:
+            if span.is_mark:
+                timings[span.name] = span.start - self.started
+            else:
+                timings[span.name] = timings.get(span.name, 0) + span.end - span.start
+        for name, total in self.totals.items():
+            timings[name] = timings.get(name, 0) + total
+        return {name: round(seconds * 1000, 1) for name, seconds in timings.items()}
+
+    def epoch_ns(self, moment: float) -> int:
+        return self.started_ns + int((moment - self.started) * 1e9)
+
+
+_current: ContextVar[Trace] = ContextVar(
+    "trace", default=Trace("", name="untraced", sampled=False)
+)
+
+
+def current_trace() -> Trace:
+    return _current.get()
+
+
+def activate(trace: Trace) -> None:
+    """
+    Make trace the current trace of this context, and of the threads started
+    from it with asyncio.to_thread.
+    """
+    _current.set(trace)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator recording a span of name in the current trace around each call.
+    """
+
+    def decorate(function: Callable) -> Callable:
+        @wraps(function)
+        def call(*args, **kwargs):
+            with _current.get().span(name):
+                return function(*args, **kwargs)
+
+        return call
+
+    return decorate
+
+
+class LogExporter:
+    def export(self, trace: Trace) -> None:
+        logging.info(f"trace {trace.trace_id} {trace.name}: {trace.timings()}")
+
+
+class OpenTelemetryExporter:
+    """
+    Replays finished traces as OpenTelemetry spans. Needs opentelemetry-api,
+    and an SDK configured by the deployment to send them anywhere.
+    """
+
+    def __init__(self, tracer_name: str = "api_talkpacific"):
+        from opentelemetry import trace as otel_trace
+
+        self.otel_trace = otel_trace
+        self.tracer = otel_trace.get_tracer(tracer_name)
+
+    def export(self, trace: Trace) -> None:
+        otel_trace = self.otel_trace
+        parent = otel_trace.SpanContext(
+            trace_id=int(trace.trace_id, 16),
+            span_id=int(trace.parent_span_id or "%016x" % random.getrandbits(64), 16),
+            is_remote=True,
+            trace_flags=otel_trace.TraceFlags(otel_trace.TraceFlags.SAMPLED),
+        )
+        context = otel_trace.set_span_in_context(otel_trace.NonRecordingSpan(parent))
+        root = self.tracer.start_span(
+            trace.name, context=context, start_time=trace.started_ns
+        )
+        for name, total in trace.totals.items():
+            root.set_attribute(f"talkpacific.{name}_ms", round(total * 1000, 3))
+        root_context = otel_trace.set_span_in_context(root)
+        for span in trace.spans:
+            otel_span = self.tracer.start_span(
+                span.name, context=root_context, start_time=trace.epoch_ns(span.start)
+            )
+            otel_span.end(end_time=trace.epoch_ns(span.end))
+        root.end(end_time=trace.epoch_ns(trace.ended or time.perf_counter()))
+
+
+class Tracer:
+    """
+    Starts a trace per request, sampling sample_rate of them, and exports the
+    sampled ones when they finish. With debug every request is traced, for
+    its timings to be attached to the final chunk of the response.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        debug: bool = False,
+        exporter=None,
+    ):
+        self.sample_rate = sample_rate
+        self.debug = debug
+        self.exporter = exporter if exporter else LogExporter()
+
+    @staticmethod
+    def from_env() -> Optional["Tracer"]:
+        sample_rate = float(os.getenv("TRACING_SAMPLE_RATE", 0))
+        debug = os.getenv("TRACING_DEBUG", "false").lower() == "true"
+        if not sample_rate and not debug:
+            return None
+        exporter = None
+        if os.getenv("TRACING_EXPORTER", "log").lower() == "otel":
+            try:
+                exporter = OpenTelemetryExporter()
+            except ImportError as e:
+                logging.warning(f"opentelemetry unavailable, logging traces: {e}")
+        return Tracer(sample_rate=sample_rate, debug=debug, exporter=exporter)
+
+    def start(self, name: str, traceparent: str = None) -> Trace:
+        """
+        A trace continuing the W3C traceparent of the request when it has one,
+        sampled when the caller sampled it or by sample_rate.
+        """
+        match = TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+        if match:
+            trace_id, parent_span_id, flags = match.groups()
+            sampled = bool(int(flags, 16) & 1) or random.random() < self.sample_rate
+        else:
+            trace_id, parent_span_id = uuid.uuid4().hex, None
+            sampled = random.random() < self.sample_rate
+        return Trace(
+            trace_id,
+            name=name,
+            sampled=sampled or self.debug,
+            debug=self.debug,
+            parent_span_id=parent_span_id,
+        )
+
+    def finish(self, trace: Trace) -> None:
+        trace.end()
+        if not trace.sampled:
+            return
+        try:
+            self.exporter.export(trace)
+        except Exception as e:
+            logging.error(f"Failed to export trace {trace.trace_id}: {e}")
@@ -0,0 +1,297 @@
+"""
+Streaming NDJSON export and import of conversations and their messages.
+
+Every line is one record, a conversation followed by its messages in position
+order:
+
+    {"type": "conversation", "conversation_id": "...", "primary_language": ...}
+    {"type": "message", "conversation_id": "...", "position": 0, "role": ...}
+
+Export walks both collections with one batched cursor each, so it runs in
+constant memory however many messages there are. Import inserts in ordered
+batches, conversations keep their ids so messages still point to them.
+
+    python -m api_talkpacific.transfer export conversations.ndjson.gz
+    python -m api_talkpacific.transfer import conversations.ndjson.gz
+
+Files ending in .gz are compressed, "-" reads stdin or writes stdout.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import sys
+import time
+import zlib
+from typing import IO, Iterable, Iterator, List
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo.errors import BulkWriteError
+
+from .models import Language
+from .teacher_db import ConversationMessage, TeacherDB
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BATCH_SIZE = 1000
+# Lines are sent in chunks of about this size rather than one by one.
+CHUNK_BYTES = 64 << 10
+GZIP_MAGIC = b"\x1f\x8b"
+PROGRESS_SECONDS = 5
+
+
+class TransferStats:
+    """
+    Counts of an export or import and its throughput.
+    """
+
+    def __init__(self):
+        self.conversations = 0
+        self.messages = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        elapsed = max(self.elapsed, 1e-9)
+        return (
+            f"{self.conversations} conversations, {self.messages} messages, "
+            f"{self.bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+            f"({self.messages / elapsed:.0f} messages/s, "
+            f"{self.bytes / 1e6 / elapsed:.1f} MB/s)"
+        )
+
+
+def dumps_line(record: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(record, ensure_ascii=False).encode() + b"\n"
+
+
+def loads_line(line: bytes) -> dict:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def export_records(
+    teacher_db: TeacherDB, conversation_id: str = None, batch_size: int = BATCH_SIZE
+) -> Iterator[dict]:
+    """
+    The records of every conversation, or only of conversation_id.
+
+    Conversations are read in _id order and messages in (conversation_id,
+    position) order, which agree since conversation ids are the hex of the
+    _id, so the two cursors are merged without holding either. Messages
+    without a conversation are left out.
+    """
+    conversation_query, message_query = {}, {}
+    if conversation_id:
+        conversation_query["_id"] = ObjectId(conversation_id)
+        message_query["conversation_id"] = conversation_id
+    teacher_db.flush()
+    conversations = (
+        teacher_db.conversations.find(conversation_query)
+        .sort("_id", 1)
+        .batch_size(batch_size)
+    )
+    messages = (
+        teacher_db.messages.find(message_query, {"_id": 0})
+        .sort([("conversation_id", 1), ("position", 1)])
+        .batch_size(batch_size)
+    )
+    message = next(messages, None)
+    for conversation in conversations:
+        conversation_id = str(conversation.pop("_id"))
+        yield {
+            "type": "conversation",
+            "conversation_id": conversation_id,
+            **conversation,
+        }
+        while message is not None and message["conversation_id"] <= conversation_id:
+            if message["conversation_id"] == conversation_id:
+                yield {"type": "message", **message}
+            message = next(messages, None)
+
+
+def export_ndjson(
+    teacher_db: TeacherDB,
+    conversation_id: str = None,
+    compress: bool = False,
+    stats: TransferStats = None,
+) -> Iterator[bytes]:
+    """
+    export_records as NDJSON in chunks of about CHUNK_BYTES, gzip compressed
+    when compress is set.
+    """
+    stats = stats or TransferStats()
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    chunk: List[bytes] = []
+    chunk_bytes = 0
+    try:
+        for record in export_records(teacher_db, conversation_id):
+            if record["type"] == "conversation":
+                stats.conversations += 1
+            else:
+                stats.messages += 1
+            line = dumps_line(record)
+            stats.bytes += len(line)
+            chunk.append(line)
+            chunk_bytes += len(line)
+            if chunk_bytes >= CHUNK_BYTES:
+                data = b"".join(chunk)
+                chunk, chunk_bytes = [], 0
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    yield data
+        data = b"".join(chunk)
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+    finally:
+        logging.info(f"exported {stats.summary()}")
+
+
+def import_ndjson(
+    teacher_db: TeacherDB,
+    lines: Iterable[bytes],
+    batch_size: int = BATCH_SIZE,
+    stats: TransferStats = None,
+) -> TransferStats:
+    """
+    Insert the records of an export in ordered batches.
+
+    Messages are validated as ConversationMessage and stored like add_message
+    stores them. A batch of messages waits for the conversations before it,
+    so a message is never written before its conversation. Inserting stops at
+    the first document that fails, with everything before it written.
+    """
+    stats = stats or TransferStats()
+    conversations: List[dict] = []
+    messages: List[dict] = []
+    for number, line in enumerate(lines, 1):
+        stats.bytes += len(line)
+        if not line.strip():
+            continue
+        record = loads_line(line)
+        kind = record.pop("type", None)
+        if kind == "conversation":
+            conversations.append(_conversation_document(record))
+        elif kind == "message":
+            message = ConversationMessage.model_validate(record)
+            messages.append(TeacherDB._map_to_conversation_document(message))
+        else:
+            raise ValueError(f"line {number}: unknown record type {kind!r}")
+        if len(conversations) >= batch_size or len(messages) >= batch_size:
+            _insert(teacher_db, conversations, messages, stats)
+            conversations, messages = [], []
+    _insert(teacher_db, conversations, messages, stats)
+    logging.info(f"imported {stats.summary()}")
+    return stats
+
+
+def _conversation_document(record: dict) -> dict:
+    conversation_id = record.pop("conversation_id")
+    # Fail on records that are not conversations before inserting them.
+    Language(record["primary_language"])
+    Language(record["learning_language"])
+    return {"_id": ObjectId(conversation_id), **record}
+
+
+def _insert(
+    teacher_db: TeacherDB,
+    conversations: List[dict],
+    messages: List[dict],
+    stats: TransferStats,
+) -> None:
+    try:
+        if conversations:
+            teacher_db.conversations.insert_many(conversations, ordered=True)
+            stats.conversations += len(conversations)
+        if messages:
+            teacher_db.messages.insert_many(messages, ordered=True)
+            stats.messages += len(messages)
+    except BulkWriteError as e:
+        logging.error(f"import failed after {stats.summary()}: {e.details}")
+        raise
+
+
+def _open(path: str, mode: str) -> IO[bytes]:
+    if path == "-":
+        return sys.stdin.buffer if mode == "rb" else sys.stdout.buffer
+    if mode == "wb":
+        return gzip.open(path, "wb") if path.endswith(".gz") else open(path, "wb")
+    file = open(path, "rb")
+    if file.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=file)
+    return file
+
+
+def _progress(stats: TransferStats, reported: float) -> float:
+    if stats.elapsed - reported >= PROGRESS_SECONDS:
+        print(stats.summary(), file=sys.stderr)
+        return stats.elapsed
+    return reported
+
+
+def export_file(teacher_db: TeacherDB, path: str, conversation_id: str = None):
+    stats = TransferStats()
+    reported = 0.0
+    with _open(path, "wb") as file:
+        # Compressed by the file itself, so only its extension decides.
+        for data in export_ndjson(teacher_db, conversation_id, stats=stats):
+            file.write(data)
+            reported = _progress(stats, reported)
+    return stats
+
+
+def import_file(teacher_db: TeacherDB, path: str, batch_size: int = BATCH_SIZE):
+    stats = TransferStats()
+    reported = 0.0
+
+    def lines(file: IO[bytes]) -> Iterator[bytes]:
+        nonlocal reported
+        for line in file:
+            yield line
+            reported = _progress(stats, reported)
+
+    with _open(path, "rb") as file:
+        import_ndjson(teacher_db, lines(file), batch_size, stats)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="NDJSON file, compressed if it ends in .gz")
+    parser.add_argument("--conversation-id", help="export only this conversation")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.WARNING)
+    teacher_db = TeacherDB()
+    try:
+        if args.command == "export":
+            stats = export_file(teacher_db, args.path, args.conversation_id)
+        else:
+            stats = import_file(teacher_db, args.path, args.batch_size)
+    finally:
+        teacher_db.close()
+    print(f"{args.command}ed {stats.summary()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+
+# Modes of WriteBehindQueue.durability.
+BUFFERED = "buffered"
+FLUSHED = "flushed"
+
+
+class WriteBehindQueue:
+    """
+    Batches message inserts of TeacherDB and writes them on a background thread.
+
+    A batch is written once max_batch documents are pending, once the oldest
+    has waited max_delay_seconds, or on flush and close. With the buffered
+    durability add_message returns before the write, so a crash loses at most
+    the pending batch. With flushed it waits for the batch holding its message,
+    which groups the writes of concurrent requests into one round trip.
+
+    Positions are handed out from a per-conversation counter kept here, seeded
+    once per conversation from the counter in Mongo. This assumes a
+    conversation is written by one process at a time, the unique position
+    index rejects the writes of a second one.
+    """
+
+    def __init__(
+        self,
+        max_batch: int = 100,
+        max_delay_seconds: float = 0.05,
+        durability: str = BUFFERED,
+        max_retries: int = 3,
+        max_conversations: int = 10_000,
+    ):
+        if durability not in (BUFFERED, FLUSHED):
+            raise ValueError(f"unknown write-behind durability: {durability}")
+        self.max_batch = max_batch
+        self.max_delay_seconds = max_delay_seconds
+        self.durability = durability
+        self.max_retries = max_retries
+        self.max_conversations = max_conversations
+        self.batches = 0
+        self.written = 0
+        self.dropped = 0
+        # (sequence, enqueued at, attempts, document), oldest first.
+        self._pending: List[Tuple[int, float, int, dict]] = []
+        self._in_flight: List[Tuple[int, float, int, dict]] = []
+        self._outstanding: Set[int] = set()
+        self._failed: Set[int] = set()
+        self._pending_by_conversation: Dict[str, int] = {}
+        self._positions: OrderedDict[str, int] = OrderedDict()
+        self._sequence = 0
+        self._flush_requested = False
+        self._closed = False
+        self._write: Callable[[List[dict]], List[dict]] = None
+        self._thread: threading.Thread = None
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def from_env() -> Optional["WriteBehindQueue"]:
+        """
+        Built from the WRITE_BEHIND_* variables, None unless enabled.
+        """
+        if os.getenv("WRITE_BEHIND_ENABLED", "false").lower() != "true":
+            return None
+        return WriteBehindQueue(
+            max_batch=int(os.getenv("WRITE_BEHIND_MAX_BATCH", 100)),
+            max_delay_seconds=float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", 50))
+            / 1000,
+            durability=os.getenv("WRITE_BEHIND_DURABILITY", BUFFERED),
+        )
+
+    def start(self, write: Callable[[List[dict]], List[dict]]) -> None:
+        """
+        Start the writer thread. write persists a batch and returns the
+        documents that failed and should be retried.
+        """
+        self._write = write
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def next_position(self, conversation_id: str, seed: Callable[[], int]) -> int:
+        """
+        The position of the conversation's next message. seed reserves a
+        position in Mongo the first time the conversation is seen.
+        """
+        with self._condition:
+            position = self._positions.get(conversation_id)
+            if position is not None:
+                self._positions[conversation_id] = position + 1
+                self._positions.move_to_end(conversation_id)
+                return position
+        position = seed()
+        with self._condition:
+            known = self._positions.get(conversation_id, 0)
+            self._positions[conversation_id] = max(known, position + 1)
+            self._evict_positions()
+        return position
+
+    def seed_position(self, conversation_id: str, position: int) -> None:
+        with self._condition:
+            self._positions[conversation_id] = position
+            self._evict_positions()
+
+    def forget_position(self, conversation_id: str) -> None:
+        """
+        Re-seed the conversation's counter from Mongo on its next message,
+        after messages were deleted.
+        """
+        with self._condition:
+            self._positions.pop(conversation_id, None)
+
+    def enqueue(self, document: dict) -> int:
+        """
+        Queue document for insertion, returning a ticket for wait.
+        """
+        document.setdefault("_id", ObjectId())
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("write-behind queue is closed")
+            self._sequence += 1
+            self._pending.append((self._sequence, time.monotonic(), 0, document))
+            self._outstanding.add(self._sequence)
+            conversation_id = document["conversation_id"]
+            self._pending_by_conversation[conversation_id] = (
+                self._pending_by_conversation.get(conversation_id, 0) + 1
+            )
+            self._condition.notify_all()
+            return self._sequence
+
+    def wait(self, ticket: int, timeout: float = None) -> bool:
+        """
+        Wait until the document of ticket is written. False when it was dropped
+        or the timeout passed.
+        """
+        with self._condition:
+            written = self._condition.wait_for(
+                lambda: ticket not in self._outstanding, timeout
+            )
+            if ticket in self._failed:
+                self._failed.discard(ticket)
+                return False
+            return written
+
+    def pending(self, conversation_id: str) -> List[dict]:
+        """
+        Documents of the conversation that are not written yet, oldest first.
+        """
+        with self._condition:
+            if not self._pending_by_conversation.get(conversation_id):
+                return []
+            return [
+                dict(document)
+                for _, _, _, document in self._in_flight + self._pending
+                if document["conversation_id"] == conversation_id
+            ]
+
+    def find(self, document_id: ObjectId) -> Optional[dict]:
+        with self._condition:
+            for _, _, _, document in self._in_flight + self._pending:
+                if document["_id"] == document_id:
+                    return dict(document)
+        return None
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Write everything queued so far, waiting up to timeout.
+        """
+        with self._condition:
+            target = self._sequence
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: not self._outstanding or min(self._outstanding) > target,
+                timeout,
+            )
+
+    def close(self, timeout: float = None) -> None:
+        """
+        Write what is pending and stop the writer thread.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logging.error(f"write-behind queue closed with writes pending {self}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._outstanding),
+            "batches": self.batches,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._due():
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait(self._time_until_due())
+                batch = self._pending[: self.max_batch]
+                del self._pending[: len(batch)]
+                self._in_flight = batch
+                if not self._pending:
+                    self._flush_requested = False
+            try:
+                failed = self._write([document for _, _, _, document in batch])
+            except Exception as e:
+                logging.error(f"write-behind batch failed: {e}")
+                failed = [document for _, _, _, document in batch]
+            self._complete(batch, {id(document) for document in failed})
+
+    def _complete(self, batch: List[Tuple[int, float, int, dict]], failed: set):
+        with self._condition:
+            self.batches += 1
+            retries = []
+            for sequence, enqueued_at, attempts, document in batch:
+                if id(document) in failed and attempts < self.max_retries:
+                    retries.append((sequence, enqueued_at, attempts + 1, document))
+                    continue
+                if id(document) in failed:
+                    logging.error(f"write-behind dropped message {document}")
+                    self.dropped += 1
+                    if self.durability == FLUSHED:
+                        self._failed.add(sequence)
+                else:
+                    self.written += 1
+                self._outstanding.discard(sequence)
+                conversation_id = document["conversation_id"]
+                self._pending_by_conversation[conversation_id] -= 1
+                if not self._pending_by_conversation[conversation_id]:
+                    del self._pending_by_conversation[conversation_id]
+            self._pending[:0] = retries
+            self._in_flight = []
+            self._condition.notify_all()
+            if retries and not self._closed:
+                # Back off before the retry instead of spinning on a failure.
+                self._condition.wait(self.max_delay_seconds)
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        return (
+            self._closed
+            or self._flush_requested
+            or len(self._pending) >= self.max_batch
+            or self._time_until_due() <= 0
+        )
+
+    def _time_until_due(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        return self._pending[0][1] + self.max_delay_seconds - time.monotonic()
+
+    def _evict_positions(self) -> None:
+        """
+        Forget the least recently used counters, keeping those of conversations
+        with pending writes since Mongo does not know their positions yet.
+        """
+        excess = len(self._positions) - self.max_conversations
+        for conversation_id in list(self._positions):
+            if excess <= 0:
+                break
+            if conversation_id not in self._pending_by_conversation:
+                del self._positions[conversation_id]
+                excess -= 1
@@ -0,0 +1,99 @@
+"""
+Benchmark for TeacherDB.add_message as the messages collection grows.
+
+Grows the collection in steps with filler messages spread over many
+conversations, then times add_message on a fresh conversation at each step.
+With the (conversation_id, position) index and the position counter the latency
+should stay flat as the collection grows.
+
+Run against a real MongoDB to measure the server, it writes to and finally
+drops the teacher_benchmark database:
+
+    python -m benchmarks.add_message --uri mongodb://localhost:27017 \\
+        --sizes 10000 100000 1000000 10000000
+
+Without --uri it falls back to mongomock, which has no real indexes and only
+suits small sizes.
+"""
+
+import argparse
+import statistics
+import time
+from typing import List
+
+import mongomock
+from pymongo import MongoClient
+
+from api_talkpacific.conversation_cache import ConversationCache
+from api_talkpacific.models import Language
+from api_talkpacific.teacher_db import ConversationRole, TeacherDB
+
+DATABASE_NAME = "teacher_benchmark"
+MESSAGES_PER_CONVERSATION = 100
+BATCH_SIZE = 10_000
+
+
+def grow(db: TeacherDB, current: int, target: int) -> None:
+    """
+    Insert filler messages until the collection holds target messages.
+    """
+    batch = []
+    for index in range(current, target):
+        conversation, position = divmod(index, MESSAGES_PER_CONVERSATION)
+        batch.append(
+            {
+                "conversation_id": f"filler-{conversation}",
+                "position": position,
+                "role": ConversationRole.User.value,
+                "content": "filler message",
+                "sentence_indices": [],
+                "learning_phrases": [],
+            }
+        )
+        if len(batch) == BATCH_SIZE:
+            db.messages.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.messages.insert_many(batch, ordered=False)
+
+
+def time_add_message(db: TeacherDB, count: int) -> List[float]:
+    conversation_id = db.create_conversation(Language.English, Language.Chinese)
+    latencies = []
+    for index in range(count):
+        start = time.perf_counter()
+        db.add_message(conversation_id, ConversationRole.User, f"message {index}")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", help="MongoDB URI, mongomock when omitted")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 500, 2000])
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri) if args.uri else mongomock.MongoClient()
+    client.drop_database(DATABASE_NAME)
+    db = TeacherDB(
+        mongo_client=client,
+        conversation_cache=ConversationCache(enabled=False),
+        database_name=DATABASE_NAME,
+    )
+    try:
+        print(f"{'messages':>10} {'p50 ms':>8} {'p99 ms':>8}")
+        size = 0
+        for target in sorted(args.sizes):
+            grow(db, size, target)
+            size = db.messages.count_documents({})
+            latencies = sorted(time_add_message(db, args.messages))
+            p50 = statistics.median(latencies)
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            print(f"{size:>10} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f}")
+    finally:
+        client.drop_database(DATABASE_NAME)
+
+
+if __name__ == "__main__":
+    main()
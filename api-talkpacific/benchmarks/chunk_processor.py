@@ -0,0 +1,46 @@
+"""
+Micro-benchmark for ChatResponseChunkProcessor.
+
+Feeds synthetic token streams through process_chunk and finish and reports the
+cost per token. The per-token cost should stay flat as responses grow.
+
+    python -m benchmarks.chunk_processor --tokens 1000 10000
+"""
+
+import argparse
+import time
+from typing import List
+
+from api_talkpacific.language_coach import ChatResponseChunkProcessor
+
+TOKENS = ["Hello", " there", ",", " 你好", "!", " This", " means", " hello", ".", "\n"]
+
+
+def synthetic_tokens(count: int) -> List[str]:
+    return [TOKENS[i % len(TOKENS)] for i in range(count)]
+
+
+def run_once(tokens: List[str]) -> float:
+    start = time.perf_counter()
+    processor = ChatResponseChunkProcessor(conversation_id="benchmark")
+    for token in tokens:
+        processor.process_chunk(token)
+    processor.finish()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'tokens':>8} {'best ms':>10} {'us/token':>10}")
+    for count in args.tokens:
+        tokens = synthetic_tokens(count)
+        best = min(run_once(tokens) for _ in range(args.repeat))
+        print(f"{count:>8} {best * 1000:>10.2f} {best / count * 1e6:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Deterministic stand-ins for the OpenAI models and instrumentation of
+TeacherDB, shared by the benchmarks.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from functools import wraps
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from api_talkpacific.language_detector import LanguageDetectionStrategy
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import TeacherDB
+
+# A teaching response mixing English and Chinese, cut into model sized tokens.
+TOKENS = [
+    "Hello",
+    " there",
+    "!",
+    " In",
+    " Chinese",
+    " you",
+    " say",
+    " 你好",
+    "!",
+    " (",
+    "Nǐ",
+    " hǎo",
+    ").",
+    " It",
+    " means",
+    " hello",
+    ".",
+    "\n",
+]
+
+TEACHER_DB_METHODS = [
+    "create_conversation",
+    "get_conversation",
+    "get_conversation_memories",
+    "add_message",
+    "edit_user_message",
+    "get_message",
+    "get_messages",
+    "update_summary",
+    "delete_messages",
+    "delete_conversation",
+]
+
+MONGO_METHODS = [
+    "find",
+    "find_one",
+    "find_one_and_update",
+    "insert_one",
+    "update_one",
+    "delete_many",
+    "bulk_write",
+]
+
+
+def fake_tokens(count: int) -> List[str]:
+    return [TOKENS[i % len(TOKENS)] for i in range(count)]
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Streams the same tokens for every prompt, tokens_per_second at a time or
+    as fast as possible when it is 0, after a first token latency.
+    """
+
+    tokens: int = 100
+    tokens_per_second: float = 0
+    latency: float = 0
+    model_name: str = "fake-streaming"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        content = "".join(self._stream_tokens())
+        generation = ChatGeneration(message=AIMessage(content=content))
+        return ChatResult(generations=[generation])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._stream_tokens():
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._stream_tokens():
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _stream_tokens(self) -> List[str]:
+        return fake_tokens(self.tokens)
+
+
+class StubDetector(LanguageDetectionStrategy):
+    """
+    The script detector behind a fixed latency, standing in for an LLM call.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.detector = ScriptLanguageDetector()
+
+    def detect(self, message: str, primary: Language, learning: Language) -> List[str]:
+        time.sleep(self.latency)
+        return self.detector.detect(message, primary, learning)
+
+    async def adetect(
+        self, message: str, primary: Language, learning: Language
+    ) -> List[str]:
+        await asyncio.sleep(self.latency)
+        return self.detector.detect(message, primary, learning)
+
+
+def count_calls(teacher_db: TeacherDB) -> Counter:
+    """
+    Count the calls of TeacherDB's methods and of the Mongo operations on its
+    collections, in a Counter that can be cleared between measurements.
+    """
+    counts = Counter()
+
+    def counted(name: str, method):
+        @wraps(method)
+        def call(*args, **kwargs):
+            counts[name] += 1
+            return method(*args, **kwargs)
+
+        return call
+
+    for name in TEACHER_DB_METHODS:
+        setattr(teacher_db, name, counted(name, getattr(teacher_db, name)))
+    teacher_db.conversations = CountingCollection(teacher_db.conversations, counts)
+    teacher_db.messages = CountingCollection(teacher_db.messages, counts)
+    return counts
+
+
+class CountingCollection:
+    """
+    Proxy of a pymongo Collection counting the operations called on it. Calls
+    the collection makes internally, e.g. find_one to find, are not counted.
+    """
+
+    def __init__(self, collection, counts: Counter):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._collection, name)
+        if name not in MONGO_METHODS:
+            return attribute
+        label = f"{self._collection.name}.{name}"
+
+        def call(*args, **kwargs):
+            self._counts[label] += 1
+            return attribute(*args, **kwargs)
+
+        return call
@@ -0,0 +1,140 @@
+"""
+Benchmark of TeacherDB.get_conversation on a cache miss across conversation
+lengths.
+
+Compares the previous load, find_one on conversations then a sorted find on
+messages with every message mapped field by field, with the current one, a
+single $lookup aggregation and one model_validate call per message. The
+mapping of the messages is also timed on its own, model_construct included.
+
+Run against a real MongoDB to measure the round trips, it writes to and
+finally drops the teacher_benchmark database:
+
+    python -m benchmarks.get_conversation --uri mongodb://localhost:27017
+
+Without --uri it falls back to mongomock, which cannot $lookup with a pipeline,
+so the current load makes two queries there and only the mapping differs.
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+import mongomock
+from bson import ObjectId
+from pymongo import MongoClient
+
+from api_talkpacific.conversation_cache import ConversationCache
+from api_talkpacific.models import Language
+from api_talkpacific.teacher_db import (
+    ConversationMemory,
+    ConversationMessage,
+    ConversationRole,
+    TeacherDB,
+)
+
+DATABASE_NAME = "teacher_benchmark"
+
+
+def seed(db: TeacherDB, messages: int) -> str:
+    conversation_id = db.create_conversation(Language.English, Language.Chinese)
+    db.messages.insert_many(
+        [
+            {
+                "conversation_id": conversation_id,
+                "position": position,
+                "role": ConversationRole.User.value,
+                "content": f"Message {position}, 你好! It means hello.",
+                "sentence_indices": [[0, 12], [13, 16], [17, 32]],
+                "learning_phrases": ["你好"],
+            }
+            for position in range(messages)
+        ]
+    )
+    db.conversations.update_one(
+        {"_id": ObjectId(conversation_id)}, {"$set": {"next_position": messages}}
+    )
+    return conversation_id
+
+
+def two_queries(db: TeacherDB, conversation_id: str) -> ConversationMemory:
+    conversation_document = db.conversations.find_one(
+        {"_id": ObjectId(conversation_id)}
+    )
+    messages = [
+        TeacherDB._map_to_conversation_message(document)
+        for document in db.messages.find({"conversation_id": conversation_id}).sort(
+            "position", 1
+        )
+    ]
+    return ConversationMemory(
+        conversation_id=str(conversation_document["_id"]),
+        primary=Language(conversation_document["primary_language"]),
+        learning=Language(conversation_document["learning_language"]),
+        messages=messages,
+    )
+
+
+def median_ms(run: Callable[[], object], repeat: int) -> float:
+    latencies: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", help="MongoDB URI, mongomock when omitted")
+    parser.add_argument("--messages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri) if args.uri else mongomock.MongoClient()
+    client.drop_database(DATABASE_NAME)
+    db = TeacherDB(
+        mongo_client=client,
+        conversation_cache=ConversationCache(enabled=False),
+        database_name=DATABASE_NAME,
+    )
+    try:
+        print(
+            f"{'messages':>8} {'previous ms':>12} {'current ms':>11} "
+            f"{'map us':>7} {'validate us':>12} {'construct us':>13}"
+        )
+        for messages in args.messages:
+            conversation_id = seed(db, messages)
+            documents = list(
+                db.messages.find({"conversation_id": conversation_id}, {"_id": 0})
+            )
+            previous = median_ms(lambda: two_queries(db, conversation_id), args.repeat)
+            current = median_ms(
+                lambda: db.get_conversation(conversation_id), args.repeat
+            )
+            mapped = median_ms(
+                lambda: [TeacherDB._map_to_conversation_message(d) for d in documents],
+                args.repeat,
+            )
+            validate = median_ms(
+                lambda: [TeacherDB._load_message(d) for d in documents],
+                args.repeat,
+            )
+            construct = median_ms(
+                lambda: [ConversationMessage.model_construct(**d) for d in documents],
+                args.repeat,
+            )
+            print(
+                f"{messages:>8} {previous:>12.3f} {current:>11.3f} "
+                f"{mapped * 1000 / messages:>7.2f} "
+                f"{validate * 1000 / messages:>12.2f} "
+                f"{construct * 1000 / messages:>13.2f}"
+            )
+        print(f"single round trip: {db.lookup_messages}")
+    finally:
+        client.drop_database(DATABASE_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark for the learning phrase detectors.
+
+Times ScriptLanguageDetector on the responses in data/detector_responses.json
+and compares its phrases with the expected ones. When a response has an LLM
+recording (llm_phrases, llm_latency_ms) the LLM path is reported next to it.
+
+    python -m benchmarks.language_detector
+    python -m benchmarks.language_detector --record   # needs OPENAI_API_KEY
+
+--record runs LanguageDetector on every response and stores its phrases and
+latency back into the data file.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from api_talkpacific.language_detector import LanguageDetector
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "detector_responses.json")
+
+
+def time_call(function, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def record(responses) -> None:
+    detector = LanguageDetector()
+    for response in responses:
+        phrases, elapsed = time_call(
+            lambda: detector.detect(
+                response["message"],
+                Language(response["primary"]),
+                Language(response["learning"]),
+            ),
+            repeat=1,
+        )
+        response["llm_phrases"] = phrases
+        response["llm_latency_ms"] = round(elapsed * 1000, 1)
+    with open(DATA_PATH, "w") as data_file:
+        json.dump(responses, data_file, ensure_ascii=False, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--record", action="store_true")
+    args = parser.parse_args()
+
+    with open(DATA_PATH) as data_file:
+        responses = json.load(data_file)
+    if args.record:
+        record(responses)
+
+    detector = ScriptLanguageDetector()
+    print(f"{'pair':<18} {'local us':>9} {'match':>6} {'llm ms':>8} {'llm match':>10}")
+    for response in responses:
+        primary = Language(response["primary"])
+        learning = Language(response["learning"])
+        pair = f"{primary.value}/{learning.value}"
+        expected = response["expected_phrases"]
+        llm_latency = response.get("llm_latency_ms")
+        llm_match = response.get("llm_phrases") == expected if llm_latency else "-"
+        if not detector.supports(primary, learning):
+            print(f"{pair:<18} {'llm only':>9} {'-':>6} {llm_latency or '-':>8}")
+            continue
+        phrases, elapsed = time_call(
+            lambda: detector.detect(response["message"], primary, learning),
+            repeat=args.repeat,
+        )
+        print(
+            f"{pair:<18} {elapsed * 1e6:>9.1f} {str(phrases == expected):>6} "
+            f"{llm_latency or '-':>8} {str(llm_match):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
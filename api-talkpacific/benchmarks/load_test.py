@@ -0,0 +1,234 @@
+"""
+Load test of concurrent /send-message streams on one uvicorn worker.
+
+Serves main.app with a stub LLM, a stub detector and mongomock from uvicorn on
+a background thread, or targets a running server with --url, and opens
+--concurrency SSE clients at a time. For every concurrency level it reports
+the time to first token and the gap between chunks as p50/p95/p99, completed
+streams per second and, in-process only, the lag of the server's event loop.
+
+The COACH_* admission variables bound the in-process server like a deployed
+one, streams it turns away with 429 or 503 count as errors.
+
+    python -m benchmarks.load_test --concurrency 1 8 32 128 --output load.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import logging
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import mongomock
+import uvicorn
+
+from api_talkpacific import main as app_main
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.teacher_db import TeacherDB
+
+from .fakes import FakeStreamingChatModel, StubDetector
+
+LAG_INTERVAL_SECONDS = 0.01
+
+FIELDS = [
+    "concurrency",
+    "streams",
+    "errors",
+    "streams_per_second",
+    "ttft_p50_ms",
+    "ttft_p95_ms",
+    "ttft_p99_ms",
+    "gap_p50_ms",
+    "gap_p95_ms",
+    "gap_p99_ms",
+    "loop_lag_p50_ms",
+    "loop_lag_p99_ms",
+    "loop_lag_max_ms",
+]
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def milliseconds(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value * 1000, 3)
+
+
+def install_coach(args: argparse.Namespace) -> LanguageCoach:
+    llm = FakeStreamingChatModel(
+        tokens=args.tokens,
+        tokens_per_second=args.tokens_per_second,
+        latency=args.llm_latency,
+    )
+    coach = LanguageCoach(
+        llm=llm,
+        teacher_db=TeacherDB(mongo_client=mongomock.MongoClient()),
+        language_detector=StubDetector(latency=args.detector_latency),
+    )
+    app_main.languageCoach = coach
+    return coach
+
+
+class InProcessServer:
+    """
+    uvicorn serving main.app on a background thread, with a probe measuring
+    how late the server's event loop wakes up from short sleeps.
+    """
+
+    def __init__(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        config = uvicorn.Config(
+            app_main.app, host="127.0.0.1", port=self.port, log_level="warning"
+        )
+        self.server = uvicorn.Server(config)
+        self.lags: List[float] = []
+        self.measuring = False
+        self._thread = threading.Thread(target=asyncio.run, args=(self._serve(),))
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self._thread.join()
+
+    async def _serve(self) -> None:
+        probe = asyncio.create_task(self._probe_lag())
+        await self.server.serve()
+        probe.cancel()
+
+    async def _probe_lag(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL_SECONDS)
+            if self.measuring:
+                lag = time.perf_counter() - started - LAG_INTERVAL_SECONDS
+                self.lags.append(max(lag, 0))
+
+
+async def stream_once(
+    client: httpx.AsyncClient, conversation_id: str, result: Dict[str, list]
+) -> None:
+    params = {"conversation_id": conversation_id, "message": "hello"}
+    started = time.perf_counter()
+    last = None
+    async with client.stream("GET", "/send-message", params=params) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            now = time.perf_counter()
+            if last is None:
+                result["ttft"].append(now - started)
+            else:
+                result["gaps"].append(now - last)
+            last = now
+
+
+async def run_level(
+    url: str, concurrency: int, streams_per_client: int, server
+) -> Dict[str, object]:
+    result = {"ttft": [], "gaps": []}
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        conversations = []
+        for _ in range(concurrency * streams_per_client):
+            response = await client.get("/create-conversation")
+            conversations.append(response.json()["conversation_id"])
+
+        async def run_client(index: int) -> None:
+            nonlocal errors
+            for turn in range(streams_per_client):
+                conversation_id = conversations[index * streams_per_client + turn]
+                try:
+                    await stream_once(client, conversation_id, result)
+                except httpx.HTTPError as e:
+                    logging.error(f"stream failed: {e}")
+                    errors += 1
+
+        if server:
+            server.lags.clear()
+            server.measuring = True
+        started = time.perf_counter()
+        await asyncio.gather(*[run_client(index) for index in range(concurrency)])
+        elapsed = time.perf_counter() - started
+        if server:
+            server.measuring = False
+
+    lags = server.lags if server else []
+    completed = len(result["ttft"])
+    return {
+        "concurrency": concurrency,
+        "streams": completed,
+        "errors": errors,
+        "streams_per_second": round(completed / elapsed, 2),
+        "ttft_p50_ms": milliseconds(percentile(result["ttft"], 50)),
+        "ttft_p95_ms": milliseconds(percentile(result["ttft"], 95)),
+        "ttft_p99_ms": milliseconds(percentile(result["ttft"], 99)),
+        "gap_p50_ms": milliseconds(percentile(result["gaps"], 50)),
+        "gap_p95_ms": milliseconds(percentile(result["gaps"], 95)),
+        "gap_p99_ms": milliseconds(percentile(result["gaps"], 99)),
+        "loop_lag_p50_ms": milliseconds(percentile(lags, 50)),
+        "loop_lag_p99_ms": milliseconds(percentile(lags, 99)),
+        "loop_lag_max_ms": milliseconds(max(lags) if lags else None),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="target a running server instead")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--streams-per-client", type=int, default=3)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--detector-latency", type=float, default=0.2)
+    parser.add_argument("--output", help="write the CSV to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    server = None
+    url = args.url
+    if not url:
+        install_coach(args)
+        server = InProcessServer()
+        server.start()
+        url = server.url
+    try:
+        rows = [
+            asyncio.run(run_level(url, level, args.streams_per_client, server))
+            for level in args.concurrency
+        ]
+    finally:
+        if server:
+            server.stop()
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.DictWriter(output, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    if args.output:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
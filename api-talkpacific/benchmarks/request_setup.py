@@ -0,0 +1,83 @@
+"""
+Benchmark of the per-request setup of LanguageCoach and LanguageDetector.
+
+Compares building the chains and the detector's OpenAI client on every
+request, as send_message used to, with the prebuilt chains and shared clients.
+A stub LLM answers instantly, so the numbers are the setup and LangChain
+overhead alone.
+
+    python -m benchmarks.request_setup --requests 200
+"""
+
+import argparse
+import time
+from typing import Callable
+
+import mongomock
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_openai import ChatOpenAI
+
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.language_detector import LanguageDetector
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import ConversationMemory, TeacherDB
+
+RESPONSE = "Hello there. 你好!"
+
+
+def stub_llm() -> FakeListChatModel:
+    return FakeListChatModel(responses=[RESPONSE])
+
+
+def per_request_setup(coach: LanguageCoach, chain_input: dict) -> None:
+    chain = coach._create_chain()
+    LanguageDetector(
+        ChatOpenAI(openai_api_key="benchmark", model_name="gpt-3.5-turbo")
+    )
+    for _ in chain.stream(chain_input):
+        pass
+
+
+def prebuilt(coach: LanguageCoach, chain_input: dict) -> None:
+    for _ in coach.chain.stream(chain_input):
+        pass
+
+
+def measure(run: Callable[[], None], requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        run()
+    return (time.perf_counter() - start) / requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    coach = LanguageCoach(
+        llm=stub_llm(),
+        teacher_db=TeacherDB(mongo_client=mongomock.MongoClient()),
+        language_detector=ScriptLanguageDetector(),
+    )
+    memory = ConversationMemory(
+        conversation_id="benchmark",
+        primary=Language.English,
+        learning=Language.Chinese,
+    )
+    chain_input = LanguageCoach._chain_input(memory, [], "hello")
+
+    # Warm up imports and pydantic validators before timing.
+    per_request_setup(coach, chain_input)
+    prebuilt(coach, chain_input)
+
+    before = measure(lambda: per_request_setup(coach, chain_input), args.requests)
+    after = measure(lambda: prebuilt(coach, chain_input), args.requests)
+    print(f"{'setup':>20} {'ms/request':>12}")
+    print(f"{'per request':>20} {before * 1000:>12.3f}")
+    print(f"{'prebuilt, shared':>20} {after * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
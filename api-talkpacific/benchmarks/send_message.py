@@ -0,0 +1,250 @@
+"""
+Offline benchmark of the send-message hot path, without OpenAI or MongoDB.
+
+Drives LanguageCoach.asend_message and the /send-message endpoint with a fake
+model streaming a fixed number of tokens, mongomock and the script detector,
+across response lengths and history sizes. Reports per response:
+
+    ttfc_ms               time to the first chunk
+    per_chunk_us          wall time per chunk, minus the model's own delay
+    cpu_ms                process CPU time, Mongo threads included
+    alloc_peak_kb         peak traced allocation, from a separate traced run
+    alloc_retained_kb     traced allocation still held after the response
+    teacher_db_calls      TeacherDB method and Mongo operation counts
+
+Results are printed as JSON, or written to --output, so runs can be diffed to
+catch regressions in ChatResponseChunkProcessor, load_history or serialization.
+
+    python -m benchmarks.send_message --tokens 50 500 --history 0 20 200
+    python -m benchmarks.send_message --paths endpoint --coalesce-bytes 0
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+from urllib.parse import urlencode
+
+import mongomock
+
+from api_talkpacific import main as app_main
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import ConversationRole, TeacherDB
+
+from .fakes import FakeStreamingChatModel, count_calls
+
+MESSAGE = "How do I say hello?"
+
+
+def seed_conversation(coach: LanguageCoach, history: int) -> str:
+    conversation_id = coach.create_conversation(Language.English, Language.Chinese)
+    for position in range(history):
+        role = ConversationRole.Assistant if position % 2 else ConversationRole.User
+        coach.teacher_db.add_message(
+            conversation_id, role, f"Message {position}, 你好! It means hello."
+        )
+    return conversation_id
+
+
+# A stream runs a response for a conversation, calling on_chunk per chunk.
+Stream = Callable[[str, Callable[[], None]], None]
+
+
+def coach_stream(coach: LanguageCoach) -> Stream:
+    loop = asyncio.new_event_loop()
+
+    async def consume(conversation_id: str, on_chunk: Callable[[], None]) -> None:
+        async for _ in coach.asend_message(conversation_id, MESSAGE):
+            on_chunk()
+
+    def run(conversation_id: str, on_chunk: Callable[[], None]) -> None:
+        loop.run_until_complete(consume(conversation_id, on_chunk))
+
+    return run
+
+
+def endpoint_stream(app, coalesce_bytes: int = None) -> Stream:
+    """
+    Calls the ASGI app directly and counts every body message as a chunk, an
+    HTTP test client would buffer the response and hide the first chunk.
+    """
+    loop = asyncio.new_event_loop()
+    params = {"message": MESSAGE}
+    if coalesce_bytes is not None:
+        params["coalesce_bytes"] = coalesce_bytes
+
+    async def request(conversation_id: str, on_chunk: Callable[[], None]) -> None:
+        query = urlencode({"conversation_id": conversation_id, **params})
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/send-message",
+            "raw_path": b"/send-message",
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [],
+            "client": ("benchmark", 0),
+            "server": ("benchmark", 80),
+        }
+
+        requested = False
+        finished = asyncio.Event()
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Starlette listens for a disconnect while it streams.
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] != "http.response.body":
+                return
+            if message.get("body"):
+                on_chunk()
+            if not message.get("more_body"):
+                finished.set()
+
+        await app(scope, receive, send)
+
+    def run(conversation_id: str, on_chunk: Callable[[], None]) -> None:
+        loop.run_until_complete(request(conversation_id, on_chunk))
+
+    return run
+
+
+def run_once(stream: Stream, conversation_id: str) -> Dict[str, float]:
+    chunk_times = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    stream(conversation_id, lambda: chunk_times.append(time.perf_counter()))
+    return {
+        "ttfc": chunk_times[0] - started,
+        "total": time.perf_counter() - started,
+        "cpu": time.process_time() - cpu_started,
+        "chunks": len(chunk_times),
+    }
+
+
+def run_traced(stream: Stream, conversation_id: str) -> Dict[str, float]:
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        stream(conversation_id, lambda: None)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak": peak - before, "retained": after - before}
+
+
+def measure(
+    path: str,
+    stream: Stream,
+    coach: LanguageCoach,
+    counts,
+    llm: FakeStreamingChatModel,
+    history: int,
+    repeat: int,
+) -> dict:
+    # Warm up the conversation cache and lazily built state.
+    run_once(stream, seed_conversation(coach, history))
+    samples = []
+    for _ in range(repeat):
+        conversation_id = seed_conversation(coach, history)
+        counts.clear()
+        samples.append(run_once(stream, conversation_id))
+    calls = dict(sorted(counts.items()))
+    traced = run_traced(stream, seed_conversation(coach, history))
+
+    model_time = llm.tokens / llm.tokens_per_second if llm.tokens_per_second else 0
+    chunks = samples[0]["chunks"]
+    return {
+        "path": path,
+        "tokens": llm.tokens,
+        "history": history,
+        "chunks": chunks,
+        "ttfc_ms": round(median(samples, "ttfc") * 1000, 3),
+        "per_chunk_us": round(
+            (median(samples, "total") - model_time) / chunks * 1e6, 3
+        ),
+        "cpu_ms": round(median(samples, "cpu") * 1000, 3),
+        "alloc_peak_kb": round(traced["peak"] / 1024, 1),
+        "alloc_retained_kb": round(traced["retained"] / 1024, 1),
+        "teacher_db_calls": calls,
+    }
+
+
+def median(samples: List[Dict[str, float]], key: str) -> float:
+    return statistics.median(sample[key] for sample in samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[50, 500, 2000])
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 20, 200])
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--paths", nargs="+", default=["coach", "endpoint"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--coalesce-bytes",
+        type=int,
+        help="SSE coalescing of the endpoint, 0 for a frame per token",
+    )
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args()
+
+    llm = FakeStreamingChatModel(tokens_per_second=args.tokens_per_second)
+    teacher_db = TeacherDB(mongo_client=mongomock.MongoClient())
+    coach = LanguageCoach(
+        llm=llm,
+        teacher_db=teacher_db,
+        language_detector=ScriptLanguageDetector(),
+    )
+    app_main.languageCoach = coach
+    streams = {
+        "coach": coach_stream(coach),
+        "endpoint": endpoint_stream(app_main.app, args.coalesce_bytes),
+    }
+    counts = count_calls(teacher_db)
+
+    results = []
+    for tokens in args.tokens:
+        llm.tokens = tokens
+        for history in args.history:
+            for path in args.paths:
+                results.append(
+                    measure(
+                        path, streams[path], coach, counts, llm, history, args.repeat
+                    )
+                )
+    coach.close()
+
+    report = {
+        "benchmark": "send_message",
+        "python": platform.python_version(),
+        "tokens_per_second": args.tokens_per_second,
+        "repeat": args.repeat,
+        "coalesce_bytes": args.coalesce_bytes,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
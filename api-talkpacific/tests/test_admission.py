@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import unittest
+import mongomock
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific import main
+from api_talkpacific.admission import (
+    QUEUE_FULL,
+    QUEUE_TIMEOUT,
+    AdmissionController,
+    Overloaded,
+)
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.metrics import ADMISSION_REJECTED
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import TeacherDB
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+
+    async def test_waiters_are_admitted_in_order(self):
+        controller = AdmissionController("test", max_concurrency=1, max_queue=2)
+        first = await controller.admit()
+        admitted = []
+
+        async def wait(name: str):
+            permit = await controller.admit()
+            admitted.append(name)
+            permit.release()
+
+        waiters = [asyncio.create_task(wait(name)) for name in ["second", "third"]]
+        await asyncio.sleep(0)
+        self.assertEqual(controller.queued, 2)
+        first.release()
+        first.release()
+        await asyncio.gather(*waiters)
+
+        self.assertEqual(admitted, ["second", "third"])
+        self.assertEqual((controller.active, controller.queued), (0, 0))
+
+    async def test_full_queue_is_rejected(self):
+        controller = AdmissionController("test", max_concurrency=1, max_queue=0)
+        await controller.admit()
+        rejected = ADMISSION_REJECTED.value("test", QUEUE_FULL)
+
+        with self.assertRaises(Overloaded) as context:
+            await controller.admit()
+
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertEqual(ADMISSION_REJECTED.value("test", QUEUE_FULL), rejected + 1)
+
+    async def test_wait_past_deadline_is_rejected(self):
+        controller = AdmissionController(
+            "test", max_concurrency=1, max_queue=1, queue_timeout_seconds=0.01
+        )
+        await controller.admit()
+
+        with self.assertRaises(Overloaded) as context:
+            await controller.admit()
+
+        self.assertEqual(context.exception.reason, QUEUE_TIMEOUT)
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(controller.queued, 0)
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        controller = AdmissionController("test", max_concurrency=1, max_queue=1)
+        permit = await controller.admit()
+        waiter = asyncio.create_task(controller.admit())
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        permit.release()
+
+        self.assertEqual((controller.active, controller.queued), (0, 0))
+
+    async def test_threads_share_the_limit(self):
+        controller = AdmissionController(
+            "test", max_concurrency=1, max_queue=1, queue_timeout_seconds=5
+        )
+        permit = await controller.admit()
+        admitted = threading.Event()
+
+        def wait():
+            with controller.limit_sync():
+                admitted.set()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        while not controller.queued:
+            await asyncio.sleep(0.001)
+        self.assertFalse(admitted.is_set())
+        permit.release()
+        thread.join()
+
+        self.assertTrue(admitted.is_set())
+        self.assertEqual(controller.active, 0)
+
+
+class TestSendMessageAdmission(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.admission = AdmissionController(
+            "coach", max_concurrency=1, max_queue=0, retry_after_seconds=2
+        )
+        self.coach = LanguageCoach(
+            llm=FakeListChatModel(responses=["Hello there."]),
+            teacher_db=TeacherDB(mongo_client=mongomock.MongoClient()),
+            language_detector=ScriptLanguageDetector(),
+            admission=self.admission,
+        )
+        self.previous = main.languageCoach
+        main.languageCoach = self.coach
+        self.client = TestClient(main.app)
+        self.conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        main.languageCoach = self.previous
+        self.coach.close()
+        return super().tearDown()
+
+    def send_message(self):
+        return self.client.get(
+            "/send-message",
+            params={"conversation_id": self.conversation_id, "message": "hello"},
+        )
+
+    def test_overloaded_stream_is_rejected_with_retry_after(self):
+        permit = asyncio.run(self.admission.admit())
+
+        rejected = self.send_message()
+        permit.release()
+        accepted = self.send_message()
+
+        self.assertEqual(rejected.status_code, 429)
+        self.assertEqual(rejected.headers["Retry-After"], "2")
+        self.assertEqual(accepted.status_code, 200)
+        self.assertEqual(self.admission.active, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
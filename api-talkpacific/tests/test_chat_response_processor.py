@@ -1,5 +1,8 @@
+import random
 import unittest
 from api_talkpacific.language_coach import ChatResponseChunkProcessor
+from api_talkpacific.models import ChatResponseChunk
+from api_talkpacific.sentence_segmenter import SENTENCE_BOUNDARY
 
 
 class TestChatResponseChunkProcessor(unittest.TestCase):
@@ -51,6 +54,74 @@ class TestChatResponseChunkProcessor(unittest.TestCase):
         sentences = processor.create_sentences()
         self.assertEqual(len(sentences), 0)
 
+    def test_process_chunk_accumulates_content(self):
+        processor = ChatResponseChunkProcessor("test_id")
+        for delta in ["Hello", "", " world", "."]:
+            processor.process_chunk(delta)
+        state = processor.finish()
+        self.assertEqual(state.content, "Hello world.")
+        self.assertTrue(state.content_finished)
+        self.assertEqual(state.sentence_indices, [(0, len("Hello world."))])
+
+    def test_process_chunk_serializes_like_validated_chunk(self):
+        processor = ChatResponseChunkProcessor("test_id")
+        chunk = processor.process_chunk('"你好"\t')
+        expected = ChatResponseChunk(
+            conversation_id="test_id",
+            content_id=processor.state.content_id,
+            delta='"你好"\t',
+            is_finished=False,
+        )
+        self.assertEqual(
+            chunk.model_dump_json(exclude_unset=True),
+            expected.model_dump_json(exclude_unset=True),
+        )
+
+    def test_sentences_close_while_streaming(self):
+        processor = ChatResponseChunkProcessor("test_id")
+        chunks = [
+            processor.process_chunk(delta)
+            for delta in ["First", " sentence.", " Second", " one!", "\n", "Tail"]
+        ]
+        self.assertIsNone(chunks[0].sentence_indices)
+        self.assertEqual(chunks[2].sentence_indices, [(0, 15)])
+        self.assertEqual(chunks[4].sentence_indices, [(16, 27)])
+        state = processor.finish()
+        self.assertEqual(state.sentence_indices, [(0, 15), (16, 27), (28, 32)])
+
+    def test_incremental_sentences_match_full_scan(self):
+        samples = [
+            "What's up? Everything's fine! Great.",
+            "* Item 1\n* Item 2\nLast line.",
+            "Mr. Smith said e.g. this.\n\n  Then?  ! ok.\n",
+            "你好! (Nǐ hǎo!) This means hello.\nIf you want, say 您好. ",
+            "   ",
+        ]
+        rng = random.Random(7)
+        for content in samples:
+            expected = self._full_scan(content)
+            for _ in range(20):
+                processor = ChatResponseChunkProcessor("test_id")
+                position = 0
+                while position < len(content):
+                    size = rng.randint(1, 4)
+                    processor.process_chunk(content[position:position + size])
+                    position += size
+                state = processor.finish()
+                self.assertEqual(state.sentence_indices, expected, content)
+
+    @staticmethod
+    def _full_scan(content):
+        sentence_indices = []
+        start_index = 0
+        for match in SENTENCE_BOUNDARY.finditer(content):
+            if content[start_index:match.start()].strip():
+                sentence_indices.append((start_index, match.start()))
+            start_index = match.end()
+        if start_index < len(content):
+            sentence_indices.append((start_index, len(content)))
+        return sentence_indices
+
 
 if __name__ == "__main__":
     unittest.main()
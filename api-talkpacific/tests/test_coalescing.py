@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+from api_talkpacific.coalescing import DeltaCoalescer
+from api_talkpacific.models import ChatResponseChunk
+
+
+def chunk(delta: str, **fields) -> ChatResponseChunk:
+    return ChatResponseChunk.model_construct(
+        conversation_id="conversation",
+        content_id="content",
+        delta=delta,
+        is_finished=fields.pop("is_finished", False),
+        **fields,
+    )
+
+
+async def stream(chunks, delay: float = 0):
+    for item in chunks:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+class TestDeltaCoalescer(unittest.IsolatedAsyncioTestCase):
+
+    async def collect(self, coalescer, chunks, delay: float = 0):
+        return [frame async for frame in coalescer.coalesce(stream(chunks, delay))]
+
+    async def test_merges_deltas_up_to_max_bytes(self):
+        coalescer = DeltaCoalescer(max_bytes=6, max_delay_seconds=1)
+        chunks = [chunk(delta) for delta in ["He", "ll", "o ", "th", "er", "e"]]
+
+        frames = await self.collect(coalescer, chunks + [chunk("", is_finished=True)])
+
+        self.assertEqual([frame.delta for frame in frames], ["Hello ", "there", ""])
+        self.assertTrue(frames[-1].is_finished)
+        self.assertEqual(coalescer.saved, 4)
+
+    async def test_flushes_at_sentence_boundary(self):
+        coalescer = DeltaCoalescer(max_bytes=1000, max_delay_seconds=1)
+        chunks = [
+            chunk("Hi"),
+            chunk(".", sentence_indices=[(0, 3)]),
+            chunk(" 你", sentence_learning_phrases=[(0, [])]),
+            chunk("好", sentence_indices=[(4, 6)]),
+            chunk("", is_finished=True, sentence_indices=[(0, 3), (4, 6)]),
+        ]
+
+        frames = await self.collect(coalescer, chunks)
+
+        self.assertEqual([frame.delta for frame in frames], ["Hi.", " 你好", ""])
+        self.assertEqual(frames[0].sentence_indices, [(0, 3)])
+        self.assertEqual(frames[1].sentence_indices, [(4, 6)])
+        self.assertEqual(frames[1].sentence_learning_phrases, [(0, [])])
+        self.assertEqual(
+            frames[1].model_dump_json(exclude_unset=True),
+            '{"conversation_id":"conversation","content_id":"content",'
+            '"delta":" 你好","is_finished":false,"sentence_indices":[[4,6]],'
+            '"sentence_learning_phrases":[[0,[]]]}',
+        )
+
+    async def test_flushes_after_time_budget(self):
+        coalescer = DeltaCoalescer(max_bytes=1000, max_delay_seconds=0.01)
+        chunks = [chunk(str(i)) for i in range(4)] + [chunk("", is_finished=True)]
+
+        frames = await self.collect(coalescer, chunks, delay=0.02)
+
+        self.assertEqual([frame.delta for frame in frames], ["0", "1", "2", "3", ""])
+
+    async def test_zero_bytes_sends_every_token(self):
+        coalescer = DeltaCoalescer(max_bytes=0)
+        chunks = [chunk("a"), chunk("b"), chunk("", is_finished=True)]
+
+        frames = await self.collect(coalescer, chunks)
+
+        self.assertEqual(frames, chunks)
+        self.assertEqual(coalescer.saved, 0)
+
+    async def test_upstream_error_is_raised(self):
+        async def failing():
+            yield chunk("a")
+            raise ValueError("upstream failed")
+
+        coalescer = DeltaCoalescer(max_bytes=1000, max_delay_seconds=1)
+
+        with self.assertRaises(ValueError):
+            [frame async for frame in coalescer.coalesce(failing())]
+
+
+if __name__ == "__main__":
+    unittest.main()
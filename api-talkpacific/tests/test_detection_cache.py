@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import unittest
+from typing import List
+from unittest import mock
+import mongomock
+from langchain_core.messages import AIMessage
+from api_talkpacific.detection_cache import MemoizedLanguageDetector
+from api_talkpacific.language_detector import (
+    DetectionFailed,
+    LanguageDetectionStrategy,
+    LanguageDetector,
+)
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.sentence_detection import AsyncSentencePhraseDetection
+
+
+class CountingDetector(LanguageDetectionStrategy):
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls: List[str] = []
+        self._lock = threading.Lock()
+
+    def detect(self, message, primary, learning):
+        with self._lock:
+            self.calls.append(message)
+        threading.Event().wait(self.delay)
+        return ScriptLanguageDetector().detect(message, primary, learning)
+
+    async def adetect(self, message, primary, learning):
+        with self._lock:
+            self.calls.append(message)
+        await asyncio.sleep(self.delay)
+        return ScriptLanguageDetector().detect(message, primary, learning)
+
+
+class TestMemoizedLanguageDetector(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.collection = mongomock.MongoClient().teacher.detections
+        self.detector = CountingDetector()
+        self.memoized = MemoizedLanguageDetector(
+            self.detector, collection=self.collection
+        )
+        return super().setUp()
+
+    def test_detect_once_per_message(self):
+        for _ in range(3):
+            phrases = self.memoized.detect(
+                "Say 你好!", Language.English, Language.Chinese
+            )
+
+        self.assertEqual(phrases, ["你好!"])
+        self.assertEqual(self.detector.calls, ["Say 你好!"])
+        self.assertEqual(self.memoized.stats()["hits"], 2)
+
+    def test_results_persist_across_instances(self):
+        self.memoized.detect("Say 你好!", Language.English, Language.Chinese)
+        memoized = MemoizedLanguageDetector(self.detector, collection=self.collection)
+
+        phrases = memoized.detect("Say 你好!", Language.English, Language.Chinese)
+
+        self.assertEqual(phrases, ["你好!"])
+        self.assertEqual(len(self.detector.calls), 1)
+        self.assertEqual(memoized.stats()["persistent_hits"], 1)
+
+    def test_detect_many_uses_one_query(self):
+        self.memoized.detect("Say 你好!", Language.English, Language.Chinese)
+        memoized = MemoizedLanguageDetector(self.detector, collection=self.collection)
+        messages = ["Say 你好!", "Then 谢谢.", "Say 你好!", "Nothing."]
+
+        with mock.patch.object(
+            self.collection, "find", wraps=self.collection.find
+        ) as find:
+            results = memoized.detect_many(
+                messages, Language.English, Language.Chinese
+            )
+
+        self.assertEqual(results, [["你好!"], ["谢谢."], ["你好!"], []])
+        self.assertEqual(find.call_count, 1)
+        self.assertEqual(self.detector.calls, ["Say 你好!", "Then 谢谢.", "Nothing."])
+
+    async def test_concurrent_misses_coalesce(self):
+        self.detector.delay = 0.01
+
+        results = await asyncio.gather(
+            *[
+                self.memoized.adetect("Say 你好!", Language.English, Language.Chinese)
+                for _ in range(5)
+            ]
+        )
+
+        self.assertEqual(results, [["你好!"]] * 5)
+        self.assertEqual(self.detector.calls, ["Say 你好!"])
+        self.assertEqual(self.memoized.stats()["coalesced"], 4)
+
+    async def test_cancelled_detection_does_not_fail_waiters(self):
+        self.detector.delay = 0.05
+        first = asyncio.create_task(
+            self.memoized.adetect("Say 你好!", Language.English, Language.Chinese)
+        )
+        second = asyncio.create_task(
+            self.memoized.adetect("Say 你好!", Language.English, Language.Chinese)
+        )
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+
+        self.assertEqual(await second, ["你好!"])
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        self.assertEqual(self.detector.calls, ["Say 你好!", "Say 你好!"])
+
+    async def test_cancelled_sentence_has_no_phrases(self):
+        self.detector.delay = 0.05
+        detection = AsyncSentencePhraseDetection(
+            self.memoized, Language.English, Language.Chinese, max_concurrency=2
+        )
+        detection.submit(["Say 你好!"])
+        other = asyncio.create_task(
+            self.memoized.adetect("Say 你好!", Language.English, Language.Chinese)
+        )
+        await asyncio.sleep(0.01)
+        sentence = detection._pending[0][1]
+
+        sentence.cancel()
+        await asyncio.sleep(0)
+
+        self.assertTrue(sentence.cancelled())
+        self.assertEqual(detection.pop_completed(), [(0, [])])
+        self.assertEqual(await other, ["你好!"])
+
+    async def test_cancelled_waiter_does_not_cancel_detection(self):
+        self.detector.delay = 0.05
+        first = asyncio.create_task(
+            self.memoized.adetect("Say 你好!", Language.English, Language.Chinese)
+        )
+        second = asyncio.create_task(
+            self.memoized.adetect("Say 你好!", Language.English, Language.Chinese)
+        )
+        await asyncio.sleep(0.01)
+
+        second.cancel()
+
+        self.assertEqual(await first, ["你好!"])
+        self.assertEqual(self.detector.calls, ["Say 你好!"])
+
+    def test_namespace_separates_detectors(self):
+        self.memoized.detect("Say 你好!", Language.English, Language.Chinese)
+        other = CountingDetector()
+        other.cache_namespace = lambda: "other"
+        memoized = MemoizedLanguageDetector(other, collection=self.collection)
+
+        memoized.detect("Say 你好!", Language.English, Language.Chinese)
+
+        self.assertEqual(other.calls, ["Say 你好!"])
+
+    def test_failed_detection_is_not_cached(self):
+        self.detector.detect = mock.Mock(
+            side_effect=[DetectionFailed("not a JSON array"), ["你好!"]]
+        )
+
+        with self.assertRaises(DetectionFailed):
+            self.memoized.detect("Say 你好!", Language.English, Language.Chinese)
+        phrases = self.memoized.detect("Say 你好!", Language.English, Language.Chinese)
+
+        self.assertEqual(phrases, ["你好!"])
+        self.assertEqual(self.detector.detect.call_count, 2)
+        self.assertEqual(self.collection.count_documents({}), 1)
+
+    def test_persisted_detections_expire(self):
+        indexes = self.collection.index_information()
+
+        self.assertEqual(
+            indexes["created_at_1"]["expireAfterSeconds"], 30 * 24 * 3600
+        )
+
+
+class TestLanguageDetectorResponse(unittest.TestCase):
+
+    def test_unparsable_response_raises(self):
+        for content in ["Sure! Here are the phrases", '{"phrases": []}']:
+            with self.assertRaises(DetectionFailed):
+                LanguageDetector._parse_response(AIMessage(content=content))
+
+        response = AIMessage(content='["你好!"]')
+        self.assertEqual(LanguageDetector._parse_response(response), ["你好!"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from api_talkpacific import frames
+from api_talkpacific.frames import (
+    MsgpackFrameEncoder,
+    SSEFrameEncoder,
+    frame_encoder,
+)
+from api_talkpacific.models import ChatResponseChunk
+
+DELTAS = ["Hello", ' "quoted"', "\\", "\n\t\r\b\f", "\x00\x1f\x7f", "你好", "😀", " "]
+
+
+def pydantic_frame(chunk: ChatResponseChunk) -> bytes:
+    return f"data: {chunk.model_dump_json(exclude_unset=True)}\n\n".encode()
+
+
+class TestSSEFrameEncoder(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.encoder = SSEFrameEncoder()
+        return super().setUp()
+
+    def test_delta_frames_match_pydantic(self):
+        for conversation_id in ["first", 'se"cond']:
+            for delta in DELTAS:
+                chunk = ChatResponseChunk.model_construct(
+                    conversation_id=conversation_id,
+                    content_id="é",
+                    delta=delta,
+                    is_finished=False,
+                )
+
+                self.assertEqual(self.encoder.encode(chunk), pydantic_frame(chunk))
+
+    def test_annotated_and_final_frames_match_pydantic(self):
+        annotated = ChatResponseChunk.model_construct(
+            conversation_id="conversation",
+            content_id="content",
+            delta=" 你好!",
+            is_finished=False,
+            sentence_indices=[(0, 6)],
+            sentence_learning_phrases=[(0, ["你好!"])],
+        )
+        final = ChatResponseChunk(
+            conversation_id="conversation",
+            content_id="content",
+            delta="",
+            is_finished=True,
+            sentence_indices=[(0, 6)],
+            learning_phrases=["你好!"],
+            timings={"history_load": 1.0, "first_token": 312.4},
+        )
+
+        self.assertEqual(self.encoder.encode(annotated), pydantic_frame(annotated))
+        self.assertEqual(self.encoder.encode(final), pydantic_frame(final))
+
+
+class TestFrameEncoderNegotiation(unittest.TestCase):
+
+    def test_event_stream_by_default(self):
+        self.assertIsInstance(frame_encoder(None), SSEFrameEncoder)
+        self.assertIsInstance(frame_encoder("text/event-stream"), SSEFrameEncoder)
+
+    def test_msgpack_when_accepted(self):
+        if frames.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        chunk = ChatResponseChunk.model_construct(
+            conversation_id="conversation",
+            content_id="content",
+            delta="你好",
+            is_finished=False,
+        )
+
+        encoder = frame_encoder("application/x-msgpack")
+        encoded = encoder.encode(chunk)
+
+        self.assertIsInstance(encoder, MsgpackFrameEncoder)
+        self.assertEqual(
+            frames.msgpack.unpackb(encoded), chunk.model_dump(exclude_unset=True)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
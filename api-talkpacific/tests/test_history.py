@@ -0,0 +1,137 @@
+import asyncio
+import unittest
+import mongomock
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from api_talkpacific.history import (
+    FullHistory,
+    SummaryHistory,
+    TokenBudgetHistory,
+    TokenCounter,
+)
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import ConversationRole, TeacherDB
+
+
+class CountingTokenizer:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return len(text.split())
+
+
+class TestHistoryStrategies(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.db = TeacherDB(mongo_client=mongomock.MongoClient())
+        self.conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        self.tokenizer = CountingTokenizer()
+        self.token_counter = TokenCounter(count_tokens=self.tokenizer)
+        return super().setUp()
+
+    def test_full_history_replays_everything(self):
+        self._add_turns(2)
+        history = FullHistory().load(self.db.get_conversation(self.conversation_id))
+        self.assertEqual(
+            [type(m) for m in history],
+            [HumanMessage, AIMessage, HumanMessage, AIMessage],
+        )
+
+    def test_token_budget_keeps_recent_messages(self):
+        self._add_turns(3)
+        strategy = TokenBudgetHistory(max_tokens=11, token_counter=self.token_counter)
+        memory = self.db.get_conversation(self.conversation_id)
+
+        history = strategy.load(memory)
+        strategy.load(memory)
+
+        self.assertEqual(
+            [m.content for m in history],
+            ["teacher two one", "student three a b", "teacher three a b"],
+        )
+        self.assertEqual(self.tokenizer.calls, 4)
+
+    async def test_summary_only_recomputed_when_window_slides(self):
+        llm = FakeListChatModel(responses=["summary one", "summary two"])
+        strategy = SummaryHistory(
+            llm, self.db, max_tokens=16, token_counter=self.token_counter
+        )
+        self._add_turns(3)
+
+        history = await strategy.aload(self.db.get_conversation(self.conversation_id))
+        self.assertEqual(llm.i, 0)
+        self.assertEqual(len(history), 5)
+
+        await strategy.after_turn(self.conversation_id)
+        history = await strategy.aload(self.db.get_conversation(self.conversation_id))
+        memory = self.db.get_conversation(self.conversation_id)
+        self.assertEqual(memory.summary, "summary one")
+        self.assertEqual(memory.summary_position, 3)
+        self.assertIsInstance(history[0], SystemMessage)
+        self.assertEqual(
+            [m.content for m in history[1:]],
+            ["student three a b", "teacher three a b"],
+        )
+
+        self._add_turns(1, start=4)
+        await strategy.after_turn(self.conversation_id)
+        history = strategy.load(self.db.get_conversation(self.conversation_id))
+        memory = self.db.get_conversation(self.conversation_id)
+        self.assertEqual(memory.summary_position, 3)
+        self.assertEqual(len(history), 5)
+        self.assertEqual(llm.i, 1)
+
+    async def test_summary_folded_after_the_turn(self):
+        llm = FakeListChatModel(responses=["summary one", "summary two"])
+        strategy = SummaryHistory(
+            llm, self.db, max_tokens=16, token_counter=self.token_counter
+        )
+        coach = LanguageCoach(
+            llm=FakeListChatModel(responses=["teacher four"]),
+            teacher_db=self.db,
+            language_detector=ScriptLanguageDetector(),
+            history_strategy=strategy,
+        )
+        self._add_turns(3)
+
+        [c async for c in coach.asend_message(self.conversation_id, "student four")]
+        self.assertEqual(llm.i, 0)
+        await asyncio.gather(*strategy._folds.values())
+
+        memory = self.db.get_conversation(self.conversation_id)
+        self.assertEqual(memory.summary, "summary one")
+        self.assertEqual(llm.i, 1)
+
+    def test_deleting_summarized_messages_drops_summary(self):
+        self._add_turns(2)
+        self.db.update_summary(self.conversation_id, "summary", 1)
+        self.db.delete_messages(self.conversation_id, 0)
+        self.db.conversation_cache.clear()
+
+        memory = self.db.get_conversation(self.conversation_id)
+        self.assertIsNone(memory.summary)
+        self.assertEqual(memory.summary_position, -1)
+
+    def _add_turns(self, count: int, start: int = 1):
+        names = ["one", "two", "three", "four", "five"]
+        for turn in range(start, start + count):
+            name = names[turn - 1]
+            padding = " a b" * (turn > 2)
+            self.db.add_message(
+                self.conversation_id, ConversationRole.User, f"student {name}{padding}"
+            )
+            self.db.add_message(
+                self.conversation_id,
+                ConversationRole.Assistant,
+                f"teacher {name}" + (" one" if turn == 2 else padding),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+import mongomock
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.metrics import CANCELLED_STREAMS, TOKENS_SAVED, StreamObserver
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import ConversationRole, TeacherDB
+
+
+class TestLanguageCoachAsync(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.llm = FakeListChatModel(
+            responses=["Hello there. 你好!", "Good morning. 早上好!"],
+            sleep=0.001,
+        )
+        self.teacher_db = TeacherDB(mongo_client=mongomock.MongoClient())
+        self.coach = LanguageCoach(
+            llm=self.llm,
+            teacher_db=self.teacher_db,
+            language_detector=ScriptLanguageDetector(),
+        )
+        return super().setUp()
+
+    async def test_concurrent_streams_interleave(self):
+        first_id = self.coach.create_conversation(Language.English, Language.Chinese)
+        second_id = self.coach.create_conversation(Language.English, Language.Chinese)
+        received = []
+
+        async def consume(conversation_id: str):
+            chunks = []
+            async for chunk in self.coach.asend_message(conversation_id, "hello"):
+                received.append(conversation_id)
+                chunks.append(chunk)
+            return chunks
+
+        first, second = await asyncio.gather(consume(first_id), consume(second_id))
+
+        switches = sum(1 for a, b in zip(received, received[1:]) if a != b)
+        self.assertGreater(switches, 2)
+        self.assertTrue(first[-1].is_finished)
+        self.assertTrue(second[-1].is_finished)
+        self.assertCountEqual(
+            [first[-1].learning_phrases, second[-1].learning_phrases],
+            [["你好!"], ["早上好!"]],
+        )
+
+    async def test_stream_persists_messages(self):
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        chunks = [c async for c in self.coach.asend_message(conversation_id, "hello")]
+        messages = self.teacher_db.get_messages(conversation_id)
+
+        content = "".join(chunk.delta for chunk in chunks)
+        self.assertEqual(content, "Hello there. 你好!")
+        self.assertEqual(chunks[-1].sentence_indices, [(0, 12), (13, 16)])
+        self.assertEqual(2, len(messages))
+        self.assertEqual(messages[0].role, ConversationRole.User)
+        self.assertEqual(messages[1].content, content)
+        self.assertEqual(messages[1].learning_phrases, ["你好!"])
+
+    async def test_phrases_detected_per_sentence(self):
+        self.llm.responses = ["Say 你好! Then 谢谢.\nAgain 你好!"]
+        detector = RecordingDetector()
+        self.coach.language_detector = detector
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        chunks = [c async for c in self.coach.asend_message(conversation_id, "hi")]
+
+        per_sentence = {}
+        for chunk in chunks:
+            per_sentence.update(dict(chunk.sentence_learning_phrases or []))
+        self.assertEqual(detector.sentences, ["Say 你好!", "Then 谢谢.", "Again 你好!"])
+        self.assertEqual(per_sentence, {0: ["你好!"], 1: ["谢谢."], 2: ["你好!"]})
+        self.assertEqual(chunks[-1].learning_phrases, ["你好!", "谢谢."])
+        self.assertTrue(all(c.learning_phrases is None for c in chunks[:-1]))
+
+    async def test_closed_stream_persists_truncated_message(self):
+        self.llm.responses = ["Say 你好! Then 谢谢."]
+        detector = RecordingDetector()
+        self.coach.language_detector = detector
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        StreamObserver.expected_tokens["english-chinese"] = 20
+        self.addCleanup(StreamObserver.expected_tokens.pop, "english-chinese")
+        cancelled = CANCELLED_STREAMS.value("english-chinese")
+        saved = TOKENS_SAVED.value("english-chinese")
+
+        stream = self.coach.asend_message(conversation_id, "hi")
+        chunks = [await anext(stream) for _ in range(5)]
+        await stream.aclose()
+        messages = self.teacher_db.get_messages(conversation_id)
+
+        self.assertEqual(messages[1].content, "".join(c.delta for c in chunks))
+        self.assertTrue(messages[1].truncated)
+        self.assertFalse(messages[0].truncated)
+        self.assertEqual(detector.sentences, [])
+        self.assertEqual(CANCELLED_STREAMS.value("english-chinese"), cancelled + 1)
+        self.assertEqual(TOKENS_SAVED.value("english-chinese"), saved + 15)
+
+    async def test_abandoned_flight_cancels_stream(self):
+        self.llm.sleep = 0.01
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        flight = self.coach.streams.flight(
+            conversation_id,
+            "hi",
+            lambda: self.coach.asend_message(conversation_id, "hi"),
+        )
+        await self.coach.streams.join(flight)
+        subscription = self.coach.streams.subscribe(flight)
+
+        first = await anext(subscription)
+        await subscription.aclose()
+        self.coach.streams.leave(flight)
+        await asyncio.wait([flight.task])
+        messages = self.teacher_db.get_messages(conversation_id)
+
+        self.assertIsInstance(flight.error, asyncio.CancelledError)
+        self.assertTrue(messages[1].truncated)
+        self.assertTrue(messages[1].content.startswith(first.delta))
+        self.assertLess(len(messages[1].content), len("Hello there. 你好!"))
+
+    async def test_cancel_during_user_insert_persists_empty_reply(self):
+        add_message = self.teacher_db.add_message
+
+        def slow_add_message(**kwargs):
+            if kwargs["role"] == ConversationRole.User:
+                time.sleep(0.05)
+            return add_message(**kwargs)
+
+        self.teacher_db.add_message = slow_add_message
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        stream = self.coach.asend_message(conversation_id, "hi")
+        first = asyncio.create_task(anext(stream))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        messages = self.teacher_db.get_messages(conversation_id)
+
+        self.assertEqual(
+            [(m.role, m.content, m.truncated) for m in messages],
+            [
+                (ConversationRole.User, "hi", False),
+                (ConversationRole.Assistant, "", True),
+            ],
+        )
+
+    async def test_chain_reused_across_messages(self):
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        with mock.patch.object(LanguageCoach, "_create_chain") as create_chain:
+            [c async for c in self.coach.asend_message(conversation_id, "hello")]
+            [c async for c in self.coach.asend_message(conversation_id, "again")]
+
+        create_chain.assert_not_called()
+
+
+class RecordingDetector(ScriptLanguageDetector):
+    def __init__(self):
+        super().__init__()
+        self.sentences = []
+
+    async def adetect(self, message, primary, learning):
+        self.sentences.append(message)
+        await asyncio.sleep(0.005)
+        return self.detect(message, primary, learning)
+
+
+if __name__ == "__main__":
+    unittest.main()
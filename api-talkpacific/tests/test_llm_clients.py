@@ -0,0 +1,24 @@
+import unittest
+from api_talkpacific.llm_clients import LLMClients
+
+
+class TestLLMClients(unittest.IsolatedAsyncioTestCase):
+
+    async def test_models_share_connection_pools(self):
+        clients = LLMClients(api_key="test")
+        self.addAsyncCleanup(clients.aclose)
+
+        for llm in [clients.coach_llm, clients.detector_llm]:
+            self.assertIs(llm.client._client._client, clients.http_client)
+            self.assertIs(llm.async_client._client._client, clients.http_async_client)
+        self.assertIsNone(clients.coach_llm.callbacks)
+
+    async def test_stdout_streaming_is_opt_in(self):
+        clients = LLMClients(api_key="test", stream_to_stdout=True)
+        self.addAsyncCleanup(clients.aclose)
+
+        self.assertEqual(len(clients.coach_llm.callbacks), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
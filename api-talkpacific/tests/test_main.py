@@ -0,0 +1,207 @@
+import asyncio
+import unittest
+from unittest import mock
+import mongomock
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific import main
+from api_talkpacific.admission import AdmissionController
+from api_talkpacific.conversation_cache import ConversationCache
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.metrics import CANCELLED_STREAMS
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import ConversationRole, TeacherDB
+
+
+class TestMessagesEndpoint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.coach = LanguageCoach(
+            llm=FakeListChatModel(responses=["Hello there."]),
+            teacher_db=TeacherDB(
+                mongo_client=mongomock.MongoClient(),
+                conversation_cache=ConversationCache(enabled=False),
+            ),
+            language_detector=ScriptLanguageDetector(),
+        )
+        self.previous = main.languageCoach
+        main.languageCoach = self.coach
+        self.client = TestClient(main.app)
+        self.conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        for position in range(5):
+            self.add_message(f"Message {position}")
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        main.languageCoach = self.previous
+        self.coach.close()
+        return super().tearDown()
+
+    def add_message(self, content: str) -> None:
+        self.coach.teacher_db.add_message(
+            self.conversation_id, ConversationRole.User, content
+        )
+
+    def get_messages(self, headers: dict = None, **params):
+        return self.client.get(
+            "/messages",
+            params={"conversation_id": self.conversation_id, **params},
+            headers=headers,
+        )
+
+    def test_pages_with_cursor(self):
+        first = self.get_messages(limit=3, fields="content").json()
+        second = self.get_messages(limit=3, cursor=first["next_cursor"]).json()
+
+        self.assertEqual([item["position"] for item in first["items"]], [0, 1, 2])
+        self.assertNotIn("sentence_indices", first["items"][0])
+        self.assertEqual([item["position"] for item in second["items"]], [3, 4])
+        self.assertNotIn("next_cursor", second)
+
+    def test_since_position_returns_newer_messages(self):
+        response = self.get_messages(since_position=3)
+
+        items = response.json()["items"]
+        self.assertEqual([item["content"] for item in items], ["Message 4"])
+
+    def test_unchanged_messages_are_not_modified(self):
+        etag = self.get_messages().headers["ETag"]
+
+        with mock.patch.object(self.coach.teacher_db.messages, "find") as find:
+            not_modified = self.get_messages(headers={"If-None-Match": etag})
+        self.add_message("Message 5")
+        modified = self.get_messages(headers={"If-None-Match": etag})
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        find.assert_not_called()
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified.headers["ETag"], etag)
+        self.assertEqual(len(modified.json()["items"]), 6)
+
+    def test_tag_covers_only_the_messages_served(self):
+        messages = self.coach.teacher_db.messages
+        insert_one = messages.insert_one
+        during = []
+
+        def read_during_insert(document, *args, **kwargs):
+            during.append(self.get_messages())
+            return insert_one(document, *args, **kwargs)
+
+        with mock.patch.object(messages, "insert_one", side_effect=read_during_insert):
+            self.add_message("Message 5")
+        after = self.get_messages(headers={"If-None-Match": during[0].headers["ETag"]})
+
+        self.assertEqual(len(during[0].json()["items"]), 5)
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(len(after.json()["items"]), 6)
+
+    def test_tag_depends_on_the_query(self):
+        etags = {
+            self.get_messages(**params).headers["ETag"]
+            for params in [
+                {},
+                {"fields": "content"},
+                {"limit": 2},
+                {"cursor": 1},
+                {"since_position": 2},
+            ]
+        }
+
+        self.assertEqual(len(etags), 5)
+        full_page = self.get_messages(limit=2).headers["ETag"]
+        self.add_message("Message 5")
+        self.assertEqual(
+            self.get_messages(
+                limit=2, headers={"If-None-Match": full_page}
+            ).status_code,
+            304,
+        )
+
+
+class TestSendMessageDisconnect(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.admission = AdmissionController("coach", max_concurrency=1)
+        self.coach = LanguageCoach(
+            llm=FakeListChatModel(
+                responses=["Hello there, how are you today? 你好!"], sleep=0.02
+            ),
+            teacher_db=TeacherDB(mongo_client=mongomock.MongoClient()),
+            language_detector=ScriptLanguageDetector(),
+            admission=self.admission,
+        )
+        self.previous = main.languageCoach
+        main.languageCoach = self.coach
+        self.conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        main.languageCoach = self.previous
+        self.coach.close()
+        return super().tearDown()
+
+    async def send_message(self, disconnect_after: int) -> list:
+        """
+        Drive /send-message through the ASGI app, disconnecting the client once
+        disconnect_after frames were sent.
+        """
+        bodies = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message["body"]:
+                bodies.append(message["body"])
+                if len(bodies) == disconnect_after:
+                    disconnected.set()
+
+        query = f"conversation_id={self.conversation_id}&message=hi&coalesce_bytes=0"
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/send-message",
+            "raw_path": b"/send-message",
+            "query_string": query.encode(),
+            "headers": [(b"idempotency-key", b"key-1")],
+            "scheme": "http",
+            "server": ("testserver", 80),
+            "client": ("testclient", 50000),
+            "root_path": "",
+            "http_version": "1.1",
+        }
+        await main.app(scope, receive, send)
+        return bodies
+
+    async def test_disconnect_cancels_the_stream(self):
+        cancelled = CANCELLED_STREAMS.value("english-chinese")
+
+        bodies = await self.send_message(disconnect_after=3)
+        # The stream and its permit are released after the reply is saved.
+        for _ in range(100):
+            saved = len(self.coach.get_messages(self.conversation_id)) == 2
+            if saved and self.admission.active == 0:
+                break
+            await asyncio.sleep(0.01)
+        messages = self.coach.get_messages(self.conversation_id)
+
+        self.assertEqual(len(bodies), 3)
+        self.assertEqual(messages[0].content, "hi")
+        self.assertTrue(messages[1].truncated)
+        self.assertLess(len(messages[1].content), 10)
+        self.assertEqual(CANCELLED_STREAMS.value("english-chinese"), cancelled + 1)
+        self.assertEqual(self.admission.active, 0)
+        self.assertEqual(self.coach.streams._flights, {})
+        self.assertEqual(self.coach.streams._locks, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
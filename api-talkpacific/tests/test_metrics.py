@@ -0,0 +1,112 @@
+import unittest
+import mongomock
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific import main
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.metrics import (
+    ACTIVE_STREAMS,
+    SSE_STREAM_FRAMES,
+    TEACHER_DB_SECONDS,
+    TIME_TO_FIRST_TOKEN_SECONDS,
+    Registry,
+)
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import TeacherDB
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_render_counter_and_gauge(self):
+        registry = Registry()
+        counter = registry.counter("requests_total", "Requests.", ["path"])
+        gauge = registry.gauge("in_flight", "In flight.")
+        counter.inc("/send-message")
+        counter.inc("/send-message", amount=2)
+        gauge.inc()
+        gauge.dec()
+
+        self.assertEqual(
+            registry.render(),
+            "# HELP requests_total Requests.\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{path="/send-message"} 3\n'
+            "# HELP in_flight In flight.\n"
+            "# TYPE in_flight gauge\n"
+            "in_flight 0\n",
+        )
+
+    def test_render_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        histogram = registry.histogram("seconds", "Duration.", ["op"], [0.1, 1])
+        for value in [0.05, 0.5, 0.5, 5]:
+            histogram.observe(value, 'say "hi"')
+
+        lines = registry.render().splitlines()
+
+        self.assertEqual(
+            lines[2:],
+            [
+                'seconds_bucket{op="say \\"hi\\"",le="0.1"} 1',
+                'seconds_bucket{op="say \\"hi\\"",le="1"} 3',
+                'seconds_bucket{op="say \\"hi\\"",le="+Inf"} 4',
+                'seconds_sum{op="say \\"hi\\""} 6.05',
+                'seconds_count{op="say \\"hi\\""} 4',
+            ],
+        )
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.teacher_db = TeacherDB(mongo_client=mongomock.MongoClient())
+        self.coach = LanguageCoach(
+            llm=FakeListChatModel(responses=["Hello there. 你好!"]),
+            teacher_db=self.teacher_db,
+            language_detector=ScriptLanguageDetector(),
+        )
+        self.previous_coach = main.languageCoach
+        main.languageCoach = self.coach
+        self.client = TestClient(main.app)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        main.languageCoach = self.previous_coach
+        self.coach.close()
+        return super().tearDown()
+
+    def test_stream_is_observed(self):
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        ttft = TIME_TO_FIRST_TOKEN_SECONDS.count("english-chinese")
+        frames = SSE_STREAM_FRAMES.count("english-chinese")
+        writes = TEACHER_DB_SECONDS.count("add_message")
+
+        response = self.client.get(
+            "/send-message",
+            params={"conversation_id": conversation_id, "message": "hello"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TIME_TO_FIRST_TOKEN_SECONDS.count("english-chinese"), ttft + 1)
+        self.assertEqual(SSE_STREAM_FRAMES.count("english-chinese"), frames + 1)
+        self.assertEqual(TEACHER_DB_SECONDS.count("add_message"), writes + 2)
+        self.assertEqual(ACTIVE_STREAMS.value("english-chinese"), 0)
+
+    def test_metrics_include_cache_stats(self):
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn(
+            "# TYPE talkpacific_time_to_first_token_seconds histogram", response.text
+        )
+        self.assertIn(
+            'talkpacific_cache{cache="conversation",stat="hits"}', response.text
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
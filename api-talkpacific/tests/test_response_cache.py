@@ -0,0 +1,85 @@
+import unittest
+import mongomock
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.models import Language
+from api_talkpacific.response_cache import ResponseCache
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import TeacherDB
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.llm = FakeListChatModel(responses=["Hello there. 你好!", "Other."])
+        self.teacher_db = TeacherDB(mongo_client=mongomock.MongoClient())
+        self.response_cache = ResponseCache(
+            collection=self.teacher_db.db.response_cache
+        )
+        self.coach = LanguageCoach(
+            llm=self.llm,
+            teacher_db=self.teacher_db,
+            language_detector=ScriptLanguageDetector(),
+            response_cache=self.response_cache,
+        )
+        return super().setUp()
+
+    async def test_hit_replays_the_same_frames(self):
+        first = await self._send("Hello")
+        second = await self._send(" hello ")
+
+        self.assertEqual(self.llm.i, 1)
+        self.assertEqual(self._frames(first), self._frames(second))
+        self.assertNotEqual(first[0].content_id, second[0].content_id)
+        self.assertEqual(second[-1].learning_phrases, ["你好!"])
+        self.assertEqual(
+            self.response_cache.stats(),
+            {"english-chinese": {"hits": 1, "misses": 1, "hit_rate": 0.5}},
+        )
+
+    async def test_hit_persists_the_turn(self):
+        await self._send("hello")
+        conversation_id = (await self._send("hello"))[0].conversation_id
+
+        messages = self.teacher_db.get_messages(conversation_id)
+        self.assertEqual([m.content for m in messages], ["hello", "Hello there. 你好!"])
+        self.assertEqual(messages[1].learning_phrases, ["你好!"])
+        self.assertEqual(messages[1].sentence_indices, [(0, 12), (13, 16)])
+
+    async def test_bypassed_with_history(self):
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        for _ in range(2):
+            [c async for c in self.coach.asend_message(conversation_id, "hello")]
+
+        self.assertEqual(self.llm.i, 0)
+        self.assertEqual(self.response_cache.stats()["english-chinese"]["misses"], 1)
+
+    async def test_persistent_tier_shared_across_caches(self):
+        first = await self._send("hello")
+        self.coach.response_cache = ResponseCache(
+            collection=self.teacher_db.db.response_cache
+        )
+        second = await self._send("hello")
+
+        self.assertEqual(self.llm.i, 1)
+        self.assertEqual(self._frames(first), self._frames(second))
+
+    async def _send(self, message: str):
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        return [c async for c in self.coach.asend_message(conversation_id, message)]
+
+    @staticmethod
+    def _frames(chunks):
+        return [
+            chunk.model_dump_json(exclude_unset=True, exclude={"content_id"})
+            .replace(chunk.conversation_id, "")
+            for chunk in chunks
+        ]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from api_talkpacific.language_detector import LanguageDetectionStrategy
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+
+
+class RecordingDetector(LanguageDetectionStrategy):
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, message, primary, learning):
+        self.calls.append((message, primary, learning))
+        return ["hola"]
+
+
+class TestScriptLanguageDetector(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.fallback = RecordingDetector()
+        self.detector = ScriptLanguageDetector(fallback=self.fallback)
+        return super().setUp()
+
+    def test_prompt_examples(self):
+        message = (
+            '你好! (Nǐ hǎo!) This means "hello" in Chinese. '
+            'If you want to be more polite, you can say "您好" (Nín hǎo).'
+        )
+        phrases = self.detector.detect(message, Language.English, Language.Chinese)
+        self.assertEqual(phrases, ["你好!", "您好"])
+
+        message = (
+            "你好, Kyle。我叫[Your Name]。很高兴认识你！"
+            "(Nǐ hǎo, Kyle. Wǒ jiào [Your Name]. Hěn gāoxìng rènshì nǐ!)"
+        )
+        phrases = self.detector.detect(message, Language.English, Language.Chinese)
+        self.assertEqual(phrases, ["你好", "我叫", "很高兴认识你！"])
+
+    def test_phrases_span_spaces_and_commas(self):
+        message = 'Say "Привет, как дела?" (Privet) and then "Пока".'
+        phrases = self.detector.detect(message, Language.English, Language.Russian)
+        self.assertEqual(phrases, ["Привет, как дела?", "Пока"])
+
+    def test_repeated_phrases_are_reported_once(self):
+        message = "안녕하세요! means hello. Say 안녕하세요! again."
+        phrases = self.detector.detect(message, Language.English, Language.Korean)
+        self.assertEqual(phrases, ["안녕하세요!"])
+
+    def test_same_script_pair_uses_fallback(self):
+        phrases = self.detector.detect("Hola amigo", Language.English, Language.Spanish)
+        self.assertEqual(phrases, ["hola"])
+        self.assertEqual(len(self.fallback.calls), 1)
+
+    def test_shared_han_script_uses_fallback(self):
+        self.detector.detect("日本語", Language.Chinese, Language.Japanese)
+        self.assertEqual(len(self.fallback.calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
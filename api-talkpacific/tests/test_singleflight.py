@@ -0,0 +1,232 @@
+import asyncio
+import json
+import unittest
+import mongomock
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific import main
+from api_talkpacific.admission import AdmissionController, Overloaded
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.models import ChatResponseChunk, Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.singleflight import ConversationStreams, IdempotencyConflict
+from api_talkpacific.teacher_db import TeacherDB
+
+
+def chunk(delta: str) -> ChatResponseChunk:
+    return ChatResponseChunk.model_construct(
+        conversation_id="conversation",
+        content_id="content",
+        delta=delta,
+        is_finished=False,
+    )
+
+
+class FakeCoach:
+    def __init__(self, deltas=("Hello", " there"), delay: float = 0.01):
+        self.deltas = deltas
+        self.delay = delay
+        self.events = []
+
+    def stream(self, name: str):
+        async def run():
+            self.events.append(f"{name} started")
+            for delta in self.deltas:
+                await asyncio.sleep(self.delay)
+                yield chunk(delta)
+            self.events.append(f"{name} finished")
+
+        return run
+
+
+class TestConversationStreams(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.streams = ConversationStreams()
+        self.coach = FakeCoach()
+        return super().setUp()
+
+    async def collect(self, flight):
+        await self.streams.join(flight)
+        try:
+            return [item.delta async for item in self.streams.subscribe(flight)]
+        finally:
+            self.streams.leave(flight)
+
+    async def test_same_key_shares_one_stream(self):
+        first = self.streams.flight("c", "hi", self.coach.stream("first"), key="k")
+        second = self.streams.flight("c", "hi", self.coach.stream("second"), key="k")
+
+        results = await asyncio.gather(self.collect(first), self.collect(second))
+        replayed = self.streams.flight("c", "hi", self.coach.stream("third"), key="k")
+
+        self.assertEqual(results, [["Hello", " there"], ["Hello", " there"]])
+        self.assertEqual(await self.collect(replayed), ["Hello", " there"])
+        self.assertEqual(self.coach.events, ["first started", "first finished"])
+        self.assertEqual(self.streams.joined, 2)
+
+    def test_key_reused_for_another_message_conflicts(self):
+        self.streams.flight("c", "hi", self.coach.stream("first"), key="k")
+
+        with self.assertRaises(IdempotencyConflict):
+            self.streams.flight("c", "bye", self.coach.stream("second"), key="k")
+
+    async def test_streams_of_a_conversation_run_in_turn(self):
+        flights = [
+            self.streams.flight("c", "hi", self.coach.stream("first")),
+            self.streams.flight("c", "hi", self.coach.stream("second")),
+            self.streams.flight("other", "hi", self.coach.stream("other")),
+        ]
+
+        await asyncio.gather(*[self.collect(flight) for flight in flights])
+
+        events = self.coach.events
+        self.assertLess(events.index("first finished"), events.index("second started"))
+        self.assertLess(events.index("other started"), events.index("first finished"))
+        self.assertEqual(self.streams._locks, {})
+
+    async def test_abandoned_stream_is_cancelled_and_retried(self):
+        flight = self.streams.flight("c", "hi", self.coach.stream("first"), key="k")
+        await self.streams.join(flight)
+        subscription = self.streams.subscribe(flight)
+
+        await anext(subscription)
+        await subscription.aclose()
+        self.streams.leave(flight)
+        await asyncio.sleep(0)
+        retry = self.streams.flight("c", "hi", self.coach.stream("retry"), key="k")
+
+        self.assertTrue(flight.task.cancelled() or flight.done)
+        self.assertIsNot(retry, flight)
+        self.assertEqual(await self.collect(retry), ["Hello", " there"])
+        self.assertEqual(
+            self.coach.events, ["first started", "retry started", "retry finished"]
+        )
+
+    async def test_failed_stream_raises_in_every_subscriber(self):
+        async def failing():
+            yield chunk("Hello")
+            raise ValueError("upstream failed")
+
+        flight = self.streams.flight("c", "hi", lambda: failing(), key="k")
+
+        results = await asyncio.gather(
+            self.collect(flight), self.collect(flight), return_exceptions=True
+        )
+
+        self.assertTrue(all(isinstance(e, ValueError) for e in results))
+        retry = self.streams.flight("c", "hi", self.coach.stream("retry"), key="k")
+        self.assertIsNot(retry, flight)
+
+    async def test_only_the_starting_request_is_admitted(self):
+        admission = AdmissionController("test", max_concurrency=1, max_queue=0)
+        first = self.streams.flight("c", "hi", self.coach.stream("first"), key="k")
+        second = self.streams.flight("c", "hi", self.coach.stream("second"))
+
+        await self.streams.join(first, admission)
+        await self.streams.join(first, admission)
+        waiting = asyncio.create_task(self.streams.join(second, admission))
+        await asyncio.sleep(0.005)
+        self.assertEqual((admission.active, admission.queued), (1, 0))
+        self.assertFalse(waiting.done())
+        with self.assertRaises(Overloaded):
+            await self.streams.join(
+                self.streams.flight("other", "hi", self.coach.stream("other")),
+                admission,
+            )
+
+        await self.collect(first)
+        self.streams.leave(first)
+        await waiting
+        self.assertEqual(
+            [item.delta async for item in self.streams.subscribe(second)],
+            ["Hello", " there"],
+        )
+        self.streams.leave(second)
+        self.assertEqual(admission.active, 0)
+        self.assertEqual(
+            self.coach.events,
+            ["first started", "first finished", "second started", "second finished"],
+        )
+
+    async def test_flights_never_started_are_evicted(self):
+        self.streams.max_entries = 2
+        self.streams.flight("c", "hi", self.coach.stream("dead"), key="dead")
+        for index in range(5):
+            flight = self.streams.flight(
+                "c", "hi", self.coach.stream(f"{index}"), key=f"{index}"
+            )
+            await self.collect(flight)
+
+        self.assertEqual(list(self.streams._flights), [("c", "3"), ("c", "4")])
+
+
+class TestIdempotentSendMessage(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.coach = LanguageCoach(
+            llm=FakeListChatModel(responses=["Hello there.", "Something else."]),
+            teacher_db=TeacherDB(mongo_client=mongomock.MongoClient()),
+            language_detector=ScriptLanguageDetector(),
+        )
+        self.previous = main.languageCoach
+        main.languageCoach = self.coach
+        self.client = TestClient(main.app)
+        self.conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        main.languageCoach = self.previous
+        self.coach.close()
+        return super().tearDown()
+
+    def send_message(self, message: str, key: str):
+        return self.client.get(
+            "/send-message",
+            params={"conversation_id": self.conversation_id, "message": message},
+            headers={"Idempotency-Key": key},
+        )
+
+    def content(self, response) -> str:
+        frames = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        return "".join(frame["delta"] for frame in frames)
+
+    def test_retry_replays_without_calling_the_llm(self):
+        first = self.send_message("hello", "key-1")
+        retry = self.send_message("hello", "key-1")
+        conflict = self.send_message("bye", "key-1")
+
+        self.assertEqual(self.content(first), "Hello there.")
+        self.assertEqual(self.content(retry), "Hello there.")
+        self.assertEqual(conflict.status_code, 422)
+        messages = self.coach.get_messages(self.conversation_id)
+        self.assertEqual([message.content for message in messages], [
+            "hello",
+            "Hello there.",
+        ])
+
+    def test_retry_after_rejection_is_admitted(self):
+        self.coach.admission = AdmissionController("coach", max_concurrency=1)
+        self.coach.streams.max_entries = 2
+        permit = asyncio.run(self.coach.admission.admit())
+
+        rejected = self.send_message("hello", "key-1")
+        permit.release()
+        retry = self.send_message("hello", "key-1")
+        for index in range(5):
+            self.send_message(f"again {index}", f"key-{index + 2}")
+
+        self.assertEqual(rejected.status_code, 429)
+        self.assertEqual(self.content(retry), "Hello there.")
+        self.assertEqual(len(self.coach.streams._flights), 2)
+        self.assertEqual(self.coach.admission.active, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,17 @@
 from typing import List
+from unittest import mock
 import mongomock
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import unittest
-from api_talkpacific.teacher_db import TeacherDB, ConversationMessage, ConversationRole
+from api_talkpacific.conversation_cache import ConversationCache
+from api_talkpacific.teacher_db import (
+    ConversationMessage,
+    ConversationRole,
+    MessageProjection,
+    TeacherDB,
+)
 from api_talkpacific.models import Language
+from api_talkpacific.write_behind import FLUSHED, WriteBehindQueue
 
 
 class TestConversationsDB(unittest.TestCase):
@@ -76,6 +85,70 @@ class TestConversationsDB(unittest.TestCase):
         self.assertEqual(messages[0].position, 0)
         self.assertEqual(messages[0].role, ConversationRole.User)
 
+    def test_positions_follow_edits_and_deletes(self):
+        db = self.db
+        conversation_id = self._initialize_conversation(db)
+
+        db.delete_messages(conversation_id, 1)
+        db.add_message(conversation_id, ConversationRole.Assistant, "您好！")
+        db.edit_user_message(conversation_id, 0, "Hi!")
+        db.add_message(conversation_id, ConversationRole.Assistant, "嗨！")
+        messages = db.get_messages(conversation_id)
+
+        self.assertEqual([m.position for m in messages], [0, 1])
+        self.assertEqual(messages[1].content, "嗨！")
+
+    def test_legacy_conversation_seeds_counter(self):
+        db = self.db
+        conversation_id = self._initialize_conversation(db)
+        db.conversations.update_one({}, {"$unset": {"next_position": ""}})
+
+        db.add_message(conversation_id, ConversationRole.User, "Thanks")
+
+        self.assertEqual(db.get_messages(conversation_id)[-1].position, 2)
+        self.assertEqual(db.conversations.find_one()["next_position"], 3)
+
+    def test_messages_version_changes_with_messages(self):
+        db = self.db
+        conversation_id = db.create_conversation(Language.English, Language.Chinese)
+        versions = [db.get_messages_version(conversation_id)]
+        for content in ["Hello!", "你好！", "Bye!"]:
+            db.add_message(conversation_id, ConversationRole.User, content)
+            versions.append(db.get_messages_version(conversation_id))
+        db.edit_user_message(conversation_id, 1, "再见!")
+        versions.append(db.get_messages_version(conversation_id))
+        db.add_message(conversation_id, ConversationRole.Assistant, "Bye!")
+        versions.append(db.get_messages_version(conversation_id))
+        db.delete_messages(conversation_id, 2)
+        versions.append(db.get_messages_version(conversation_id))
+
+        self.assertEqual(len(set(versions)), len(versions))
+        self.assertIsNone(db.get_messages_version("not an id"))
+
+    def test_duplicate_position_rejected(self):
+        db = self.db
+        conversation_id = self._initialize_conversation(db)
+        db.conversations.update_one({}, {"$set": {"next_position": 1}})
+
+        with self.assertRaises(DuplicateKeyError):
+            db.add_message(conversation_id, ConversationRole.User, "Thanks")
+
+    def test_starts_with_duplicate_positions(self):
+        client = mongomock.MongoClient()
+        client.teacher.messages.insert_many(
+            [
+                {"conversation_id": "legacy", "position": 0, "role": "user"},
+                {"conversation_id": "legacy", "position": 0, "role": "assistant"},
+            ]
+        )
+
+        with self.assertLogs(level="ERROR") as logs:
+            db = TeacherDB(mongo_client=client)
+        conversation_id = self._initialize_conversation(db)
+
+        self.assertIn("['legacy']", logs.output[0])
+        self.assertEqual(len(db.get_messages(conversation_id)), 2)
+
     def _initialize_conversation(self, db: TeacherDB) -> str:
         conversation_id = db.create_conversation(
             Language.English,
@@ -94,5 +167,337 @@ class TestConversationsDB(unittest.TestCase):
         return conversation_id
 
 
+class TestConversationCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.cache = ConversationCache(max_entries=2)
+        self.db = TeacherDB(
+            mongo_client=mongomock.MongoClient(), conversation_cache=self.cache
+        )
+        return super().setUp()
+
+    def test_follow_up_turn_makes_no_reads(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        self.db.get_conversation(conversation_id)
+        self._fail_on_reads()
+
+        self.db.add_message(conversation_id, ConversationRole.User, "Hello!")
+        self.db.add_message(conversation_id, ConversationRole.Assistant, "你好！")
+        memory = self.db.get_conversation(conversation_id)
+
+        self.assertEqual([m.position for m in memory.messages], [0, 1])
+        self.assertEqual(memory.messages[1].content, "你好！")
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_delete_and_edit_write_through(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        for content in ["Hello!", "你好！", "Thanks", "不客气"]:
+            self.db.add_message(conversation_id, ConversationRole.User, content)
+
+        self.db.delete_messages(conversation_id, 3)
+        self.db.edit_user_message(conversation_id, 0, "Hi!")
+        cached = self.db.get_conversation(conversation_id)
+        self.cache.clear()
+        stored = self.db.get_conversation(conversation_id)
+
+        self.assertEqual(cached.messages, stored.messages)
+        self.assertEqual([m.content for m in cached.messages], ["Hi!"])
+
+    def test_write_during_a_miss_is_not_hidden(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        self.cache.clear()
+        load_conversation = self.db._load_conversation
+
+        def write_after_the_read(*args):
+            document = load_conversation(*args)
+            self.db.add_message(conversation_id, ConversationRole.User, "Hello!")
+            return document
+
+        with mock.patch.object(
+            self.db, "_load_conversation", side_effect=write_after_the_read
+        ):
+            stale = self.db.get_conversation(conversation_id)
+        memory = self.db.get_conversation(conversation_id)
+
+        self.assertEqual(stale.messages, [])
+        self.assertEqual([m.content for m in memory.messages], ["Hello!"])
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_cached_copy_is_isolated(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        self.db.get_conversation(conversation_id).messages.append(None)
+        self.assertEqual(self.db.get_conversation(conversation_id).messages, [])
+
+    def test_bounded_entries_and_disable(self):
+        ids = [
+            self.db.create_conversation(Language.English, Language.Chinese)
+            for _ in range(3)
+        ]
+        self.assertEqual(self.cache.stats()["entries"], 2)
+        self.assertEqual(self.cache.evictions, 1)
+
+        self.cache.enabled = False
+        self.db.get_conversation(ids[2])
+        self.assertEqual(self.cache.hits, 0)
+
+    def _fail_on_reads(self):
+        # mongomock implements the position counter's find_one_and_update with
+        # conversations.find, so conversation reads are covered by misses.
+        for method in ["find", "find_one"]:
+            read = mock.patch.object(
+                self.db.messages, method, side_effect=AssertionError(method)
+            )
+            read.start()
+            self.addCleanup(read.stop)
+
+
+class TestWriteBehind(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.queue = WriteBehindQueue(max_batch=3, max_delay_seconds=60)
+        self.db = TeacherDB(
+            mongo_client=mongomock.MongoClient(),
+            conversation_cache=ConversationCache(enabled=False),
+            write_behind=self.queue,
+        )
+        self.addCleanup(self.db.close)
+        return super().setUp()
+
+    def test_reads_see_pending_writes(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        message_id = self.db.add_message(
+            conversation_id, ConversationRole.User, "Hello!"
+        )
+        self.db.add_message(conversation_id, ConversationRole.Assistant, "你好！")
+
+        self.assertEqual(self.db.messages.count_documents({}), 0)
+        self.assertEqual(self.db.get_message(message_id).content, "Hello!")
+        messages = self.db.get_conversation(conversation_id).messages
+        self.assertEqual([m.position for m in messages], [0, 1])
+
+        self.db.flush()
+        self.assertEqual(self.db.messages.count_documents({}), 2)
+        self.assertEqual(self.db.get_messages(conversation_id), messages)
+        self.assertEqual(self.queue.stats()["batches"], 1)
+
+    def test_version_counts_pending_writes(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        self.db.add_message(conversation_id, ConversationRole.User, "Hello!")
+        pending = self.db.get_messages_version(conversation_id)
+
+        self.db.flush()
+
+        self.assertEqual(pending, (0, 1))
+        self.assertEqual(self.db.get_messages_version(conversation_id), pending)
+
+    def test_full_batch_is_written(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        for content in ["Hello!", "你好！", "Thanks"]:
+            self.db.add_message(conversation_id, ConversationRole.User, content)
+
+        self.assertTrue(self.queue.wait(3, timeout=5))
+        self.assertEqual(self.db.messages.count_documents({}), 3)
+        document = self.db.conversations.find_one()
+        self.assertEqual(document["next_position"], 3)
+
+    def test_delete_writes_pending_first(self):
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        for content in ["Hello!", "你好！"]:
+            self.db.add_message(conversation_id, ConversationRole.User, content)
+
+        self.db.delete_messages(conversation_id, 1)
+        self.db.add_message(conversation_id, ConversationRole.Assistant, "您好！")
+        self.db.close()
+
+        messages = self.db.get_messages(conversation_id)
+        self.assertEqual([m.content for m in messages], ["Hello!", "您好！"])
+        self.assertEqual([m.position for m in messages], [0, 1])
+
+    def test_flushed_durability_waits_for_write(self):
+        self.queue.durability = FLUSHED
+        self.queue.max_delay_seconds = 0.01
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        self.db.add_message(conversation_id, ConversationRole.User, "Hello!")
+
+        self.assertEqual(self.db.messages.count_documents({}), 1)
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = TeacherDB(
+            mongo_client=mongomock.MongoClient(),
+            conversation_cache=ConversationCache(enabled=False),
+        )
+        return super().setUp()
+
+    def add_conversation(self, messages: int) -> str:
+        conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        for position in range(messages):
+            self.db.add_message(
+                conversation_id,
+                ConversationRole.Assistant,
+                f"Message {position}",
+                sentence_indices=[(0, 9)],
+                learning_phrases=["你好"],
+            )
+        return conversation_id
+
+    def test_conversations_pages_follow_id_order(self):
+        conversation_ids = [self.add_conversation(0) for _ in range(5)]
+
+        first = self.db.get_conversation_memories(limit=2)
+        second = self.db.get_conversation_memories(
+            limit=2, after=first[-1].conversation_id
+        )
+        last = self.db.get_conversation_memories(
+            limit=2, after=second[-1].conversation_id
+        )
+
+        pages = [first, second, last]
+        self.assertEqual(
+            [memory.conversation_id for page in pages for memory in page],
+            conversation_ids,
+        )
+
+    def test_messages_page_after_position(self):
+        conversation_id = self.add_conversation(10)
+
+        with mock.patch.object(
+            self.db.messages, "find", wraps=self.db.messages.find
+        ) as find:
+            messages = self.db.get_messages(conversation_id, after_position=3, limit=4)
+
+        self.assertEqual([m.position for m in messages], [4, 5, 6, 7])
+        query = find.call_args.args[0]
+        self.assertEqual(query["position"], {"$gt": 3})
+
+    def test_content_projection_omits_annotations(self):
+        conversation_id = self.add_conversation(2)
+
+        with mock.patch.object(
+            self.db.messages, "find", wraps=self.db.messages.find
+        ) as find:
+            messages = self.db.get_messages(
+                conversation_id, projection=MessageProjection.Content
+            )
+
+        self.assertEqual([m.content for m in messages], ["Message 0", "Message 1"])
+        self.assertTrue(all(m.sentence_indices is None for m in messages))
+        self.assertTrue(all(m.learning_phrases is None for m in messages))
+        self.assertNotIn("sentence_indices", find.call_args.args[1])
+
+    def test_cached_messages_page_like_mongo(self):
+        conversation_id = self.add_conversation(6)
+        db = TeacherDB(mongo_client=self.db.client)
+        db.get_conversation(conversation_id)
+
+        cached = db.get_messages(
+            conversation_id,
+            after_position=1,
+            limit=3,
+            projection=MessageProjection.Content,
+        )
+
+        self.assertEqual(
+            cached,
+            self.db.get_messages(
+                conversation_id,
+                after_position=1,
+                limit=3,
+                projection=MessageProjection.Content,
+            ),
+        )
+        self.assertEqual(db.conversation_cache.stats()["hits"], 1)
+
+
+class TestConversationLoad(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = TeacherDB(
+            mongo_client=mongomock.MongoClient(),
+            conversation_cache=ConversationCache(enabled=False),
+        )
+        self.conversation_id = self.db.create_conversation(
+            Language.English, Language.Chinese
+        )
+        for position in range(5):
+            self.db.add_message(
+                self.conversation_id,
+                ConversationRole.Assistant,
+                f"Message {position}",
+                sentence_indices=[(0, 9)],
+                learning_phrases=["你好"],
+            )
+        return super().setUp()
+
+    def test_one_aggregation_loads_recent_messages(self):
+        conversation = self.db.conversations.find_one()
+        conversation["messages"] = list(
+            self.db.messages.find({}, {"_id": 0}).sort("position", -1).limit(2)
+        )
+        aggregate = mock.Mock(return_value=iter([conversation]))
+
+        with mock.patch.object(self.db.conversations, "aggregate", aggregate):
+            with mock.patch.object(self.db.messages, "find") as find:
+                memory = self.db.get_conversation(
+                    self.conversation_id, message_limit=2
+                )
+
+        lookup = aggregate.call_args.args[0][-1]["$lookup"]
+        self.assertEqual(lookup["foreignField"], "conversation_id")
+        self.assertIn({"$limit": 2}, lookup["pipeline"])
+        find.assert_not_called()
+        self.assertEqual([message.position for message in memory.messages], [3, 4])
+
+    def test_falls_back_to_two_queries(self):
+        memory = self.db.get_conversation(self.conversation_id, message_limit=2)
+
+        self.assertFalse(self.db.lookup_messages)
+        self.assertEqual([message.position for message in memory.messages], [3, 4])
+        memory = self.db.get_conversation(self.conversation_id)
+        self.assertEqual(len(memory.messages), 5)
+
+    def test_transient_failure_falls_back_once(self):
+        for code, lookup_messages in [(50, True), (40324, False)]:
+            self.db.lookup_messages = True
+            aggregate = mock.Mock(
+                side_effect=OperationFailure("aggregate failed", code=code)
+            )
+
+            with mock.patch.object(self.db.conversations, "aggregate", aggregate):
+                memory = self.db.get_conversation(self.conversation_id)
+
+            self.assertEqual(len(memory.messages), 5)
+            self.assertEqual(self.db.lookup_messages, lookup_messages)
+
+    def test_loaded_messages_equal_mapped(self):
+        for document in self.db.messages.find({}, {"_id": 0}):
+            self.assertEqual(
+                TeacherDB._load_message(document),
+                TeacherDB._map_to_conversation_message(document),
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
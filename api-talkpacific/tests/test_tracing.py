@@ -0,0 +1,114 @@
+import json
+import unittest
+import mongomock
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific import main
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import TeacherDB
+from api_talkpacific.tracing import NULL_SPAN, OpenTelemetryExporter, Tracer
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_traceparent_continues_the_trace(self):
+        tracer = Tracer(sample_rate=0)
+
+        trace = tracer.start("send_message", f"00-{TRACE_ID}-00f067aa0ba902b7-01")
+
+        self.assertEqual(trace.trace_id, TRACE_ID)
+        self.assertEqual(trace.parent_span_id, "00f067aa0ba902b7")
+        self.assertTrue(trace.sampled)
+
+    def test_unsampled_trace_records_nothing(self):
+        tracer = Tracer(sample_rate=0, exporter=RecordingExporter())
+
+        trace = tracer.start("send_message", f"00-{TRACE_ID}-00f067aa0ba902b7-00")
+        trace.mark("first_token")
+        tracer.finish(trace)
+
+        self.assertFalse(trace.sampled)
+        self.assertIs(trace.span("history_load"), NULL_SPAN)
+        self.assertEqual(trace.spans, [])
+        self.assertEqual(tracer.exporter.traces, [])
+
+    def test_opentelemetry_export(self):
+        try:
+            exporter = OpenTelemetryExporter()
+        except ImportError:
+            self.skipTest("opentelemetry is not installed")
+        trace = Tracer(sample_rate=1).start("send_message")
+        with trace.span("history_load"):
+            trace.mark("first_token")
+        trace.end()
+
+        exporter.export(trace)
+
+
+class TestDebugTimings(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.coach = LanguageCoach(
+            llm=FakeListChatModel(responses=["Hello there. 你好!"]),
+            teacher_db=TeacherDB(mongo_client=mongomock.MongoClient()),
+            language_detector=ScriptLanguageDetector(),
+        )
+        self.exporter = RecordingExporter()
+        self.previous = main.languageCoach, main.tracer
+        main.languageCoach = self.coach
+        main.tracer = Tracer(debug=True, exporter=self.exporter)
+        self.client = TestClient(main.app)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        main.languageCoach, main.tracer = self.previous
+        self.coach.close()
+        return super().tearDown()
+
+    def test_final_chunk_has_timings(self):
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+
+        response = self.client.get(
+            "/send-message",
+            params={"conversation_id": conversation_id, "message": "hello"},
+            headers={"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-00"},
+        )
+        frames = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+
+        self.assertEqual(response.headers["X-Trace-Id"], TRACE_ID)
+        self.assertTrue(all("timings" not in frame for frame in frames[:-1]))
+        self.assertCountEqual(
+            frames[-1]["timings"],
+            [
+                "history_load",
+                "prompt_build",
+                "first_token",
+                "stream_end",
+                "segmentation",
+                "detection",
+                "teacher_db.add_message",
+            ],
+        )
+        self.assertEqual([trace.trace_id for trace in self.exporter.traces], [TRACE_ID])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import mongomock
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from api_talkpacific import main
+from api_talkpacific.conversation_cache import ConversationCache
+from api_talkpacific.language_coach import LanguageCoach
+from api_talkpacific.models import Language
+from api_talkpacific.script_detector import ScriptLanguageDetector
+from api_talkpacific.teacher_db import ConversationRole, TeacherDB
+from api_talkpacific.transfer import (
+    export_file,
+    export_ndjson,
+    import_file,
+    import_ndjson,
+)
+
+
+def teacher_db() -> TeacherDB:
+    return TeacherDB(
+        mongo_client=mongomock.MongoClient(),
+        conversation_cache=ConversationCache(enabled=False),
+    )
+
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = teacher_db()
+        self.conversation_ids = []
+        for count in [3, 0, 2]:
+            conversation_id = self.db.create_conversation(
+                Language.English, Language.Chinese
+            )
+            for position in range(count):
+                self.db.add_message(
+                    conversation_id,
+                    ConversationRole.Assistant,
+                    f"Message {position}, 你好!",
+                    sentence_indices=[(0, 10), (11, 14)],
+                    learning_phrases=["你好"],
+                )
+            self.conversation_ids.append(conversation_id)
+        self.db.update_summary(self.conversation_ids[0], "Greetings.", 1)
+        self.db.messages.insert_one(
+            {"conversation_id": "orphan", "position": 0, "role": "user"}
+        )
+        return super().setUp()
+
+    def export_lines(self, **kwargs) -> list:
+        data = b"".join(export_ndjson(self.db, **kwargs))
+        return data.splitlines(keepends=True)
+
+    def test_export_follows_conversation_order(self):
+        records = [json.loads(line) for line in self.export_lines()]
+
+        self.assertEqual(
+            [(record["type"], record["conversation_id"]) for record in records],
+            [
+                ("conversation", self.conversation_ids[0]),
+                ("message", self.conversation_ids[0]),
+                ("message", self.conversation_ids[0]),
+                ("message", self.conversation_ids[0]),
+                ("conversation", self.conversation_ids[1]),
+                ("conversation", self.conversation_ids[2]),
+                ("message", self.conversation_ids[2]),
+                ("message", self.conversation_ids[2]),
+            ],
+        )
+        self.assertEqual(records[0]["summary"], "Greetings.")
+        self.assertEqual(records[1]["content"], "Message 0, 你好!")
+
+    def test_import_round_trips(self):
+        imported = teacher_db()
+
+        stats = import_ndjson(imported, self.export_lines())
+
+        self.assertEqual((stats.conversations, stats.messages), (3, 5))
+        for conversation_id in self.conversation_ids:
+            self.assertEqual(
+                imported.get_conversation(conversation_id),
+                self.db.get_conversation(conversation_id),
+            )
+        imported.add_message(self.conversation_ids[0], ConversationRole.User, "Hi")
+        messages = imported.get_messages(self.conversation_ids[0])
+        self.assertEqual([message.position for message in messages], [0, 1, 2, 3])
+
+    def test_gzip_file_round_trips(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "conversations.ndjson.gz")
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(os.remove, path)
+        imported = teacher_db()
+
+        export_file(self.db, path, self.conversation_ids[2])
+        stats = import_file(imported, path)
+
+        with gzip.open(path) as file:
+            self.assertEqual(len(file.readlines()), 3)
+        self.assertEqual((stats.conversations, stats.messages), (1, 2))
+
+    def test_unknown_record_is_rejected(self):
+        with self.assertRaises(ValueError):
+            import_ndjson(teacher_db(), [b'{"type": "summary"}\n'])
+
+
+class TestExportEndpoint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.coach = LanguageCoach(
+            llm=FakeListChatModel(responses=["Hello there."]),
+            teacher_db=teacher_db(),
+            language_detector=ScriptLanguageDetector(),
+        )
+        self.previous = main.languageCoach
+        main.languageCoach = self.coach
+        self.client = TestClient(main.app)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        main.languageCoach = self.previous
+        self.coach.close()
+        return super().tearDown()
+
+    def test_gzip_export(self):
+        conversation_id = self.coach.create_conversation(
+            Language.English, Language.Chinese
+        )
+        self.coach.teacher_db.add_message(
+            conversation_id, ConversationRole.User, "Hello!"
+        )
+
+        response = self.client.get("/export", params={"gzip": True})
+        lines = gzip.decompress(response.content).splitlines()
+
+        self.assertEqual(response.headers["content-type"], "application/gzip")
+        types = [json.loads(line)["type"] for line in lines]
+        self.assertEqual(types, ["conversation", "message"])
+        self.assertEqual(
+            self.client.get("/export", params={"conversation_id": "x"}).status_code,
+            400,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()